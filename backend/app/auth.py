@@ -16,6 +16,9 @@ behaviour.  See `.env.example` for examples.
 SUPABASE_JWT_JWKS_URL   URL pointing to the Supabase project's JWKS endpoint.
 SUPABASE_JWT_AUDIENCE    (optional) Expected audience value for tokens.
 SUPABASE_JWT_ISSUER      (optional) Expected issuer value for tokens.
+SUPABASE_JWKS_CACHE_TTL  (optional) Seconds to keep fetched keys (default 3600).
+SUPABASE_JWT_CACHE_SIZE  (optional) Number of verified tokens to cache (default 10000).
+ADMIN_USER_IDS           (optional) Comma-separated user IDs allowed to use admin endpoints.
 ```
 
 If `SUPABASE_JWT_JWKS_URL` is not provided, tokens will be decoded
@@ -23,18 +26,25 @@ without signature verification.  This should only be used in local
 development.
 """
 
+from collections import OrderedDict
 from functools import lru_cache
-from typing import Optional
+from typing import Dict, Optional, Tuple
+import hashlib
+import logging
 import os
+import threading
+import time
 
 import requests
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from . import models
-from .database import get_db
+from . import crud, metrics, models
+from .cache import search_cache, user_cache
+from .database import get_write_db
 
 
 # Fetch configuration from environment variables.  These variables can
@@ -43,6 +53,28 @@ JWKS_URL: Optional[str] = os.getenv("SUPABASE_JWT_JWKS_URL")
 JWT_AUDIENCE: Optional[str] = os.getenv("SUPABASE_JWT_AUDIENCE")
 JWT_ISSUER: Optional[str] = os.getenv("SUPABASE_JWT_ISSUER")
 
+# JWKS caching.  Keys are kept for `SUPABASE_JWKS_CACHE_TTL` seconds and
+# refreshed in the background once they reach `SUPABASE_JWKS_REFRESH_AHEAD`
+# of that lifetime.  Lookups for an unknown key ID trigger a refetch at
+# most once every `SUPABASE_JWKS_MIN_REFETCH_INTERVAL` seconds.
+JWKS_CACHE_TTL = float(os.getenv("SUPABASE_JWKS_CACHE_TTL", "3600"))
+JWKS_REFRESH_AHEAD = float(os.getenv("SUPABASE_JWKS_REFRESH_AHEAD", "0.8"))
+JWKS_MIN_REFETCH_INTERVAL = float(os.getenv("SUPABASE_JWKS_MIN_REFETCH_INTERVAL", "30"))
+
+# Verified-token cache.  Up to `SUPABASE_JWT_CACHE_SIZE` decoded payloads
+# are kept until the token's `exp` claim or for at most
+# `SUPABASE_JWT_CACHE_MAX_AGE` seconds, whichever comes first.  Set the
+# size to 0 to disable the cache.
+TOKEN_CACHE_SIZE = int(os.getenv("SUPABASE_JWT_CACHE_SIZE", "10000"))
+TOKEN_CACHE_MAX_AGE = float(os.getenv("SUPABASE_JWT_CACHE_MAX_AGE", "300"))
+
+# Users allowed to call the admin endpoints (e.g. the support team).
+ADMIN_USER_IDS = frozenset(
+    user_id.strip() for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()
+)
+
+logger = logging.getLogger(__name__)
+
 # Configure the OAuth2 scheme to extract bearer tokens from incoming
 # requests.  Since we do not provide our own token endpoint, the
 # `tokenUrl` parameter is set to a dummy value.
@@ -53,18 +85,36 @@ class JWKSClient:
     """Client for retrieving and caching JSON Web Keys (JWKs).
 
     Supabase exposes a JWKS endpoint that lists the public keys used
-    to sign authentication tokens.  This client fetches the keys
-    once and caches them for subsequent verifications.  If the keys
-    rotate, you should restart the application or invalidate the
-    cache to fetch the new set.
+    to sign authentication tokens.  Keys are indexed by their key ID
+    (``kid``) and kept for ``ttl`` seconds.  Once a key set is older
+    than ``refresh_ahead * ttl`` it is refreshed on a background thread
+    so that request handlers never wait on the network in the common
+    case.  A token signed with an unknown ``kid`` (e.g. right after a
+    key rotation) triggers a single synchronous refetch; concurrent
+    callers share that fetch instead of each issuing their own.
     """
 
-    def __init__(self, jwks_url: str):
+    def __init__(
+        self,
+        jwks_url: str,
+        ttl: float = JWKS_CACHE_TTL,
+        refresh_ahead: float = JWKS_REFRESH_AHEAD,
+        min_refetch_interval: float = JWKS_MIN_REFETCH_INTERVAL,
+    ):
         self.jwks_url = jwks_url
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.min_refetch_interval = min_refetch_interval
+        self._keys: Dict[str, dict] = {}
+        self._fetched_at: Optional[float] = None
+        self._last_forced_refetch: Optional[float] = None
+        self._fetch_lock = threading.Lock()
+        self._background_refresh: Optional[threading.Thread] = None
+        self.fetches = 0
+        self.fetch_seconds = 0.0
 
-    @lru_cache(maxsize=1)
-    def get_keys(self):
-        """Retrieve the JWKS from the configured URL."""
+    def fetch_keys(self) -> Dict[str, dict]:
+        """Retrieve the JWKS from the configured URL, indexed by ``kid``."""
         try:
             response = requests.get(self.jwks_url, timeout=5)
             response.raise_for_status()
@@ -74,38 +124,193 @@ class JWKSClient:
         keys = jwks.get("keys")
         if not keys:
             raise RuntimeError("Invalid JWKS format: missing 'keys'")
-        return keys
+        return {key["kid"]: key for key in keys if key.get("kid")}
 
-    def get_key(self, kid: str) -> Optional[dict]:
-        """Find the JWK matching the given key ID (kid)."""
-        for key in self.get_keys():
-            if key.get("kid") == kid:
-                return key
-        return None
+    def _load(self) -> None:
+        start = time.perf_counter()
+        try:
+            with metrics.timed("jwks"):
+                self._keys = self.fetch_keys()
+        finally:
+            self.fetches += 1
+            self.fetch_seconds += time.perf_counter() - start
+        self._fetched_at = time.monotonic()
 
+    def stats(self) -> Dict[str, float]:
+        """Return the number of JWKS fetches and the time spent on them."""
+        return {
+            "keys": len(self._keys),
+            "fetches": self.fetches,
+            "fetch_seconds": self.fetch_seconds,
+        }
 
-def decode_supabase_token(token: str) -> dict:
-    """Decode and optionally verify a Supabase JWT.
+    def refresh(self) -> None:
+        """Fetch the key set, sharing the request with concurrent callers.
 
-    If a JWKS URL is configured, the token's signature is verified
-    against the corresponding public key.  Otherwise, the token is
-    decoded without signature verification (development only).
+        Callers that were blocked while another thread fetched the keys
+        return as soon as that fetch completes rather than issuing a
+        second request.
+        """
+        requested_at = time.monotonic()
+        with self._fetch_lock:
+            if self._fetched_at is not None and self._fetched_at >= requested_at:
+                return
+            self._load()
 
-    Returns the decoded payload on success or raises an HTTPException
-    with status 401 on failure.
+    def _refresh_quietly(self) -> None:
+        try:
+            self.refresh()
+        except RuntimeError as exc:
+            # Keep serving the current keys; the next request past the
+            # TTL retries synchronously.
+            logger.warning("Background JWKS refresh failed: %s", exc)
+
+    def _schedule_refresh(self) -> None:
+        thread = self._background_refresh
+        if thread is not None and thread.is_alive():
+            return
+        thread = threading.Thread(
+            target=self._refresh_quietly, name="jwks-refresh", daemon=True
+        )
+        self._background_refresh = thread
+        thread.start()
+
+    def get_key(self, kid: Optional[str]) -> Optional[dict]:
+        """Return the JWK matching the given key ID (kid), if any."""
+        if self._fetched_at is None or time.monotonic() - self._fetched_at >= self.ttl:
+            self.refresh()
+        elif time.monotonic() - self._fetched_at >= self.ttl * self.refresh_ahead:
+            self._schedule_refresh()
+        if not kid:
+            return None
+        key = self._keys.get(kid)
+        if key is None:
+            # Unknown kid: the keys may have rotated.  Waiting on the lock
+            # lets concurrent callers share a fetch that is already in
+            # flight.  A new fetch is issued at most once per
+            # `min_refetch_interval` so that tokens carrying bogus key IDs
+            # cannot be used to hammer the JWKS endpoint.
+            with self._fetch_lock:
+                key = self._keys.get(kid)
+                now = time.monotonic()
+                last = self._last_forced_refetch
+                if key is None and (last is None or now - last >= self.min_refetch_interval):
+                    self._last_forced_refetch = now
+                    self._load()
+                    key = self._keys.get(kid)
+        return key
+
+
+@lru_cache(maxsize=None)
+def get_jwks_client(jwks_url: str) -> JWKSClient:
+    """Return the process-wide JWKS client for ``jwks_url``."""
+    return JWKSClient(jwks_url)
+
+
+class TokenCache:
+    """Bounded LRU cache of verified JWT payloads.
+
+    Entries are keyed by a SHA-256 digest of the raw token so that the
+    tokens themselves are never held in memory longer than needed.  A
+    cached payload is only returned while it is still valid: entries
+    expire at the token's `exp` claim or `max_age` seconds after they
+    were stored, whichever comes first.
     """
-    credentials_exception = HTTPException(
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE, max_age: float = TOKEN_CACHE_MAX_AGE):
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self._entries: "OrderedDict[bytes, Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        """Return the cached payload for ``token`` or None on a miss."""
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def peek(self, token: str) -> Optional[dict]:
+        """Like `get`, but leave the hit/miss counters and LRU order alone.
+
+        For callers that only look at the payload (such as the rate
+        limiter), so that the cache statistics still describe token
+        verification.
+        """
+        with self._lock:
+            entry = self._entries.get(self._key(token))
+        if entry is None or entry[0] <= time.time():
+            return None
+        return entry[1]
+
+    def put(self, token: str, payload: dict) -> None:
+        """Store a verified payload, evicting the least recently used entry if full."""
+        if self.maxsize <= 0:
+            return
+        expires_at = time.time() + self.max_age
+        exp = payload.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit, miss and eviction counters along with the current size."""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Shared by every request handled by this process.
+token_cache = TokenCache()
+
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def _verify_supabase_token(token: str) -> dict:
+    """Decode and verify a token without consulting `token_cache`."""
+    credentials_exception = _credentials_exception()
     try:
         unverified_header = jwt.get_unverified_header(token)
     except JWTError:
         raise credentials_exception
 
     if JWKS_URL:
-        client = JWKSClient(JWKS_URL)
+        client = get_jwks_client(JWKS_URL)
         key = client.get_key(unverified_header.get("kid"))
         if not key:
             raise credentials_exception
@@ -130,8 +335,43 @@ def decode_supabase_token(token: str) -> dict:
     return payload
 
 
+def decode_supabase_token(token: str) -> dict:
+    """Decode and optionally verify a Supabase JWT.
+
+    If a JWKS URL is configured, the token's signature is verified
+    against the corresponding public key.  Otherwise, the token is
+    decoded without signature verification (development only).
+
+    Successfully decoded payloads are kept in `token_cache`, so repeat
+    requests with the same token skip header parsing and signature
+    verification entirely.
+
+    Returns the decoded payload on success or raises an HTTPException
+    with status 401 on failure.
+    """
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = _verify_supabase_token(token)
+        token_cache.put(token, payload)
+    return payload
+
+
+async def decode_supabase_token_async(token: str) -> dict:
+    """Asyncio variant of `decode_supabase_token`.
+
+    Cache hits are answered inline.  On a miss, verification (which may
+    need to fetch the JWKS over the network) runs in the threadpool so
+    that it does not block the event loop.
+    """
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = await run_in_threadpool(_verify_supabase_token, token)
+        token_cache.put(token, payload)
+    return payload
+
+
 async def get_current_user(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_write_db)
 ) -> models.User:
     """Retrieve the current user based on the provided bearer token.
 
@@ -139,8 +379,17 @@ async def get_current_user(
     optionally the email address.  A corresponding local user record
     is returned.  If the user does not already exist in the local
     database, a new record is created with the given ID and email.
+
+    Known users are served from `user_cache` without touching the
+    database.  The time spent here is reported as the request's
+    ``auth`` phase (see `metrics`).
     """
-    payload = decode_supabase_token(token)
+    with metrics.timed("auth"):
+        return await _current_user(token, db)
+
+
+async def _current_user(token: str, db: AsyncSession) -> models.User:
+    payload = await decode_supabase_token_async(token)
     user_id: Optional[str] = payload.get("sub")
     email: Optional[str] = payload.get("email")
     if not user_id:
@@ -150,11 +399,24 @@ async def get_current_user(
             detail="Invalid authentication token",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
     # Look up the user locally; create a placeholder if not found
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = await crud.get_user(db, user_id)
     if user is None:
-        user = models.User(id=user_id, email=email, username=None)
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-    return user
\ No newline at end of file
+        await crud.ensure_users(db, [(user_id, email)])
+        await db.commit()
+        if email:
+            # The new user may match cached searches on their email.
+            search_cache.invalidate_user(user_id, email)
+        user = await crud.get_user(db, user_id)
+    user_cache.put(user)
+    return user
+
+
+async def get_admin_user(user: models.User = Depends(get_current_user)) -> models.User:
+    """Like `get_current_user`, but only for users listed in `ADMIN_USER_IDS`."""
+    if user.id not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return user
@@ -0,0 +1,305 @@
+"""
+In-process caches shared by the request handlers.
+
+The caches in this module live for the lifetime of a worker process and
+are never shared between processes, so every entry is bounded in size
+and (where the underlying data can change) in age.  They trade a small,
+bounded amount of staleness for skipping database round-trips on the
+hot request path.
+
+Configuration
+-------------
+```
+USER_CACHE_SIZE     Maximum number of user rows / known user IDs kept (default 10000).
+USER_CACHE_TTL      Seconds a cached user row is trusted (default 60).
+SEARCH_CACHE_SIZE   Maximum number of user search results kept (default 1000, 0 disables).
+SEARCH_CACHE_TTL    Seconds a cached search result is trusted (default 30).
+```
+"""
+
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import os
+import string
+import threading
+import time
+
+from . import models
+
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1000"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "30"))
+
+
+class UserCache:
+    """LRU cache of user rows and of user IDs known to exist locally.
+
+    `get_current_user` consults the row cache so that known users cost no
+    database round-trip, and the endpoints that create placeholder users
+    consult the set of known IDs to skip the upsert entirely.  Cached
+    rows are detached copies, so handlers can never accidentally flush
+    changes to a shared object; `crud.update_user` invalidates the entry
+    for the user it changes.  Known IDs never expire because users are
+    never deleted.
+    """
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._rows: "OrderedDict[str, Tuple[float, models.User]]" = OrderedDict()
+        self._known: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str) -> Optional[models.User]:
+        """Return the cached row for ``user_id`` or None on a miss."""
+        with self._lock:
+            entry = self._rows.get(user_id)
+            if entry is not None:
+                expires_at, user = entry
+                if expires_at > time.monotonic():
+                    self._rows.move_to_end(user_id)
+                    self.hits += 1
+                    return user
+                del self._rows[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, user: models.User) -> None:
+        """Cache a detached copy of ``user`` and remember its ID."""
+        if self.maxsize <= 0:
+            return
+        copy = models.User(id=user.id, username=user.username, email=user.email)
+        with self._lock:
+            self._rows[user.id] = (time.monotonic() + self.ttl, copy)
+            self._rows.move_to_end(user.id)
+            while len(self._rows) > self.maxsize:
+                self._rows.popitem(last=False)
+        self.mark_known(user.id)
+
+    def invalidate(self, user_id: str) -> None:
+        """Drop the cached row for ``user_id`` (it remains a known ID)."""
+        with self._lock:
+            self._rows.pop(user_id, None)
+
+    def mark_known(self, *user_ids: str) -> None:
+        """Record that rows for ``user_ids`` exist in the database.
+
+        Only call this once the transaction that created them has been
+        committed.
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            for user_id in user_ids:
+                self._known[user_id] = None
+                self._known.move_to_end(user_id)
+            while len(self._known) > self.maxsize:
+                self._known.popitem(last=False)
+
+    def unknown(self, user_ids: Iterable[str]) -> List[str]:
+        """Return the subset of ``user_ids`` not known to exist."""
+        with self._lock:
+            return [user_id for user_id in user_ids if user_id not in self._known]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rows.clear()
+            self._known.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._rows),
+                "known_ids": len(self._known),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# (id, username, email) of a user found by a search.
+SearchRow = Tuple[str, Optional[str], Optional[str]]
+
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def ascii_lower(value: str) -> str:
+    """Lower-case ASCII letters only, as SQLite's ``lower()`` does."""
+    return value.translate(_ASCII_LOWER)
+
+
+def search_rank(
+    query: str,
+    username: Optional[str],
+    email: Optional[str],
+    lower: Callable[[str], str] = str.lower,
+) -> Optional[int]:
+    """Rank of a user for the lower-cased ``query``, as `crud.search_users` ranks it.
+
+    0 for an exact match of either field, 1 for a prefix match, 2 for
+    any other substring match; None if the user does not match.
+    ``lower`` is the database's ``lower()`` (`ascii_lower` on SQLite).
+    """
+    best = None
+    for value in (username, email):
+        if not value:
+            continue
+        value = lower(value)
+        if value.startswith(query):
+            rank = 0 if value == query else 1
+        elif query in value:
+            rank = 2
+        else:
+            continue
+        best = rank if best is None else min(best, rank)
+    return best
+
+
+def search_order(query: str, row: SearchRow, lower: Callable[[str], str] = str.lower):
+    """Sort key reproducing the ordering of `crud.search_users`."""
+    user_id, username, email = row
+    # NULL usernames first, as SQLite sorts them (`crud.search_users` asks
+    # every database for that order); the ID breaks the remaining ties.
+    rank = search_rank(query, username, email, lower)
+    return (rank, username is not None, lower(username or ""), user_id)
+
+
+class SearchCache:
+    """LRU cache of user search results, keyed by the lower-cased query.
+
+    Typing a name fires a search per keystroke, and every match for
+    "alic" is also a match for "ali".  Each entry holds the ranked
+    matches for its query, and is *complete* when it holds all of them
+    (the search found fewer than it asked for).  A query is answered
+    from its own entry or, failing that, from a complete entry for any
+    of its prefixes by filtering and re-ranking the prefix's matches in
+    memory; the result is then cached under the longer query too.
+    Entries hold about a page of matches, so only a prefix with fewer
+    matches than that is complete: the first keystrokes of a name
+    usually miss, and the ones after the query narrows to a page hit.
+    Repeating a recent search always hits.
+
+    Entries expire after ``ttl`` seconds, which bounds how long a change
+    made through another worker, or a new user, can go unnoticed.
+    `crud.update_user` and `auth.get_current_user` (creating a user)
+    drop the entries their committed changes affect in this process.
+    Rows are returned as fresh, detached `models.User` objects.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = SEARCH_CACHE_SIZE,
+        ttl: float = SEARCH_CACHE_TTL,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # query -> (expires at, complete, ranked rows)
+        self._entries: "OrderedDict[str, Tuple[float, bool, List[SearchRow]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+
+    def _entry(self, query: str, now: float) -> Optional[Tuple[float, bool, List[SearchRow]]]:
+        entry = self._entries.get(query)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del self._entries[query]
+            return None
+        self._entries.move_to_end(query)
+        return entry
+
+    def _store(self, query: str, complete: bool, rows: List[SearchRow], now: float) -> None:
+        self._entries[query] = (now + self.ttl, complete, rows)
+        self._entries.move_to_end(query)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(
+        self, query: str, count: int, lower: Callable[[str], str] = str.lower
+    ) -> Optional[List[models.User]]:
+        """Return the ranked matches for ``query``, or None on a miss.
+
+        At least ``count`` matches are returned unless the query has
+        fewer; an entry holding fewer than that, and not complete,
+        counts as a miss.  ``query`` was lower-cased by ``lower``, which
+        is used to match and rank the entry of a prefix (see
+        `search_rank`).
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entry(query, now)
+            if entry is not None and (entry[1] or len(entry[2]) >= count):
+                self.hits += 1
+                return _users(entry[2])
+            for end in range(len(query) - 1, 0, -1):
+                entry = self._entry(query[:end], now)
+                if entry is not None and entry[1]:
+                    rows = [
+                        row for row in entry[2]
+                        if search_rank(query, *row[1:], lower) is not None
+                    ]
+                    rows.sort(key=lambda row: search_order(query, row, lower))
+                    self._store(query, True, rows, now)
+                    self.prefix_hits += 1
+                    return _users(rows)
+            self.misses += 1
+            return None
+
+    def put(self, query: str, users: Iterable[models.User], complete: bool) -> None:
+        """Cache the ranked ``users`` found for ``query``."""
+        if not self.enabled:
+            return
+        rows = [(user.id, user.username, user.email) for user in users]
+        with self._lock:
+            self._store(query, complete, rows, time.monotonic())
+
+    def invalidate_user(self, user_id: str, *values: Optional[str]) -> None:
+        """Drop the entries listing ``user_id`` or matching any of ``values``.
+
+        Pass the user's new username and email: entries for queries they
+        now match may be missing the user.
+        """
+        # Either case folding may have produced the cached queries.
+        values = [lower(value) for value in values if value for lower in (str.lower, ascii_lower)]
+        with self._lock:
+            stale = [
+                query
+                for query, (_, _, rows) in self._entries.items()
+                if any(query in value for value in values)
+                or any(row[0] == user_id for row in rows)
+            ]
+            for query in stale:
+                del self._entries[query]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.prefix_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "prefix_hits": self.prefix_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.prefix_hits) / lookups if lookups else 0.0,
+            }
+
+
+def _users(rows: List[SearchRow]) -> List[models.User]:
+    return [models.User(id=id_, username=username, email=email) for id_, username, email in rows]
+
+
+# Shared by every request handled by this process.
+user_cache = UserCache()
+search_cache = SearchCache()
@@ -4,13 +4,42 @@ CRUD operations for the betting app.
 These helper functions interact with the SQLAlchemy session to create
 and retrieve users and bets.  By centralizing database logic here, we
 keep the endpoint code in `main.py` clean and easy to maintain.
+
+All helpers take an `AsyncSession` and must be awaited, so database
+I/O never blocks the event loop serving the API.
 """
 
-from typing import List, Optional
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+import base64
 
-from sqlalchemy.orm import Session
+from sqlalchemy import (
+    Row,
+    and_,
+    case,
+    column,
+    delete,
+    func,
+    insert,
+    inspect,
+    literal,
+    literal_column,
+    select,
+    table,
+    text,
+    tuple_,
+    union,
+    union_all,
+    update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstrumentedAttribute, aliased
 from . import models, schemas
-from sqlalchemy import func
+from .cache import ascii_lower, search_cache, user_cache
+from .events import hub
+from .graph import friend_graph
 
 
 
@@ -20,16 +49,188 @@ from sqlalchemy import func
 # do not provide a separate create_user function here.
 
 
-def get_user_by_email(db: Session, email: str) -> Optional[models.User]:
-    return db.query(models.User).filter(models.User.email == email).first()
+# Dialect-specific INSERT constructs that support ON CONFLICT clauses.
+_UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def upsert_insert(db: AsyncSession, table):
+    """Return an INSERT construct for ``table`` supporting ``on_conflict_*``."""
+    dialect = db.bind.dialect.name
+    try:
+        return _UPSERT_INSERTS[dialect](table)
+    except KeyError:
+        raise NotImplementedError(f"Upserts are not supported on {dialect!r}") from None
+
+
+async def ensure_users(
+    db: AsyncSession, users: Iterable[Tuple[str, Optional[str]]]
+) -> List[str]:
+    """Create placeholder rows for any of ``users`` that do not exist yet.
+
+    ``users`` is an iterable of ``(id, email)`` pairs.  IDs already known
+    to `user_cache` are skipped; the rest are written with a single
+    ``INSERT ... ON CONFLICT (id) DO NOTHING`` so concurrent first
+    requests cannot race into a duplicate-key error.  The statement is
+    not committed.  Returns the IDs that were sent to the database so the
+    caller can mark them as known once its transaction commits.
+    """
+    emails = dict(users)
+    missing = user_cache.unknown(emails)
+    if not missing:
+        return []
+    stmt = upsert_insert(db, models.User).values(
+        [{"id": user_id, "email": emails[user_id], "username": None} for user_id in missing]
+    )
+    await db.execute(stmt.on_conflict_do_nothing(index_elements=[models.User.id]))
+    return missing
+
+
+# Counters kept in `user_stats`.
+_STATS_COLUMNS = ("wins", "losses", "pending", "active", "net_winnings")
+
+
+def _created_stats(bets: Iterable[models.Bet]) -> Dict[str, Counter]:
+    """Stats deltas for newly created (pending) bets."""
+    deltas: Dict[str, Counter] = defaultdict(Counter)
+    for bet in bets:
+        for participant in {bet.creator_id, bet.opponent_id}:
+            deltas[participant]["pending"] += 1
+    return deltas
+
 
+def _closed_stats(bets: Iterable[models.Bet]) -> Dict[str, Counter]:
+    """Stats deltas for open bets closed without a winner (expired or declined)."""
+    deltas: Dict[str, Counter] = defaultdict(Counter)
+    for bet in bets:
+        for participant in {bet.creator_id, bet.opponent_id}:
+            deltas[participant]["pending"] -= 1
+    return deltas
 
-def get_users(db: Session, skip: int = 0, limit: int = 100) -> List[models.User]:
-    return db.query(models.User).offset(skip).limit(limit).all()
 
+def _accepted_stats(bet: models.Bet) -> Dict[str, Counter]:
+    """Stats deltas for a pending bet becoming active."""
+    deltas: Dict[str, Counter] = defaultdict(Counter)
+    for participant in {bet.creator_id, bet.opponent_id}:
+        deltas[participant].update(pending=-1, active=1)
+    return deltas
 
-def create_bet(
-    db: Session, creator: models.User, bet_in: schemas.BetCreate
+
+def _resolved_stats(
+    bet: models.Bet, winner_id: str, previous: models.BetStatus
+) -> Dict[str, Counter]:
+    """Stats deltas for resolving a bet that was ``previous`` (pending or active).
+
+    A bet against oneself is neither won nor lost: it moves no money.
+    """
+    deltas: Dict[str, Counter] = defaultdict(Counter)
+    for participant in {bet.creator_id, bet.opponent_id}:
+        delta = deltas[participant]
+        delta["pending" if previous == models.BetStatus.PENDING else "active"] -= 1
+        if bet.creator_id == bet.opponent_id:
+            continue
+        if participant == winner_id:
+            delta["wins"] += 1
+            delta["net_winnings"] += bet.wager
+        else:
+            delta["losses"] += 1
+            delta["net_winnings"] -= bet.wager
+    return deltas
+
+
+async def apply_stats(db: AsyncSession, deltas: Dict[str, Counter]) -> None:
+    """Add per-user ``deltas`` to `user_stats` with a single upsert.
+
+    Missing rows are created; existing ones are incremented in place with
+    ``SET wins = wins + excluded.wins`` etc., so concurrent updates never
+    overwrite each other.  The statement is not committed.
+    """
+    if not deltas:
+        return
+    stmt = upsert_insert(db, models.UserStats).values(
+        [
+            {"user_id": user_id, **{name: delta[name] for name in _STATS_COLUMNS}}
+            for user_id, delta in deltas.items()
+        ]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.UserStats.user_id],
+        set_={
+            name: getattr(models.UserStats, name) + getattr(stmt.excluded, name)
+            for name in _STATS_COLUMNS
+        },
+    )
+    await db.execute(stmt)
+
+
+async def bump_versions(
+    db: AsyncSession, user_ids: Iterable[str], include_friends: bool = False
+) -> None:
+    """Increment the `user_versions` counter of every user in ``user_ids``.
+
+    With ``include_friends`` the friends of those users are bumped too
+    (their friend lists embed the users' profiles).  Runs as one upsert
+    and is not committed, so the bump lands with the change it reflects.
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    if include_friends:
+        rows = select(models.Friendship.friend_id, literal(1)).where(
+            models.Friendship.user_id.in_(user_ids)
+        )
+        rows = union(
+            rows, *[select(literal(user_id), literal(1)) for user_id in user_ids]
+        )
+        stmt = upsert_insert(db, models.UserVersion).from_select(["user_id", "version"], rows)
+    else:
+        stmt = upsert_insert(db, models.UserVersion).values(
+            [{"user_id": user_id, "version": 1} for user_id in user_ids]
+        )
+    await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[models.UserVersion.user_id],
+            set_={"version": models.UserVersion.version + 1},
+        )
+    )
+
+
+async def get_version(db: AsyncSession, user_id: str) -> int:
+    """Return the user's data version (see `models.UserVersion`)."""
+    version = await db.scalar(
+        select(models.UserVersion.version).where(models.UserVersion.user_id == user_id)
+    )
+    return version or 0
+
+
+async def get_user(db: AsyncSession, user_id: str) -> Optional[models.User]:
+    return await db.get(models.User, user_id)
+
+
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[models.User]:
+    result = await db.scalars(select(models.User).where(models.User.email == email))
+    return result.first()
+
+
+async def get_users(db: AsyncSession, skip: int = 0, limit: int = 100) -> List[models.User]:
+    result = await db.scalars(select(models.User).offset(skip).limit(limit))
+    return list(result)
+
+
+async def get_recently_active_users(db: AsyncSession, limit: int = 1000) -> List[models.User]:
+    """Return the creators of the ``limit`` most recent bets (distinct users).
+
+    Reads the newest rows of the `bets` primary key, so the cost is
+    independent of the size of the table.
+    """
+    recent = select(models.Bet.creator_id).order_by(models.Bet.id.desc()).limit(limit)
+    result = await db.scalars(
+        select(models.User).where(models.User.id.in_(recent.scalar_subquery()))
+    )
+    return list(result)
+
+
+async def create_bet(
+    db: AsyncSession, creator: models.User, bet_in: schemas.BetCreate
 ) -> models.Bet:
     """Create a new bet between the creator and an opponent."""
     bet = models.Bet(
@@ -38,95 +239,901 @@ def create_bet(
         status=models.BetStatus.PENDING,
         creator_id=creator.id,
         opponent_id=bet_in.opponent_id,
+        deadline=bet_in.deadline,
     )
     db.add(bet)
-    db.commit()
-    db.refresh(bet)
+    await apply_stats(db, _created_stats([bet]))
+    await bump_versions(db, (bet.creator_id, bet.opponent_id))
+    await db.commit()
+    await db.refresh(bet)
+    hub.publish_bets("bet.created", [bet])
     return bet
 
 
-def get_bets_for_user(
-    db: Session, user_id: str, skip: int = 0, limit: int = 100
+def encode_cursor(bet: models.Bet) -> str:
+    """Return an opaque cursor pointing just past ``bet`` in a bet listing."""
+    raw = f"{bet.created_at.isoformat()}|{bet.id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode a cursor produced by `encode_cursor`.
+
+    Raises ValueError if the cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, bet_id = raw.split("|")
+        return datetime.fromisoformat(created_at), int(bet_id)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+async def create_bets(
+    db: AsyncSession, creator: models.User, bets_in: List[schemas.BetCreate]
+) -> List[models.Bet]:
+    """Create several bets from ``creator`` in a single transaction.
+
+    All rows are written with one bulk ``INSERT ... RETURNING`` and a
+    single commit, so the cost barely grows with the size of the batch.
+    The batch is all-or-nothing: if any row fails, nothing is committed.
+    Bets are returned in the order they were given.
+    """
+    if not bets_in:
+        return []
+    created_at = datetime.utcnow()
+    rows = [
+        {
+            "description": bet_in.description,
+            "wager": bet_in.wager,
+            "status": models.BetStatus.PENDING,
+            "creator_id": creator.id,
+            "opponent_id": bet_in.opponent_id,
+            "created_at": created_at,
+            "deadline": bet_in.deadline,
+        }
+        for bet_in in bets_in
+    ]
+    # RETURNING need not follow VALUES order, and SQLAlchemy may split the
+    # rows over several INSERTs.  Asking for parameter order keeps both the
+    # batching and the order, except on SQLite where it would cost one
+    # INSERT per row; there the single writer assigns ascending IDs in
+    # VALUES order, so sorting on the primary key restores it instead.
+    stmt = insert(models.Bet)
+    if db.bind.dialect.name == "sqlite":
+        result = await db.scalars(stmt.returning(models.Bet), rows)
+        bets = sorted(result, key=lambda bet: bet.id)
+    else:
+        result = await db.scalars(
+            stmt.returning(models.Bet, sort_by_parameter_order=True), rows
+        )
+        bets = list(result)
+    await apply_stats(db, _created_stats(bets))
+    await bump_versions(db, {creator.id} | {bet.opponent_id for bet in bets})
+    await db.commit()
+    hub.publish_bets("bet.created", bets)
+    return bets
+
+
+async def get_bets_for_user(
+    db: AsyncSession,
+    user_id: str,
+    skip: int = 0,
+    limit: int = 100,
+    before: Optional[Tuple[datetime, int]] = None,
 ) -> List[models.Bet]:
-    """Return all bets where the user is either the creator or the opponent."""
-    return (
-        db.query(models.Bet)
-        .filter((models.Bet.creator_id == user_id) | (models.Bet.opponent_id == user_id))
-        .order_by(models.Bet.created_at.desc())
+    """Return all bets where the user is either the creator or the opponent.
+
+    Bets are ordered newest first.  ``before`` is a ``(created_at, id)``
+    keyset cursor (see `decode_cursor`); when given, only bets strictly
+    older than it are returned, so every page costs the same no matter
+    how deep it is.  ``skip`` is still honoured for offset pagination.
+
+    Rather than ``creator_id = :u OR opponent_id = :u``, which cannot use
+    an index for the ordering, the query merges two index range scans
+    (one per participant column) with UNION ALL and takes the top rows.
+    """
+    bet = aliased(models.Bet, _bets_for_user_union(user_id, skip, limit, before))
+    result = await db.scalars(
+        select(bet)
+        .order_by(bet.created_at.desc(), bet.id.desc())
         .offset(skip)
         .limit(limit)
-        .all()
     )
+    return list(result)
+
+
+async def get_bet_rows_for_user(
+    db: AsyncSession,
+    user_id: str,
+    fields: Sequence[str],
+    skip: int = 0,
+    limit: int = 100,
+    before: Optional[Tuple[datetime, int]] = None,
+) -> List[Row]:
+    """Like `get_bets_for_user`, but return plain rows of the ``fields`` columns.
+
+    No ORM objects are built, which makes this the cheaper choice when
+    the rows are only going to be serialised (see `serialization`).
+    """
+    merged = _bets_for_user_union(user_id, skip, limit, before, fields)
+    result = await db.execute(
+        select(*(merged.c[field] for field in fields))
+        .order_by(merged.c.created_at.desc(), merged.c.id.desc())
+        .offset(skip)
+        .limit(limit)
+    )
+    return list(result)
+
+
+async def get_bet_history(
+    db: AsyncSession,
+    user_id: str,
+    fields: Sequence[str],
+    limit: int = 100,
+    before: Optional[Tuple[datetime, int]] = None,
+) -> List[Row]:
+    """Return the user's bets across `bets` and `bets_archive`.
+
+    Same ordering and ``before`` keyset cursor as `get_bets_for_user`;
+    the union simply gains one index range scan per participant column
+    of the archive, so a page costs the same whichever table its bets
+    are in.  Returns plain rows of the ``fields`` columns.
+    """
+    merged = _bets_for_user_union(
+        user_id, 0, limit, before, fields, sources=(models.Bet, models.BetArchive)
+    )
+    result = await db.execute(
+        select(*(merged.c[field] for field in fields))
+        .order_by(merged.c.created_at.desc(), merged.c.id.desc())
+        .limit(limit)
+    )
+    return list(result)
+
+
+def _bets_for_user_union(
+    user_id: str,
+    skip: int,
+    limit: int,
+    before: Optional[Tuple[datetime, int]],
+    fields: Optional[Sequence[str]] = None,
+    sources: Sequence[type] = (models.Bet,),
+):
+    """The UNION ALL subquery behind `get_bets_for_user` (see there).
+
+    Selects every `Bet` column, or only ``fields`` plus the ordering keys,
+    from each of the ``sources`` tables (which must share `Bet`'s columns).
+    """
+    fetch = skip + limit
+    names = None if fields is None else dict.fromkeys([*fields, "created_at", "id"])
+
+    def side(source, column, *criteria):
+        columns = [source] if names is None else [getattr(source, name) for name in names]
+        query = select(*columns).where(column == user_id, *criteria)
+        if before is not None:
+            query = query.where(tuple_(source.created_at, source.id) < tuple_(*before))
+        query = query.order_by(source.created_at.desc(), source.id.desc()).limit(fetch)
+        return select(query.subquery())
+
+    sides = []
+    for source in sources:
+        sides.append(side(source, source.creator_id))
+        # Bets against oneself are already produced by the creator side.
+        sides.append(side(source, source.opponent_id, source.creator_id != user_id))
+    return union_all(*sides).subquery()
+
+
+async def stream_bet_rows(
+    db: AsyncSession,
+    fields: Sequence[str],
+    user_id: Optional[str] = None,
+    batch_size: int = 1000,
+) -> AsyncIterator[Sequence[Row]]:
+    """Yield the ``fields`` columns of bets, ``batch_size`` rows at a time.
+
+    Covers both `bets` and `bets_archive`: every bet involving
+    ``user_id`` ordered oldest first, or every bet in ID order when
+    ``user_id`` is None.  Either way the tables are combined by one
+    ``UNION ALL ... ORDER BY``; in ID order, SQLite and Postgres merge
+    the two primary key scans rather than sort the whole table.  Rows
+    are fetched from a server-side cursor, so only one batch is ever
+    held in memory however many bets there are.
+    """
+    names = dict.fromkeys([*fields, "created_at", "id"])
+    sides = []
+    for source in (models.BetArchive, models.Bet):
+        columns = [getattr(source, name) for name in names]
+        if user_id is None:
+            sides.append(select(*columns))
+            continue
+        sides.append(select(*columns).where(source.creator_id == user_id))
+        sides.append(
+            select(*columns).where(source.opponent_id == user_id, source.creator_id != user_id)
+        )
+    merged = union_all(*sides).subquery()
+    order = [merged.c.id] if user_id is None else [merged.c.created_at, merged.c.id]
+    statement = select(*(merged.c[field] for field in fields)).order_by(*order)
+    result = await db.stream(statement.execution_options(yield_per=batch_size))
+    async for partition in result.partitions():
+        yield partition
+
+
+async def expire_bets(db: AsyncSession, now: datetime, limit: int = 500) -> List[models.Bet]:
+    """Expire up to ``limit`` pending bets whose deadline is before ``now``.
+
+    One set-based ``UPDATE ... WHERE id IN (SELECT ... LIMIT n)
+    RETURNING`` flips the batch, found through the (status, deadline)
+    index, without loading the rows first; the pending-status check is
+    repeated in the UPDATE itself, so a bet accepted or resolved
+    concurrently is left alone.  The participants' `pending` counts and
+    data versions are updated and ``bet.expired`` events are published.
+    Everything is committed as one short transaction.  Returns the
+    expired bets; call repeatedly until fewer than ``limit`` come back.
+    """
+    overdue = (
+        select(models.Bet.id)
+        .where(models.Bet.status == models.BetStatus.PENDING, models.Bet.deadline < now)
+        .order_by(models.Bet.deadline)
+        .limit(limit)
+    )
+    result = await db.scalars(
+        update(models.Bet)
+        .where(models.Bet.id.in_(overdue.scalar_subquery()))
+        .where(models.Bet.status == models.BetStatus.PENDING)
+        .values(status=models.BetStatus.EXPIRED)
+        .returning(models.Bet)
+        .execution_options(synchronize_session=False, populate_existing=True)
+    )
+    bets = sorted(result, key=lambda bet: bet.id)
+    if not bets:
+        await db.rollback()
+        return []
+    stats = _closed_stats(bets)
+    await apply_stats(db, stats)
+    await bump_versions(db, stats)
+    await db.commit()
+    hub.publish_bets("bet.expired", bets)
+    return bets
+
+
+async def archive_bets(db: AsyncSession, closed_before: datetime, limit: int = 500) -> int:
+    """Move up to ``limit`` bets closed before ``closed_before`` to the archive.
+
+    Bets count as closed when resolved (as of `resolved_at`) or expired
+    (as of their deadline).  The chunk is copied to `bets_archive` and
+    deleted from `bets` in one short transaction, so a bet is always in
+    exactly one of the tables and writers are never blocked for long;
+    call repeatedly until it returns less than ``limit`` to archive
+    everything eligible.  The chunk is picked inside the ``INSERT ...
+    SELECT``, so the transaction starts with a write: a separate read
+    first could not be upgraded to a write on SQLite once another writer
+    had committed.  The participants' data versions are bumped, since
+    the bets leave their `/bets` listing.  Returns the number of bets
+    moved.
+    """
+    # One branch per status, so that each is a range scan of its own index.
+    branches = [
+        select(
+            select(models.Bet.id)
+            .where(models.Bet.status == status, closed_at < closed_before)
+            .order_by(closed_at)
+            .limit(limit)
+            .subquery()
+        )
+        for status, closed_at in (
+            (models.BetStatus.RESOLVED, models.Bet.resolved_at),
+            (models.BetStatus.EXPIRED, models.Bet.deadline),
+        )
+    ]
+    chunk = select(union_all(*branches).subquery()).limit(limit)
+    columns = [column.key for column in models.BetArchive.__table__.columns]
+    moved = await db.execute(
+        insert(models.BetArchive)
+        .from_select(
+            columns,
+            select(*(models.Bet.__table__.c[name] for name in columns)).where(
+                models.Bet.id.in_(chunk)
+            ),
+        )
+        .returning(
+            models.BetArchive.id, models.BetArchive.creator_id, models.BetArchive.opponent_id
+        )
+    )
+    ids, user_ids = [], set()
+    for bet_id, creator_id, opponent_id in moved:
+        ids.append(bet_id)
+        user_ids.update((creator_id, opponent_id))
+    if not ids:
+        await db.rollback()
+        return 0
+    await db.execute(
+        delete(models.Bet)
+        .where(models.Bet.id.in_(ids))
+        .execution_options(synchronize_session=False)
+    )
+    await bump_versions(db, user_ids)
+    await db.commit()
+    return len(ids)
+
+
+async def get_bet(db: AsyncSession, bet_id: int) -> Optional[models.Bet]:
+    return await db.get(models.Bet, bet_id)
+
+
+async def settle_bets(
+    db: AsyncSession,
+    resolutions: Iterable[Tuple[int, str, str]],
+    actor_id: Optional[str] = None,
+) -> List[models.Bet]:
+    """Resolve many bets at once and move the wagered currency.
+
+    ``resolutions`` is an iterable of ``(bet_id, winner_id, result)``.
+    Everything happens in one transaction using a fixed number of
+    statements, no matter how many bets are settled:
+
+    1. a conditional ``UPDATE bets ... RETURNING`` per open status
+       (pending, then active) resolves every bet still in it, whose
+       winner is one of its participants and (when ``actor_id`` is given)
+       in which the actor takes part; one statement per status tells
+       which stats counter each bet leaves;
+    2. one bulk insert appends a ledger entry per participant;
+    3. one upsert applies ``balance = balance + :delta`` per user;
+    4. one upsert updates `user_stats`.
+
+    Because the status check happens inside the UPDATE, concurrent
+    resolves of the same bet cannot both succeed, so money is never moved
+    twice.  Bets that do not qualify are skipped; the resolved bets are
+    returned ordered by ID.
+    """
+    resolutions = {bet_id: (winner_id, result) for bet_id, winner_id, result in resolutions}
+    if not resolutions:
+        return []
+    winner = case(
+        {bet_id: winner_id for bet_id, (winner_id, _) in resolutions.items()},
+        value=models.Bet.id,
+    )
+    outcome = case(
+        {bet_id: result for bet_id, (_, result) in resolutions.items()},
+        value=models.Bet.id,
+    )
+    criteria = [
+        models.Bet.id.in_(resolutions),
+        (models.Bet.creator_id == winner) | (models.Bet.opponent_id == winner),
+    ]
+    if actor_id is not None:
+        criteria.append(
+            (models.Bet.creator_id == actor_id) | (models.Bet.opponent_id == actor_id)
+        )
+    resolved_at = datetime.utcnow()
+    previous = {}
+    for status in models.OPEN_STATUSES:
+        result = await db.scalars(
+            update(models.Bet)
+            .where(*criteria, models.Bet.status == status)
+            .values(
+                status=models.BetStatus.RESOLVED,
+                winner_id=winner,
+                result=outcome,
+                resolved_at=resolved_at,
+            )
+            .returning(models.Bet)
+            .execution_options(synchronize_session=False, populate_existing=True)
+        )
+        previous.update((bet, status) for bet in result)
+    bets = sorted(previous, key=lambda bet: bet.id)
+    if not bets:
+        await db.rollback()
+        return []
+
+    entries = []
+    balances: Dict[str, Counter] = defaultdict(Counter)
+    stats: Dict[str, Counter] = defaultdict(Counter)
+    for bet in bets:
+        for user_id, delta in _resolved_stats(bet, bet.winner_id, previous[bet]).items():
+            stats[user_id].update(delta)
+            # Bets against oneself move no money.
+            if bet.creator_id != bet.opponent_id:
+                amount = delta["net_winnings"]
+                entries.append({"user_id": user_id, "bet_id": bet.id, "amount": amount})
+                balances[user_id]["balance"] += amount
+    if entries:
+        await db.execute(insert(models.LedgerEntry), entries)
+        await _apply_balances(db, balances)
+    await apply_stats(db, stats)
+    await bump_versions(db, stats)
+    await db.commit()
+    hub.publish_bets("bet.resolved", bets)
+    return bets
+
 
+async def _transition_bet(
+    db: AsyncSession,
+    bet_id: int,
+    participant: InstrumentedAttribute,
+    user_id: str,
+    expected: models.BetStatus,
+    new: models.BetStatus,
+) -> Optional[models.Bet]:
+    """Compare-and-set a bet's status from ``expected`` to ``new``.
 
-def get_bet(db: Session, bet_id: int) -> Optional[models.Bet]:
-    return db.query(models.Bet).filter(models.Bet.id == bet_id).first()
+    A single ``UPDATE ... WHERE id = :id AND status = :expected AND
+    <participant> = :user RETURNING *`` performs the check and the write
+    at once, so of several concurrent transitions of the same bet exactly
+    one can succeed and none is lost.  Returns the updated bet, or None
+    (with the transaction rolled back) if the bet did not qualify.  Not
+    committed otherwise.
+    """
+    bet = await db.scalar(
+        update(models.Bet)
+        .where(models.Bet.id == bet_id, models.Bet.status == expected, participant == user_id)
+        .values(status=new)
+        .returning(models.Bet)
+        .execution_options(synchronize_session=False, populate_existing=True)
+    )
+    if bet is None:
+        await db.rollback()
+    return bet
+
+
+async def accept_bet(db: AsyncSession, bet_id: int, user_id: str) -> Optional[models.Bet]:
+    """Accept a pending bet as its opponent, making it active.
+
+    One conditional UPDATE (see `_transition_bet`); the participants'
+    stats move the bet from `pending` to `active` and their data
+    versions are bumped in the same transaction, and a ``bet.accepted``
+    event is published.  Returns None if the bet does
+    not exist, is not pending or ``user_id`` is not its opponent.
+    """
+    bet = await _transition_bet(
+        db,
+        bet_id,
+        models.Bet.opponent_id,
+        user_id,
+        models.BetStatus.PENDING,
+        models.BetStatus.ACTIVE,
+    )
+    if bet is None:
+        return None
+    stats = _accepted_stats(bet)
+    await apply_stats(db, stats)
+    await bump_versions(db, stats)
+    await db.commit()
+    hub.publish_bets("bet.accepted", [bet])
+    return bet
+
+
+async def decline_bet(db: AsyncSession, bet_id: int, user_id: str) -> Optional[models.Bet]:
+    """Decline a pending bet as its opponent.
+
+    Like `accept_bet`, but the bet becomes declined, which also takes it
+    off both participants' `pending` counts, and ``bet.declined`` is
+    published.
+    """
+    bet = await _transition_bet(
+        db,
+        bet_id,
+        models.Bet.opponent_id,
+        user_id,
+        models.BetStatus.PENDING,
+        models.BetStatus.DECLINED,
+    )
+    if bet is None:
+        return None
+    stats = _closed_stats([bet])
+    await apply_stats(db, stats)
+    await bump_versions(db, stats)
+    await db.commit()
+    hub.publish_bets("bet.declined", [bet])
+    return bet
 
 
-def update_bet_result(
-    db: Session,
+async def _apply_balances(db: AsyncSession, deltas: Dict[str, Counter]) -> None:
+    """Add per-user ``deltas`` to `balances` with one atomic upsert."""
+    stmt = upsert_insert(db, models.Balance).values(
+        [{"user_id": user_id, "balance": delta["balance"]} for user_id, delta in deltas.items()]
+    )
+    await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[models.Balance.user_id],
+            set_={"balance": models.Balance.balance + stmt.excluded.balance},
+        )
+    )
+
+
+async def update_bet_result(
+    db: AsyncSession,
     bet: models.Bet,
     winner_id: str,
     result: str,
-) -> models.Bet:
-    """Resolve a bet by setting the winner and result."""
-    bet.status = models.BetStatus.RESOLVED
-    bet.winner_id = winner_id
-    bet.result = result
-    from datetime import datetime
-
-    bet.resolved_at = datetime.utcnow()
-    db.commit()
-    db.refresh(bet)
-    return bet
+) -> Optional[models.Bet]:
+    """Resolve a bet by setting the winner and result.
 
+    The wager is settled through the ledger and the participants'
+    `user_stats` are updated in the same transaction (see `settle_bets`).
+    Returns None if the bet was resolved concurrently by someone else.
+    """
+    settled = await settle_bets(db, [(bet.id, winner_id, result)])
+    return settled[0] if settled else None
 
-def update_user(db: Session, user: models.User, update_in: schemas.UserUpdate) -> models.User:
-    """Update the current user's profile with supplied fields."""
-    if update_in.username is not None:
-        user.username = update_in.username
-    if update_in.email is not None:
-        user.email = update_in.email
-    db.commit()
-    db.refresh(user)
-    return user
 
+async def get_balance(db: AsyncSession, user_id: str) -> int:
+    """Return the user's current balance (zero if they never settled a bet)."""
+    balance = await db.scalar(
+        select(models.Balance.balance).where(models.Balance.user_id == user_id)
+    )
+    return balance or 0
 
-def search_users(db: Session, query: str, current_user_id: str, limit: int = 20):
-    """Search for users by username or email, excluding the current user."""
-    if not query:
-        return []
-    q = f"%{query.lower()}%"
-    return (
-        db.query(models.User)
-        .filter(
-            models.User.id != current_user_id,
-            (func.lower(models.User.username).like(q)) | (func.lower(models.User.email).like(q)),
+
+async def snapshot_balances(db: AsyncSession, retain: int = 2) -> int:
+    """Copy every balance into `balance_snapshots` and prune old snapshots.
+
+    The copy and the high-water mark of the ledger are read by a single
+    ``INSERT ... SELECT`` so they are consistent with each other.  On
+    Postgres the ledger and `balances` are briefly locked against
+    writers, which also waits for settlements in flight: one could have
+    written its ledger entry but not yet its balances, and the snapshot
+    would then miss its amounts while recording a high-water mark past
+    its entry.  Only the newest ``retain`` snapshots are kept.  Returns
+    the number of rows copied.
+    """
+    if db.bind.dialect.name == "postgresql":
+        # Settlements write the ledger first, then balances: lock in that order.
+        await db.execute(text("LOCK TABLE ledger_entries, balances IN SHARE MODE"))
+    taken_at = datetime.utcnow()
+    high_water = select(func.coalesce(func.max(models.LedgerEntry.id), 0)).scalar_subquery()
+    result = await db.execute(
+        insert(models.BalanceSnapshot).from_select(
+            ["user_id", "balance", "ledger_id", "taken_at"],
+            select(
+                models.Balance.user_id,
+                models.Balance.balance,
+                high_water,
+                literal(taken_at, models.BalanceSnapshot.taken_at.type),
+            ),
+        )
+    )
+    recent = (
+        select(models.BalanceSnapshot.taken_at)
+        .distinct()
+        .order_by(models.BalanceSnapshot.taken_at.desc())
+        .limit(retain)
+        .subquery()
+    )
+    await db.execute(
+        delete(models.BalanceSnapshot).where(
+            models.BalanceSnapshot.taken_at < select(func.min(recent.c.taken_at)).scalar_subquery()
+        )
+    )
+    await db.commit()
+    return result.rowcount
+
+
+async def rebuild_balances(db: AsyncSession) -> int:
+    """Recompute `balances` from the latest snapshot plus newer ledger entries.
+
+    Returns the number of balances written.
+    """
+    snapshot = models.BalanceSnapshot
+    latest = (
+        select(snapshot.user_id, snapshot.balance, snapshot.ledger_id)
+        .where(snapshot.id.in_(select(func.max(snapshot.id)).group_by(snapshot.user_id)))
+        .subquery()
+    )
+    totals = {
+        user_id: balance for user_id, balance, _ in await db.execute(select(latest))
+    }
+    replay = await db.execute(
+        select(models.LedgerEntry.user_id, func.sum(models.LedgerEntry.amount))
+        .outerjoin(latest, latest.c.user_id == models.LedgerEntry.user_id)
+        .where(models.LedgerEntry.id > func.coalesce(latest.c.ledger_id, 0))
+        .group_by(models.LedgerEntry.user_id)
+    )
+    for user_id, amount in replay:
+        totals[user_id] = totals.get(user_id, 0) + amount
+    await db.execute(delete(models.Balance))
+    if totals:
+        await db.execute(
+            insert(models.Balance),
+            [{"user_id": user_id, "balance": balance} for user_id, balance in totals.items()],
+        )
+    await db.commit()
+    return len(totals)
+
+
+async def get_user_stats(db: AsyncSession, user_id: str) -> models.UserStats:
+    """Return the user's running bet totals (all zero if they have no bets)."""
+    stats = await db.get(models.UserStats, user_id)
+    if stats is None:
+        stats = models.UserStats(
+            user_id=user_id, **{name: 0 for name in _STATS_COLUMNS}
         )
+    return stats
+
+
+async def get_pending_counts(db: AsyncSession, user_id: str) -> Tuple[int, int]:
+    """Return the user's pending bet counts as ``(incoming, outgoing)``.
+
+    Incoming bets await the user's answer, outgoing ones their
+    opponent's; bets against oneself only count as outgoing.  Both
+    counts come from one statement, each served by a participant index.
+    """
+    pending = models.Bet.status == models.BetStatus.PENDING
+    incoming = select(func.count()).where(
+        models.Bet.opponent_id == user_id, models.Bet.creator_id != user_id, pending
+    )
+    outgoing = select(func.count()).where(models.Bet.creator_id == user_id, pending)
+    result = await db.execute(select(incoming.scalar_subquery(), outgoing.scalar_subquery()))
+    incoming_count, outgoing_count = result.one()
+    return incoming_count, outgoing_count
+
+
+async def get_friends_leaderboard(
+    db: AsyncSession, user_id: str, limit: int = 20
+) -> List[Tuple[models.User, Optional[models.UserStats]]]:
+    """Rank the user and their friends by net winnings, best first.
+
+    The candidate set comes from the `friendships` index for ``user_id``;
+    each candidate's totals are a primary-key lookup in `user_stats`, so
+    the cost depends on the number of friends, not on bet history.
+    Users without any bets are returned with ``None`` stats.
+    """
+    members = select(models.Friendship.friend_id).where(models.Friendship.user_id == user_id)
+    net_winnings = func.coalesce(models.UserStats.net_winnings, 0)
+    wins = func.coalesce(models.UserStats.wins, 0)
+    result = await db.execute(
+        select(models.User, models.UserStats)
+        .outerjoin(models.UserStats, models.UserStats.user_id == models.User.id)
+        .where((models.User.id == user_id) | models.User.id.in_(members))
+        .order_by(net_winnings.desc(), wins.desc(), models.User.id)
         .limit(limit)
-        .all()
     )
+    return [(user, stats) for user, stats in result]
+
+
+async def update_user(
+    db: AsyncSession, user: models.User, update_in: schemas.UserUpdate
+) -> models.User:
+    """Update the current user's profile with supplied fields.
+
+    ``user`` may be a detached copy served from `user_cache`, so the row
+    is updated by primary key rather than through the instance.
+    """
+    values = update_in.model_dump(exclude_none=True)
+    if values:
+        await db.execute(
+            update(models.User).where(models.User.id == user.id).values(**values)
+        )
+        await bump_versions(db, [user.id], include_friends=True)
+        await db.commit()
+        user_cache.invalidate(user.id)
+        search_cache.invalidate_user(user.id, values.get("username"), values.get("email"))
+    return await db.get(models.User, user.id, populate_existing=True)
+
+
+# The SQLite FTS5 trigram index declared in `models.USER_SEARCH_DDL`.
+# The hidden column named after the table is the MATCH target.
+_users_search = table("users_search", column("rowid"), column("users_search"))
+
+# Trigram indexes can only answer queries of at least three characters.
+_MIN_INDEXED_QUERY = 3
+
+_search_index_available: Optional[bool] = None
+
+
+async def _has_search_index(db: AsyncSession) -> bool:
+    """Return whether the SQLite search index exists (checked once)."""
+    global _search_index_available
+    if _search_index_available is None:
+        _search_index_available = await db.run_sync(
+            lambda session: inspect(session.connection()).has_table("users_search")
+        )
+    return _search_index_available
+
+
+async def search_users(db: AsyncSession, query: str, current_user_id: str, limit: int = 20):
+    """Search for users by username or email, excluding the current user.
+
+    The query is matched case-insensitively as a substring of either
+    field, folding case as the database's ``lower()`` does (ASCII letters
+    only on SQLite).  Exact matches rank first, then prefix matches, then
+    the rest (see `_search_users` for the query itself).
+
+    Results are served from `search_cache` when possible: a search that
+    extends a recent one with fewer matches than a page is answered by
+    filtering the shorter query's matches in memory.  Cached results
+    include the current user, so that they can be shared by everyone;
+    one extra match is fetched to make up for it.
+    """
+    lower = ascii_lower if db.bind.dialect.name == "sqlite" else str.lower
+    q = lower(query)
+    if not q:
+        return []
+    if not search_cache.enabled:
+        return await _search_users(db, q, limit, exclude_id=current_user_id)
+    fetch = limit + 1
+    users = search_cache.get(q, fetch, lower)
+    if users is None:
+        users = await _search_users(db, q, fetch)
+        search_cache.put(q, users, complete=len(users) < fetch)
+    return [user for user in users if user.id != current_user_id][:limit]
+
+
+async def _search_users(
+    db: AsyncSession, q: str, limit: int, exclude_id: Optional[str] = None
+) -> List[models.User]:
+    """Return the first ``limit`` users matching the lower-cased ``q``, ranked.
 
+    Every part of the search is a bounded index scan, so latency does not
+    grow with the size of the `users` table:
 
-def add_friend(db: Session, user_id: str, friend_id: str):
+    * exact and prefix matches are range scans over the ``lower()``
+      expression indexes on `users`;
+    * other substrings come from the `users_search` trigram index on
+      SQLite (queries of three or more characters) or the `pg_trgm`
+      indexes on Postgres, stopping after enough rows have been found.
+
+    Shorter queries on SQLite fall back to a LIKE scan for the substring
+    part.  The branches are merged with UNION ALL in a single statement.
+    Fewer than ``limit`` results means these are all the matches.
+    `cache.search_rank` and `cache.search_order` mirror the ranking and
+    ordering in Python; keep them in step.
+    """
+    excluded = [] if exclude_id is None else [models.User.id != exclude_id]
+    dialect = db.bind.dialect.name
+    username = func.lower(models.User.username)
+    email = func.lower(models.User.email)
+
+    if dialect == "sqlite":
+        # BINARY collation orders strings by code point, so every string
+        # starting with `q` sorts in [q, successor(q)).
+        upper = q[:-1] + chr(ord(q[-1]) + 1)
+        prefix_of = lambda expr: and_(expr >= q, expr < upper)  # noqa: E731
+    else:
+        prefix_of = lambda expr: expr.startswith(q, autoescape=True)  # noqa: E731
+
+    def candidates(rank, *criteria, order_by=None, fetch=limit):
+        branch = select(models.User, rank.label("rank")).where(*excluded, *criteria)
+        if order_by is not None:
+            branch = branch.order_by(order_by)
+        return select(branch.limit(fetch).subquery())
+
+    # Prefix matches on either field; an exact match sorts first in its range.
+    branches = [
+        candidates(case((expr == q, 0), else_=1), prefix_of(expr), order_by=expr)
+        for expr in (username, email)
+    ]
+    # Remaining substring matches.  Up to 2 * limit of them may duplicate
+    # the prefix matches above, so fetch enough to fill the page regardless.
+    substring_rank = literal(2)
+    contains_q = username.contains(q, autoescape=True) | email.contains(q, autoescape=True)
+    if (
+        len(q) >= _MIN_INDEXED_QUERY
+        and dialect == "sqlite"
+        and await _has_search_index(db)
+    ):
+        phrase = '"' + q.replace('"', '""') + '"'
+        branch = (
+            select(models.User, substring_rank.label("rank"))
+            .join(_users_search, _users_search.c.rowid == literal_column("users.rowid"))
+            .where(
+                _users_search.c.users_search.op("MATCH")(phrase),
+                # The trigram tokenizer folds non-ASCII case too; `lower()`
+                # and the other branches do not.
+                contains_q,
+                *excluded,
+            )
+            .limit(3 * limit)
+        )
+        branches.append(select(branch.subquery()))
+    else:
+        branches.append(candidates(substring_rank, contains_q, fetch=3 * limit))
+
+    merged = union_all(*branches).subquery()
+    user = aliased(models.User, merged)
+    rows = await db.execute(
+        select(user).order_by(
+            merged.c.rank, func.lower(merged.c.username).nulls_first(), merged.c.id
+        )
+    )
+    results = {}
+    for found in rows.scalars():
+        results.setdefault(found.id, found)
+        if len(results) == limit:
+            break
+    return list(results.values())
+
+
+async def add_friend(db: AsyncSession, user_id: str, friend_id: str):
     """Create a mutual friendship between two users if it does not already exist."""
     # Check if friendship already exists
-    exists = (
-        db.query(models.Friendship)
-        .filter(models.Friendship.user_id == user_id, models.Friendship.friend_id == friend_id)
-        .first()
+    exists = await db.scalar(
+        select(models.Friendship.id).where(
+            models.Friendship.user_id == user_id, models.Friendship.friend_id == friend_id
+        )
     )
     if exists:
         return
     friendship = models.Friendship(user_id=user_id, friend_id=friend_id)
     inverse = models.Friendship(user_id=friend_id, friend_id=user_id)
     db.add_all([friendship, inverse])
-    db.commit()
+    await bump_versions(db, (user_id, friend_id))
+    await db.commit()
+    friend_graph.add(user_id, friend_id)
 
 
-def get_friends(db: Session, user_id: str):
+async def get_friends(db: AsyncSession, user_id: str):
     """Return a list of users who are friends with the given user."""
-    friend_ids = [f.friend_id for f in db.query(models.Friendship).filter_by(user_id=user_id).all()]
-    if not friend_ids:
+    result = await db.scalars(
+        select(models.User)
+        .join(models.Friendship, models.Friendship.friend_id == models.User.id)
+        .where(models.Friendship.user_id == user_id)
+    )
+    return list(result)
+
+
+async def _get_users_by_ids(db: AsyncSession, user_ids: Iterable[str]) -> List[models.User]:
+    """Fetch users by ID, preserving the order of ``user_ids``."""
+    user_ids = list(user_ids)
+    if not user_ids:
         return []
-    return db.query(models.User).filter(models.User.id.in_(friend_ids)).all()
+    result = await db.scalars(select(models.User).where(models.User.id.in_(user_ids)))
+    users = {user.id: user for user in result}
+    return [users[user_id] for user_id in user_ids if user_id in users]
+
+
+async def get_mutual_friends(db: AsyncSession, user_id: str, other_id: str) -> List[models.User]:
+    """Return the users who are friends with both ``user_id`` and ``other_id``."""
+    if friend_graph.enabled:
+        await friend_graph.ensure_loaded(db)
+        return await _get_users_by_ids(db, sorted(friend_graph.mutual(user_id, other_id)))
+    mine = aliased(models.Friendship)
+    theirs = aliased(models.Friendship)
+    result = await db.scalars(
+        select(models.User)
+        .join(mine, mine.friend_id == models.User.id)
+        .join(theirs, theirs.friend_id == models.User.id)
+        .where(mine.user_id == user_id, theirs.user_id == other_id)
+        .order_by(models.User.id)
+    )
+    return list(result)
+
+
+async def get_friend_suggestions(
+    db: AsyncSession, user_id: str, limit: int = 10
+) -> List[Tuple[models.User, int]]:
+    """Rank friends-of-friends by the number of mutual friends.
+
+    Returns ``(user, mutual_friend_count)`` pairs, best first.  With the
+    in-memory friend graph enabled, ranking happens entirely in memory
+    and only the suggested users are read from the database.
+    """
+    if friend_graph.enabled:
+        await friend_graph.ensure_loaded(db)
+        ranked = friend_graph.suggestions(user_id, limit)
+        counts = dict(ranked)
+        users = await _get_users_by_ids(db, [candidate for candidate, _ in ranked])
+        return [(user, counts[user.id]) for user in users]
+    mine = aliased(models.Friendship)
+    theirs = aliased(models.Friendship)
+    mutual = func.count().label("mutual")
+    ranked = (
+        select(theirs.friend_id, mutual)
+        .join(mine, mine.friend_id == theirs.user_id)
+        .where(
+            mine.user_id == user_id,
+            theirs.friend_id != user_id,
+            theirs.friend_id.not_in(
+                select(models.Friendship.friend_id).where(models.Friendship.user_id == user_id)
+            ),
+        )
+        .group_by(theirs.friend_id)
+        .order_by(mutual.desc(), theirs.friend_id)
+        .limit(limit)
+        .subquery()
+    )
+    result = await db.execute(
+        select(models.User, ranked.c.mutual)
+        .join(ranked, ranked.c.friend_id == models.User.id)
+        .order_by(ranked.c.mutual.desc(), models.User.id)
+    )
+    return [(user, count) for user, count in result]
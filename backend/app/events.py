@@ -0,0 +1,129 @@
+"""
+In-process publish/subscribe hub for pushing bet updates to clients.
+
+The CRUD helpers publish an event after every committed bet change and
+the hub fans it out to the per-user queues of connected WebSocket
+subscribers (see the `/ws` endpoint in `main.py`).  Each event is
+serialised once, however many subscribers receive it.
+
+Queues are bounded.  A subscriber that falls `EVENT_QUEUE_SIZE` events
+behind (a stalled phone, a slow network) has its backlog discarded and
+replaced by a single ``{"type": "resync"}`` event, telling the client to
+re-fetch `/bets` instead of letting memory grow without bound.
+
+The hub only sees changes made through this process.  When running
+several workers, each one pushes the events for the requests it served.
+
+Configuration
+-------------
+```
+EVENT_QUEUE_SIZE   Maximum number of undelivered events per subscriber (default 100).
+```
+"""
+
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Set
+import asyncio
+import json
+import os
+
+from . import models, schemas
+
+
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "100"))
+
+RESYNC_EVENT = json.dumps({"type": "resync"})
+
+
+class Subscription:
+    """A single subscriber's bounded queue of serialised events."""
+
+    def __init__(self, user_id: str, maxsize: int):
+        self.user_id = user_id
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize)
+
+    async def get(self) -> str:
+        return await self.queue.get()
+
+
+class EventHub:
+    """Fan out events to the subscriptions of the users they concern."""
+
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscriptions: Dict[str, Set[Subscription]] = defaultdict(set)
+        self.published = 0
+        self.delivered = 0
+        self.overflows = 0
+
+    def subscribe(self, user_id: str) -> Subscription:
+        subscription = Subscription(user_id, self.queue_size)
+        self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions = self._subscriptions.get(subscription.user_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.user_id]
+
+    def publish(self, user_ids: Iterable[str], event: dict) -> None:
+        """Queue ``event`` for every subscriber of the given users.
+
+        Never blocks: a full queue is collapsed into a resync event.
+        """
+        targets = [
+            subscription
+            for user_id in set(user_ids)
+            for subscription in self._subscriptions.get(user_id, ())
+        ]
+        self.published += 1
+        if not targets:
+            return
+        message = json.dumps(event)
+        for subscription in targets:
+            try:
+                subscription.queue.put_nowait(message)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                self._overflow(subscription)
+
+    def _overflow(self, subscription: Subscription) -> None:
+        self.overflows += 1
+        queue = subscription.queue
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(RESYNC_EVENT)
+
+    def publish_bets(self, event_type: str, bets: Iterable[models.Bet]) -> None:
+        """Publish one ``event_type`` event per bet to both participants.
+
+        Bets whose participants have no subscribers are not serialised.
+        """
+        for bet in bets:
+            participants = (bet.creator_id, bet.opponent_id)
+            if not any(user_id in self._subscriptions for user_id in participants):
+                self.published += 1
+                continue
+            payload = schemas.BetOut.model_validate(bet, from_attributes=True)
+            self.publish(
+                participants, {"type": event_type, "bet": payload.model_dump(mode="json")}
+            )
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "subscribers": self.subscriber_count(),
+            "published": self.published,
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+        }
+
+    def subscriber_count(self, user_id: Optional[str] = None) -> int:
+        if user_id is not None:
+            return len(self._subscriptions.get(user_id, ()))
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+# Shared by every request handled by this process.
+hub = EventHub()
@@ -0,0 +1,114 @@
+"""
+In-memory index of the friendship graph.
+
+Friend suggestions and mutual-friend lookups are graph traversals that
+are awkward and expensive to express in SQL.  When enabled, this module
+keeps an adjacency index (user ID -> set of friend IDs) for the whole
+graph in process memory.  It is loaded from the `friendships` table on
+first use and updated incrementally by `crud.add_friend`, so traversals
+never issue graph queries to the database.
+
+Each worker process holds its own copy.  Friendships added through
+another worker become visible once the index is reloaded, which happens
+every `FRIEND_GRAPH_RELOAD_INTERVAL` seconds.
+
+Configuration
+-------------
+```
+FRIEND_GRAPH_INDEX              Set to 1 to enable the index (default 0).
+FRIEND_GRAPH_RELOAD_INTERVAL    Seconds between full reloads (default 300).
+```
+"""
+
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import os
+import time
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+
+
+FRIEND_GRAPH_INDEX = os.getenv("FRIEND_GRAPH_INDEX", "0") == "1"
+FRIEND_GRAPH_RELOAD_INTERVAL = float(os.getenv("FRIEND_GRAPH_RELOAD_INTERVAL", "300"))
+
+
+class FriendGraph:
+    """Adjacency index over the friendship graph."""
+
+    def __init__(
+        self,
+        enabled: bool = FRIEND_GRAPH_INDEX,
+        reload_interval: float = FRIEND_GRAPH_RELOAD_INTERVAL,
+    ):
+        self.enabled = enabled
+        self.reload_interval = reload_interval
+        self._adjacency: Dict[str, Set[str]] = defaultdict(set)
+        self._loading: Optional[Dict[str, Set[str]]] = None
+        self._loaded_at: Optional[float] = None
+        self._load_lock = asyncio.Lock()
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._loaded_at is not None
+            and time.monotonic() - self._loaded_at < self.reload_interval
+        )
+
+    async def ensure_loaded(self, db: AsyncSession) -> None:
+        """Load (or reload) the index from the database if it is stale."""
+        if self._is_fresh():
+            return
+        async with self._load_lock:
+            if self._is_fresh():
+                return
+            adjacency: Dict[str, Set[str]] = defaultdict(set)
+            # Friendships added while the rows stream in are applied to
+            # both the live index and the one being built.
+            self._loading = adjacency
+            try:
+                result = await db.stream(
+                    select(models.Friendship.user_id, models.Friendship.friend_id)
+                )
+                async for user_id, friend_id in result:
+                    adjacency[user_id].add(friend_id)
+            finally:
+                self._loading = None
+            self._adjacency = adjacency
+            self._loaded_at = time.monotonic()
+
+    def add(self, user_id: str, friend_id: str) -> None:
+        """Record a (mutual) friendship that has been committed."""
+        for adjacency in (self._adjacency, self._loading):
+            if adjacency is not None:
+                adjacency[user_id].add(friend_id)
+                adjacency[friend_id].add(user_id)
+
+    def friends(self, user_id: str) -> Set[str]:
+        return set(self._adjacency.get(user_id, ()))
+
+    def mutual(self, user_id: str, other_id: str) -> Set[str]:
+        """Return the IDs of users who are friends with both users."""
+        return self._adjacency.get(user_id, set()) & self._adjacency.get(other_id, set())
+
+    def suggestions(self, user_id: str, limit: int = 10) -> List[Tuple[str, int]]:
+        """Rank friends-of-friends by how many mutual friends they share.
+
+        Returns ``(user_id, mutual_friend_count)`` pairs, best first; ties
+        are broken by user ID so results are stable.
+        """
+        friends = self._adjacency.get(user_id, set())
+        counts: Counter = Counter()
+        for friend_id in friends:
+            counts.update(self._adjacency.get(friend_id, ()))
+        counts.pop(user_id, None)
+        for friend_id in friends:
+            counts.pop(friend_id, None)
+        ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
+
+
+# Shared by every request handled by this process.
+friend_graph = FriendGraph()
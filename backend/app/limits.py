@@ -0,0 +1,325 @@
+"""
+Per-user rate limiting and load shedding.
+
+Every API worker funnels its writes through a single SQLite writer (or
+a bounded connection pool), so one client hammering an expensive
+endpoint slows everybody down.  `LimitsMiddleware` protects the app in
+two layers, both answered before any handler or database work runs:
+
+* a token bucket per caller and route budget.  Callers are identified
+  by the ``sub`` claim of their bearer token once the token has been
+  verified (it is then in `auth.token_cache`), or by client address
+  otherwise.  The middleware never verifies a token itself: a request
+  with a new or forged token is throttled by address before any
+  signature check or JWKS fetch, and a JWKS outage cannot fail
+  requests here.  With the token cache disabled
+  (``SUPABASE_JWT_CACHE_SIZE=0``) every caller is limited by address,
+  so clients behind a shared address share a bucket.  Expensive routes
+  have their own, tighter budgets (see `ROUTE_BUDGETS`); every other
+  route draws from a shared default bucket.  A caller out of tokens
+  gets 429 with a ``Retry-After`` header saying when the next token
+  arrives;
+* a global cap on the number of requests handled concurrently.  Up to
+  `LOAD_SHED_QUEUE_SIZE` further requests wait, first come first
+  served, for at most `LOAD_SHED_QUEUE_TIMEOUT` seconds; beyond that
+  requests are shed immediately with 503 and ``Retry-After`` rather
+  than piling up behind the database.
+
+Throttled and shed requests are counted in `/metrics`
+(``http_requests_throttled_total`` and ``http_requests_shed_total``)
+along with the current concurrency, queue length and number of
+tracked buckets, so the limits can be tuned from production data.
+``/metrics`` itself is never limited.
+
+State is per process and lives on the event loop, so it needs no locks;
+with several workers each enforces its own share of the limits.
+
+Configuration
+-------------
+```
+RATE_LIMIT_ENABLED          Set to 0 to disable per-user rate limiting (default 1).
+RATE_LIMIT_RATE             Default budget: requests per second per caller (default 20).
+RATE_LIMIT_BURST            Default budget: bucket size (default 40).
+RATE_LIMIT_ROUTES           Route budget overrides, e.g. "POST /bets=2:10;GET /users/search=5:10".
+RATE_LIMIT_MAX_KEYS         Maximum number of buckets kept, LRU (default 100000).
+LOAD_SHED_MAX_CONCURRENCY   Requests handled at once (default 64, 0 disables the cap).
+LOAD_SHED_QUEUE_SIZE        Requests allowed to wait for a slot (default 256).
+LOAD_SHED_QUEUE_TIMEOUT     Seconds a request may wait for a slot (default 5).
+LOAD_SHED_RETRY_AFTER       Retry-After sent with 503 responses, in seconds (default 1).
+```
+"""
+
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+import asyncio
+import math
+import os
+import time
+
+from starlette.responses import JSONResponse
+from starlette.routing import BaseRoute, Match
+
+from . import auth, metrics
+
+
+# (requests per second, burst)
+Budget = Tuple[float, float]
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+DEFAULT_BUDGET: Budget = (
+    float(os.getenv("RATE_LIMIT_RATE", "20")),
+    float(os.getenv("RATE_LIMIT_BURST", "40")),
+)
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+LOAD_SHED_MAX_CONCURRENCY = int(os.getenv("LOAD_SHED_MAX_CONCURRENCY", "64"))
+LOAD_SHED_QUEUE_SIZE = int(os.getenv("LOAD_SHED_QUEUE_SIZE", "256"))
+LOAD_SHED_QUEUE_TIMEOUT = float(os.getenv("LOAD_SHED_QUEUE_TIMEOUT", "5"))
+LOAD_SHED_RETRY_AFTER = int(os.getenv("LOAD_SHED_RETRY_AFTER", "1"))
+
+# Routes that write, fan out or scan get their own, tighter budgets.
+ROUTE_BUDGETS: Dict[Tuple[str, str], Budget] = {
+    ("POST", "/bets"): (2, 10),
+    ("POST", "/bets/batch"): (0.2, 3),
+    ("POST", "/bets/resolve"): (0.5, 5),
+    ("PUT", "/bets/{bet_id}/accept"): (2, 10),
+    ("PUT", "/bets/{bet_id}/decline"): (2, 10),
+    ("PUT", "/bets/{bet_id}/resolve"): (2, 10),
+    ("PUT", "/users/me"): (0.5, 5),
+    ("GET", "/users/search"): (5, 10),
+    ("POST", "/friends/{friend_id}"): (1, 10),
+    ("GET", "/friends/suggestions"): (2, 5),
+    ("GET", "/bets/export"): (0.1, 3),
+}
+
+# Never limited, so that monitoring keeps working under overload.
+EXEMPT_PATHS = frozenset({"/metrics"})
+
+
+def parse_route_budgets(spec: str) -> Dict[Tuple[str, str], Budget]:
+    """Parse ``"METHOD /path=rate:burst;..."`` into route budgets."""
+    budgets = {}
+    for item in filter(None, (part.strip() for part in spec.split(";"))):
+        try:
+            route, _, budget = item.rpartition("=")
+            method, path = route.split()
+            rate, burst = budget.split(":")
+            budgets[(method.upper(), path)] = (float(rate), float(burst))
+        except ValueError:
+            raise ValueError(f"Invalid RATE_LIMIT_ROUTES entry: {item!r}") from None
+    return budgets
+
+
+ROUTE_BUDGETS.update(parse_route_budgets(os.getenv("RATE_LIMIT_ROUTES", "")))
+
+
+class RateLimiter:
+    """Token buckets keyed by caller and route budget.
+
+    Each bucket holds at most ``burst`` tokens and refills at ``rate``
+    tokens per second; a request takes one token.  Buckets are created
+    full and kept in LRU order, at most ``max_keys`` of them, so idle
+    callers cost nothing once evicted (an evicted caller simply starts
+    again with a full bucket).
+    """
+
+    def __init__(
+        self,
+        budgets: Dict[Tuple[str, str], Budget] = ROUTE_BUDGETS,
+        default: Budget = DEFAULT_BUDGET,
+        max_keys: int = RATE_LIMIT_MAX_KEYS,
+    ):
+        self.budgets = budgets
+        self.default = default
+        self.max_keys = max_keys
+        # (caller, route or "*") -> [tokens, last refill]
+        self._buckets: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        self.allowed = 0
+        self.throttled = 0
+
+    def acquire(self, caller: str, method: str, route: Optional[str]) -> float:
+        """Take a token for ``caller`` on ``route``.
+
+        Returns 0 if the request may proceed, otherwise the number of
+        seconds until a token will be available.
+        """
+        budget = self.budgets.get((method, route)) if route is not None else None
+        group = f"{method} {route}" if budget is not None else "*"
+        rate, burst = budget or self.default
+        key = (caller, group)
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [burst, now]
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            self.allowed += 1
+            return 0.0
+        self.throttled += 1
+        return (1 - bucket[0]) / rate if rate > 0 else float("inf")
+
+    def stats(self) -> Dict[str, float]:
+        return {"buckets": len(self._buckets), "allowed": self.allowed, "throttled": self.throttled}
+
+
+class ConcurrencyLimiter:
+    """At most ``limit`` holders at once, with a bounded FIFO wait queue."""
+
+    def __init__(
+        self,
+        limit: int = LOAD_SHED_MAX_CONCURRENCY,
+        queue_size: int = LOAD_SHED_QUEUE_SIZE,
+        timeout: float = LOAD_SHED_QUEUE_TIMEOUT,
+    ):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.queued_total = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    async def acquire(self) -> Optional[str]:
+        """Take a slot, waiting if needed.
+
+        Returns None once a slot is held (release it with `release`),
+        or the reason the request was shed: ``"queue_full"`` or
+        ``"queue_timeout"``.
+        """
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return None
+        if len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            return "queue_full"
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued_total += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # Handed a slot just as the wait expired: use it.
+                return None
+            self._waiters.remove(waiter)
+            self.timed_out += 1
+            return "queue_timeout"
+        except BaseException:
+            if waiter.done():
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+        # `release` passed its slot on to us without decrementing `active`.
+        return None
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "active": self.active,
+            "queued": len(self._waiters),
+            "queued_total": self.queued_total,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+# Shared by every request handled by this process.
+rate_limiter = RateLimiter()
+concurrency_limiter = ConcurrencyLimiter()
+
+
+def _caller(scope) -> str:
+    """Identify the caller by already verified token subject, else by address."""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                # Only tokens a handler has verified are cached.
+                payload = auth.token_cache.peek(token)
+                if payload is not None and payload.get("sub"):
+                    return "user:" + payload["sub"]
+            break
+    client = scope.get("client")
+    return "addr:" + (client[0] if client else "unknown")
+
+
+def _match_route(routes: List[BaseRoute], scope) -> Optional[BaseRoute]:
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route
+    return None
+
+
+def _error(status_code: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        {"detail": detail},
+        status_code=status_code,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class LimitsMiddleware:
+    """Pure ASGI middleware applying `rate_limiter` and `concurrency_limiter`.
+
+    ``routes`` is the application's route list, used to look up the
+    route template (and so the budget) before the router runs.
+    """
+
+    def __init__(
+        self,
+        app,
+        routes: List[BaseRoute],
+        rate_limiter: RateLimiter = rate_limiter,
+        concurrency_limiter: ConcurrencyLimiter = concurrency_limiter,
+    ):
+        self.app = app
+        self.routes = routes
+        self.rate_limiter = rate_limiter if RATE_LIMIT_ENABLED else None
+        self.concurrency_limiter = concurrency_limiter if concurrency_limiter.limit > 0 else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        route = _match_route(self.routes, scope)
+        route_path = getattr(route, "path", None)
+        if route is not None:
+            # Lets `metrics.MetricsMiddleware` label rejected requests too.
+            scope["route"] = route
+
+        if self.rate_limiter is not None and method != "OPTIONS":
+            wait = self.rate_limiter.acquire(_caller(scope), method, route_path)
+            if wait:
+                metrics.registry.throttled.inc(method, route_path or "unmatched")
+                await _error(429, "Too many requests", wait)(scope, receive, send)
+                return
+
+        if self.concurrency_limiter is None:
+            await self.app(scope, receive, send)
+            return
+        reason = await self.concurrency_limiter.acquire()
+        if reason is not None:
+            metrics.registry.shed.inc(reason)
+            await _error(503, "Server is overloaded", LOAD_SHED_RETRY_AFTER)(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.concurrency_limiter.release()
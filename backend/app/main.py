@@ -12,32 +12,87 @@ To run the app locally:
 uvicorn app.main:app --reload
 ```
 
+In production, run `python -m app.server` instead, which serves the app
+from several preloaded, warmed-up worker processes (see `server`).
+
 The API will be available at http://127.0.0.1:8000.
 """
 
-from typing import List
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+import asyncio
+import hashlib
+import time
 
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import (
+    Depends,
+    FastAPI,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from . import models, schemas, crud, auth
-from .database import Base, engine, get_db
+from . import (
+    models,
+    schemas,
+    crud,
+    auth,
+    export,
+    limits,
+    metrics,
+    migrations,
+    serialization,
+    tasks,
+    warmup,
+)
+from .cache import search_cache, user_cache
+from .events import hub
+from .database import (
+    AsyncReadSessionLocal,
+    AsyncSessionLocal,
+    async_engine,
+    get_async_db,
+)
 
 
-# Create the database tables on startup.  In production you may wish to
-# manage migrations separately using a tool such as Alembic.
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Check the schema version, warm up, then run background jobs.
+
+    The schema itself is managed by `migrations`; importing this module
+    never touches the database.  The server only accepts connections
+    once this hook has yielded, so the warm-up (see `warmup`) runs
+    before the first request.  Background jobs are described in `tasks`.
+    """
+    await migrations.check_schema(async_engine)
+    await warmup.warm_up()
+    jobs = tasks.start_background_jobs()
+    try:
+        yield
+    finally:
+        for job in jobs:
+            job.cancel()
+        await asyncio.gather(*jobs, return_exceptions=True)
 
 
 app = FastAPI(
     title="Friendly Betting API",
-    description="API for a social betting app using virtual currency."
+    description="API for a social betting app using virtual currency.",
+    lifespan=lifespan,
 )
 
 # Configure CORS so the mobile client can call the API.  Adjust
 # `origins` to restrict which domains are permitted in production.
 origins = ["*"]
+# Inside CORS so that 429 and 503 responses still carry CORS headers.
+app.add_middleware(limits.LimitsMiddleware, routes=app.routes)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -46,96 +101,507 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so that the recorded latency covers the whole stack.
+app.add_middleware(metrics.MetricsMiddleware)
+
+metrics.registry.register_stats("token_cache", "Token cache counters.", auth.token_cache.stats)
+metrics.registry.register_stats("user_cache", "User cache counters.", user_cache.stats)
+metrics.registry.register_stats("search_cache", "User search cache counters.", search_cache.stats)
+metrics.registry.register_stats("event_hub", "Event hub counters.", hub.stats)
+metrics.registry.register_stats(
+    "bet_expiry", "Bet expiry job counters.", lambda: dict(tasks.expiry_stats)
+)
+metrics.registry.register_stats("warmup", "Worker warm-up outcome.", lambda: dict(warmup.stats))
+metrics.registry.register_stats(
+    "rate_limiter", "Rate limiter counters.", limits.rate_limiter.stats
+)
+metrics.registry.register_stats(
+    "concurrency_limiter", "Concurrency limiter counters.", limits.concurrency_limiter.stats
+)
+if auth.JWKS_URL:
+    metrics.registry.register_stats(
+        "jwks", "JWKS client counters.", auth.get_jwks_client(auth.JWKS_URL).stats
+    )
+
+
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    """Expose request, SQL and cache metrics in Prometheus text format."""
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+# Conditional GET support.  The ETag of a user's bets, friends and
+# profile is derived from their data version (see `models.UserVersion`),
+# so a revalidation that matches costs one primary-key lookup and never
+# touches the bets or friendships tables.  The version is read before
+# the data: a change committed in between yields fresh data under the
+# old tag, which merely costs the client one extra full response later.
+
+
+def _etag(request: Request, user_id: str, version: int) -> str:
+    digest = hashlib.sha256(
+        f"{user_id}|{request.url.path}|{request.url.query}".encode()
+    ).hexdigest()[:16]
+    return f'W/"{version}-{digest}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """Weak comparison of ``etag`` against the request's If-None-Match."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:]
+    return any(
+        candidate.strip().removeprefix("W/") == opaque for candidate in header.split(",")
+    )
+
+
+async def _check_etag(
+    request: Request, response: Response, db: AsyncSession, user_id: str
+) -> Optional[Response]:
+    """Set the ETag header, returning a 304 response if the client is current."""
+    etag = _etag(request, user_id, await crud.get_version(db, user_id))
+    if _etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return None
+
+
+def _refresh_cached_user(user: models.User) -> None:
+    """Refresh `user_cache` with a row just read, unless a replica served it.
+
+    The cache is authoritative for `auth.get_current_user`, and a lagging
+    replica could return a row older than the cached one.
+    """
+    if AsyncReadSessionLocal is None:
+        user_cache.put(user)
+
 
 @app.get("/users/me", response_model=schemas.UserOut)
-async def read_users_me(current_user: models.User = Depends(auth.get_current_user)):
-    """Return information about the currently authenticated user."""
-    return current_user
+async def read_users_me(
+    request: Request,
+    response: Response,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Return information about the currently authenticated user.
+
+    Supports ``If-None-Match`` revalidation via the ``ETag`` header.
+    """
+    not_modified = await _check_etag(request, response, db, current_user.id)
+    if not_modified is not None:
+        return not_modified
+    # The identity cache may predate a change made through another worker;
+    # never pair a new tag with a stale cached row.  A lagging read
+    # replica may not have the row yet: fall back to the cached one.
+    user = await crud.get_user(db, current_user.id)
+    if user is None:
+        return current_user
+    _refresh_cached_user(user)
+    return user
+
+
+# Sections of `/me/feed`, in response order.
+FEED_SECTIONS = ("profile", "bets", "friends", "pending")
+
+
+@app.get("/me/feed", response_model=schemas.FeedOut, response_model_exclude_unset=True)
+async def read_feed(
+    request: Request,
+    response: Response,
+    fields: Optional[str] = Query(
+        None, description="Comma-separated sections to include (default: all)"
+    ),
+    bets_limit: int = Query(20, ge=1, le=100),
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Return the app's home screen in one round-trip.
+
+    Combines the profile (`/users/me`), the ``bets_limit`` most recent
+    bets (`/bets`, with ``next_cursor`` to continue paging there), the
+    friends list (`/friends`) and the number of pending bets awaiting
+    the user or their opponents.  ``fields`` (e.g. ``bets,pending``)
+    restricts the response to the named sections.
+
+    The request is authenticated once and the sections are loaded
+    concurrently, each on its own session, so the response takes about
+    as long as the slowest section rather than the sum.  Supports
+    ``If-None-Match`` revalidation via the ``ETag`` header.
+    """
+    sections = FEED_SECTIONS
+    if fields is not None:
+        requested = {name.strip() for name in fields.split(",") if name.strip()}
+        unknown = requested.difference(FEED_SECTIONS)
+        if unknown:
+            raise HTTPException(
+                status_code=400, detail=f"Unknown feed sections: {', '.join(sorted(unknown))}"
+            )
+        sections = tuple(name for name in FEED_SECTIONS if name in requested)
+    not_modified = await _check_etag(request, response, db, current_user.id)
+    if not_modified is not None:
+        return not_modified
+
+    user_id = current_user.id
+    loaders = {
+        "profile": lambda session: crud.get_user(session, user_id),
+        "bets": lambda session: crud.get_bet_rows_for_user(
+            session, user_id, serialization.BET_FIELDS, limit=bets_limit
+        ),
+        "friends": lambda session: crud.get_friends(session, user_id),
+        "pending": lambda session: crud.get_pending_counts(session, user_id),
+    }
+    sessions = AsyncReadSessionLocal or AsyncSessionLocal
+
+    async def load(name: str, own_session: bool):
+        # A session serves one statement at a time: the first section
+        # reuses the request's, the others open their own.
+        if not own_session:
+            return await loaders[name](db)
+        async with sessions() as session:
+            return await loaders[name](session)
+
+    results = await asyncio.gather(
+        *(load(name, i > 0) for i, name in enumerate(sections))
+    )
+    feed = dict(zip(sections, results))
+    if "profile" in feed:
+        # Same as `/users/me`.
+        if feed["profile"] is None:
+            feed["profile"] = current_user
+        else:
+            _refresh_cached_user(feed["profile"])
+    if "bets" in feed and len(feed["bets"]) == bets_limit:
+        feed["next_cursor"] = crud.encode_cursor(feed["bets"][-1])
+    if "pending" in feed:
+        incoming, outgoing = feed["pending"]
+        feed["pending"] = schemas.PendingCounts(incoming=incoming, outgoing=outgoing)
+    return feed
 
 
 # Bet endpoints
 @app.get("/bets", response_model=List[schemas.BetOut])
-def list_bets(
+async def list_bets(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    """Return a paginated list of bets involving the current user."""
-    bets = crud.get_bets_for_user(db, current_user.id, skip=skip, limit=limit)
+    """Return a paginated list of bets involving the current user.
+
+    Pages can be requested either with ``skip``/``limit`` or, preferably,
+    with the opaque ``cursor`` returned in the ``X-Next-Cursor`` header of
+    the previous page.  The header is omitted once there are no more bets.
+    Each page supports ``If-None-Match`` revalidation via the ``ETag`` header.
+    """
+    before = None
+    if cursor is not None:
+        try:
+            before = crud.decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    not_modified = await _check_etag(request, response, db, current_user.id)
+    if not_modified is not None:
+        return not_modified
+    if serialization.FAST_JSON:
+        rows = await crud.get_bet_rows_for_user(
+            db, current_user.id, serialization.BET_FIELDS, skip=skip, limit=limit, before=before
+        )
+        if rows and len(rows) == limit:
+            response.headers["X-Next-Cursor"] = crud.encode_cursor(rows[-1])
+        return Response(
+            serialization.dump_rows(serialization.BET_FIELDS, rows),
+            media_type="application/json",
+            headers=dict(response.headers),
+        )
+    bets = await crud.get_bets_for_user(
+        db, current_user.id, skip=skip, limit=limit, before=before
+    )
+    if bets and len(bets) == limit:
+        response.headers["X-Next-Cursor"] = crud.encode_cursor(bets[-1])
     return bets
 
 
+@app.get("/bets/history", response_model=List[schemas.BetOut])
+async def list_bet_history(
+    request: Request,
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Return all of the current user's bets, including archived ones.
+
+    `/bets` only lists bets still in the hot table; old resolved bets are
+    moved to the archive (see `tasks.archive_bets`) and only appear here.
+    Pages work like `/bets` cursor pagination: follow ``X-Next-Cursor``.
+    Supports ``If-None-Match`` revalidation via the ``ETag`` header.
+    """
+    before = None
+    if cursor is not None:
+        try:
+            before = crud.decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    not_modified = await _check_etag(request, response, db, current_user.id)
+    if not_modified is not None:
+        return not_modified
+    rows = await crud.get_bet_history(
+        db, current_user.id, serialization.BET_FIELDS, limit=limit, before=before
+    )
+    if rows and len(rows) == limit:
+        response.headers["X-Next-Cursor"] = crud.encode_cursor(rows[-1])
+    if serialization.FAST_JSON:
+        return Response(
+            serialization.dump_rows(serialization.BET_FIELDS, rows),
+            media_type="application/json",
+            headers=dict(response.headers),
+        )
+    return rows
+
+
+def _export_response(fmt: str, user_id: Optional[str], filename: str) -> StreamingResponse:
+    media_type, extension = export.FORMATS[fmt]
+    return StreamingResponse(
+        export.stream_bets(fmt, user_id),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{extension}"'},
+    )
+
+
+@app.get("/bets/export")
+async def export_bets(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    current_user: models.User = Depends(auth.get_current_user),
+):
+    """Download every bet involving the current user, archived ones included.
+
+    The bets are streamed oldest first as newline-delimited JSON (one
+    object per line, as in `/bets`) or as CSV with a header row.
+    """
+    return _export_response(format, current_user.id, "bets")
+
+
+@app.get("/admin/bets/export", dependencies=[Depends(auth.get_admin_user)])
+async def export_all_bets(format: Literal["ndjson", "csv"] = "ndjson"):
+    """Download every bet of every user, in ID order, for analytics.
+
+    Same formats as `/bets/export`.  Restricted to `auth.ADMIN_USER_IDS`.
+    """
+    return _export_response(format, None, "all-bets")
+
+
 @app.post("/bets", response_model=schemas.BetOut, status_code=status.HTTP_201_CREATED)
-def create_new_bet(
+async def create_new_bet(
     bet_in: schemas.BetCreate,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Create a new bet and ensure both participants are recorded locally."""
-    # Ensure opponent exists locally; create placeholder user record if necessary
-    opponent = db.query(models.User).filter(models.User.id == bet_in.opponent_id).first()
-    if opponent is None:
-        opponent = models.User(id=bet_in.opponent_id, email=None, username=None)
-        db.add(opponent)
-        db.commit()
-    bet = crud.create_bet(db, creator=current_user, bet_in=bet_in)
+    # Ensure opponent exists locally; the placeholder upsert (if any) is
+    # committed together with the bet.
+    created = await crud.ensure_users(db, [(bet_in.opponent_id, None)])
+    bet = await crud.create_bet(db, creator=current_user, bet_in=bet_in)
+    user_cache.mark_known(*created)
+    return bet
+
+
+# Upper bound on the number of bets accepted by a single batch request.
+MAX_BATCH_BETS = 100
+
+
+@app.post(
+    "/bets/batch", response_model=List[schemas.BetOut], status_code=status.HTTP_201_CREATED
+)
+async def create_bet_batch(
+    bets_in: List[schemas.BetCreate],
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Create several bets at once, e.g. for a group challenge.
+
+    The batch is atomic: either every bet is created or none is.  An
+    invalid item rejects the whole request with 422 and a batch larger
+    than `MAX_BATCH_BETS` with 413.  Missing opponents get placeholder
+    records in the same transaction.  The created bets are returned in
+    request order.
+    """
+    if len(bets_in) > MAX_BATCH_BETS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {MAX_BATCH_BETS} bets can be created per request",
+        )
+    created = await crud.ensure_users(db, [(bet_in.opponent_id, None) for bet_in in bets_in])
+    bets = await crud.create_bets(db, creator=current_user, bets_in=bets_in)
+    user_cache.mark_known(*created)
+    return bets
+
+
+# Bet state transitions.  Each is a single conditional UPDATE that checks
+# the bet's state and the caller's role while writing (see
+# `crud._transition_bet` and `crud.settle_bets`), so concurrent requests
+# for the same bet cannot both succeed.  The bet is only read back to
+# explain a refusal.
+
+_STATUS_CONFLICTS = {
+    models.BetStatus.ACTIVE: "Bet has already been accepted",
+    models.BetStatus.RESOLVED: "Bet has already been resolved",
+    models.BetStatus.EXPIRED: "Bet has expired",
+    models.BetStatus.DECLINED: "Bet has been declined",
+}
+
+
+async def _transition_error(
+    db: AsyncSession,
+    bet_id: int,
+    user_id: str,
+    action: str,
+    opponent_only: bool = False,
+    winner_id: Optional[str] = None,
+) -> HTTPException:
+    """Explain why ``user_id`` could not ``action`` the bet."""
+    bet = await crud.get_bet(db, bet_id)
+    if not bet:
+        return HTTPException(status_code=404, detail="Bet not found")
+    if user_id not in (bet.creator_id, bet.opponent_id) or (
+        opponent_only and user_id != bet.opponent_id
+    ):
+        return HTTPException(status_code=403, detail=f"Not authorized to {action} this bet")
+    if winner_id is not None and winner_id not in (bet.creator_id, bet.opponent_id):
+        return HTTPException(status_code=400, detail="Winner must be one of the participants")
+    # The bet may have changed again since the update: if it now looks
+    # eligible, another request got there first.
+    return HTTPException(
+        status_code=409, detail=_STATUS_CONFLICTS.get(bet.status, "Bet was changed concurrently")
+    )
+
+
+@app.put("/bets/{bet_id}/accept", response_model=schemas.BetOut)
+async def accept_bet(
+    bet_id: int,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Accept a pending bet; only its opponent may do so.  It becomes active."""
+    bet = await crud.accept_bet(db, bet_id, current_user.id)
+    if bet is None:
+        raise await _transition_error(db, bet_id, current_user.id, "accept", opponent_only=True)
+    return bet
+
+
+@app.put("/bets/{bet_id}/decline", response_model=schemas.BetOut)
+async def decline_bet(
+    bet_id: int,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Decline a pending bet; only its opponent may do so."""
+    bet = await crud.decline_bet(db, bet_id, current_user.id)
+    if bet is None:
+        raise await _transition_error(db, bet_id, current_user.id, "decline", opponent_only=True)
     return bet
 
 
 @app.put("/bets/{bet_id}/resolve", response_model=schemas.BetOut)
-def resolve_bet(
+async def resolve_bet(
     bet_id: int,
     winner_id: str,
     result: str,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    """Mark a bet as resolved by specifying the winner and result."""
-    bet = crud.get_bet(db, bet_id)
-    if not bet:
-        raise HTTPException(status_code=404, detail="Bet not found")
-    # Only allow participants to resolve
-    if current_user.id not in (bet.creator_id, bet.opponent_id):
-        raise HTTPException(status_code=403, detail="Not authorized to resolve this bet")
-    # Validate winner
-    if winner_id not in (bet.creator_id, bet.opponent_id):
-        raise HTTPException(status_code=400, detail="Winner must be one of the participants")
-    bet = crud.update_bet_result(db, bet, winner_id=winner_id, result=result)
-    return bet
+    """Mark an open (pending or active) bet as resolved with its winner and result.
+
+    Either participant may resolve the bet.  The wager is settled in the
+    same transaction.
+    """
+    settled = await crud.settle_bets(db, [(bet_id, winner_id, result)], actor_id=current_user.id)
+    if not settled:
+        raise await _transition_error(
+            db, bet_id, current_user.id, "resolve", winner_id=winner_id
+        )
+    return settled[0]
+
+
+@app.post("/bets/resolve", response_model=List[schemas.BetOut])
+async def resolve_bets(
+    resolutions: List[schemas.BetResolution],
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Resolve many bets and settle their wagers in one transaction.
+
+    Only bets in which the current user takes part, that are still open
+    (pending or active) and whose winner is one of the participants are settled;
+    the others are skipped.  The bets that were resolved are returned.
+    """
+    if len(resolutions) > MAX_BATCH_BETS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {MAX_BATCH_BETS} bets can be resolved per request",
+        )
+    return await crud.settle_bets(
+        db,
+        [(item.bet_id, item.winner_id, item.result) for item in resolutions],
+        actor_id=current_user.id,
+    )
 
 
 # User profile and friendship endpoints
 
+@app.get("/users/me/stats", response_model=schemas.UserStatsOut)
+async def read_my_stats(
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Return the current user's wins, losses, pending and active bets and net winnings."""
+    return await crud.get_user_stats(db, current_user.id)
+
+
+@app.get("/users/me/balance", response_model=schemas.BalanceOut)
+async def read_my_balance(
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Return the current user's virtual-currency balance."""
+    return schemas.BalanceOut(balance=await crud.get_balance(db, current_user.id))
+
+
 @app.put("/users/me", response_model=schemas.UserOut)
-def update_profile(
+async def update_profile(
     user_update: schemas.UserUpdate,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Update the current user's profile (username and/or email)."""
-    user = crud.update_user(db, current_user, user_update)
+    user = await crud.update_user(db, current_user, user_update)
     return user
 
 
 @app.get("/users/search", response_model=List[schemas.UserOut])
-def search_users(
+async def search_users(
     query: str,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Search for users by username or email.
 
     The current user is excluded from the results.  At most 20 users are returned.
     """
-    return crud.search_users(db, query, current_user.id)
+    return await crud.search_users(db, query, current_user.id)
 
 
 @app.post("/friends/{friend_id}", status_code=status.HTTP_201_CREATED)
-def add_friend(
+async def add_friend(
     friend_id: str,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Create a friendship with another user.
 
@@ -143,20 +609,130 @@ def add_friend(
     """
     if friend_id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot add yourself as a friend")
-    # Ensure the friend exists locally; create placeholder if necessary
-    friend = db.query(models.User).filter(models.User.id == friend_id).first()
-    if friend is None:
-        friend = models.User(id=friend_id, email=None, username=None)
-        db.add(friend)
-        db.commit()
-    crud.add_friend(db, current_user.id, friend_id)
+    # Ensure the friend exists locally; the placeholder upsert (if any) is
+    # committed together with the friendship.
+    created = await crud.ensure_users(db, [(friend_id, None)])
+    await crud.add_friend(db, current_user.id, friend_id)
+    user_cache.mark_known(*created)
     return {"detail": "Friend added"}
 
 
 @app.get("/friends", response_model=List[schemas.UserOut])
-def list_friends(
+async def list_friends(
+    request: Request,
+    response: Response,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Return the current user's friends.
+
+    Supports ``If-None-Match`` revalidation via the ``ETag`` header.
+    """
+    not_modified = await _check_etag(request, response, db, current_user.id)
+    if not_modified is not None:
+        return not_modified
+    return await crud.get_friends(db, current_user.id)
+
+
+@app.get("/friends/mutual/{user_id}", response_model=List[schemas.UserOut])
+async def list_mutual_friends(
+    user_id: str,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    """Return the current user's friends."""
-    return crud.get_friends(db, current_user.id)
+    """Return the friends the current user has in common with another user."""
+    return await crud.get_mutual_friends(db, current_user.id, user_id)
+
+
+@app.get("/friends/suggestions", response_model=List[schemas.FriendSuggestion])
+async def suggest_friends(
+    limit: int = Query(10, ge=1, le=50),
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Suggest friends-of-friends, ranked by the number of mutual friends."""
+    suggestions = await crud.get_friend_suggestions(db, current_user.id, limit=limit)
+    return [
+        schemas.FriendSuggestion(
+            id=user.id, username=user.username, email=user.email, mutual_friends=count
+        )
+        for user, count in suggestions
+    ]
+
+
+@app.get("/leaderboard/friends", response_model=List[schemas.LeaderboardEntry])
+async def friends_leaderboard(
+    limit: int = Query(20, ge=1, le=100),
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Rank the current user and their friends by net winnings."""
+    rows = await crud.get_friends_leaderboard(db, current_user.id, limit=limit)
+    return [
+        schemas.LeaderboardEntry(
+            id=user.id,
+            username=user.username,
+            wins=stats.wins if stats else 0,
+            losses=stats.losses if stats else 0,
+            net_winnings=stats.net_winnings if stats else 0,
+        )
+        for user, stats in rows
+    ]
+
+
+# Real-time updates
+
+@app.websocket("/ws")
+async def bet_events(websocket: WebSocket, token: Optional[str] = None):
+    """Push bet changes involving the current user as they happen.
+
+    Clients authenticate once, with the same Supabase JWT used for the
+    REST endpoints, passed either as a bearer ``Authorization`` header or
+    as the ``token`` query parameter.  Each message is a JSON object with
+    a ``type`` of ``bet.created``, ``bet.accepted``, ``bet.declined``,
+    ``bet.resolved`` or ``bet.expired`` and the affected ``bet``.  A
+    ``resync`` message means events were dropped because the client fell
+    behind, and it should re-fetch `/bets`.  The connection is closed
+    when the token expires.
+    """
+    if token is None:
+        scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+        token = credentials if scheme.lower() == "bearer" else None
+    try:
+        payload = await auth.decode_supabase_token_async(token or "")
+    except HTTPException:
+        payload = {}
+    if not payload.get("sub"):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    expires_at = payload.get("exp")
+
+    await websocket.accept()
+    subscription = hub.subscribe(payload["sub"])
+
+    async def send_events():
+        while True:
+            timeout = None if expires_at is None else max(expires_at - time.time(), 0)
+            try:
+                message = await asyncio.wait_for(subscription.get(), timeout)
+            except asyncio.TimeoutError:
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+                return
+            await websocket.send_text(message)
+
+    async def drain_client():
+        # Nothing is expected from the client; reading only detects disconnects.
+        while True:
+            await websocket.receive_text()
+
+    tasks_ = [asyncio.create_task(send_events()), asyncio.create_task(drain_client())]
+    try:
+        done, pending = await asyncio.wait(tasks_, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            exc = task.exception()
+            if exc is not None and not isinstance(exc, WebSocketDisconnect):
+                raise exc
+    finally:
+        hub.unsubscribe(subscription)
@@ -0,0 +1,348 @@
+"""
+Per-request instrumentation and the Prometheus ``/metrics`` exposition.
+
+`MetricsMiddleware` times every HTTP request and files it under its
+route template (``/bets/{bet_id}/resolve`` rather than the concrete
+path, so label cardinality stays bounded).  While a request runs, a
+`RequestStats` object travels with it in a context variable:
+
+* `instrument_engine` hooks SQLAlchemy's cursor events so that every
+  statement executed on behalf of the request is counted and timed;
+* `timed` records named phases, such as the authentication dependency
+  (`auth.get_current_user`) and JWKS fetches.
+
+Context variables follow the request into SQLAlchemy's greenlets and
+Starlette's threadpool, so statements and phases are attributed to the
+right request even under concurrency.  Whatever is left of a request's
+latency after auth and SQL is spent in the handler itself, mostly in
+serialisation.
+
+When a request exceeds the configured SQL statement or latency budget
+it is logged with its breakdown, which makes N+1 query patterns easy to
+spot.  Other modules' counters (caches, the event hub) are exported by
+registering a stats callable with `registry.register_stats`.
+
+Configuration
+-------------
+```
+METRICS_QUERY_BUDGET        Log requests executing more SQL statements than this (default 0: off).
+METRICS_LATENCY_BUDGET_MS   Log requests slower than this many milliseconds (default 0: off).
+```
+"""
+
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event
+
+
+logger = logging.getLogger(__name__)
+
+METRICS_QUERY_BUDGET = int(os.getenv("METRICS_QUERY_BUDGET", "0"))
+METRICS_LATENCY_BUDGET_MS = float(os.getenv("METRICS_LATENCY_BUDGET_MS", "0"))
+
+# Content type of the Prometheus text exposition format.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count per label set."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+                )
+        return lines
+
+
+class Histogram:
+    """Cumulative bucketed observations per label set."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float],
+        labelnames: Sequence[str] = (),
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        # Per label set: one count per bucket plus +Inf, then the sum.
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = series
+            counts[bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = (*self.labelnames, "le")
+        with self._lock:
+            for labels, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip((*self.buckets, "+Inf"), counts):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else _format_value(bound)
+                    lines.append(
+                        f"{self.name}_bucket{_format_labels(names, (*labels, le))} {cumulative}"
+                    )
+                suffix = _format_labels(self.labelnames, labels)
+                lines.append(f"{self.name}_sum{suffix} {_format_value(total[0])}")
+                lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class RequestStats:
+    """What one request spent its time on."""
+
+    __slots__ = ("queries", "query_seconds", "phases")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.phases: Dict[str, float] = defaultdict(float)
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    """Return the stats of the request being handled, if any."""
+    return _current.get()
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """Add the time spent in the ``with`` block to the request's ``phase``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _current.get()
+        if stats is not None:
+            stats.phases[phase] += time.perf_counter() - start
+
+
+class MetricsRegistry:
+    """The metrics exported by this process."""
+
+    def __init__(self):
+        self.requests = Counter(
+            "http_requests_total", "HTTP requests handled.", ("method", "route", "status")
+        )
+        self.latency = Histogram(
+            "http_request_duration_seconds",
+            "Time spent handling HTTP requests.",
+            LATENCY_BUCKETS,
+            ("method", "route"),
+        )
+        self.request_queries = Histogram(
+            "http_request_queries",
+            "SQL statements executed per HTTP request.",
+            QUERY_COUNT_BUCKETS,
+            ("method", "route"),
+        )
+        self.request_query_seconds = Histogram(
+            "http_request_query_duration_seconds",
+            "Time spent executing SQL per HTTP request.",
+            LATENCY_BUCKETS,
+            ("method", "route"),
+        )
+        self.phases = Histogram(
+            "http_request_phase_duration_seconds",
+            "Time spent in named phases (auth, jwks) per HTTP request.",
+            LATENCY_BUCKETS,
+            ("method", "route", "phase"),
+        )
+        self.queries = Counter("db_queries_total", "SQL statements executed.")
+        self.query_seconds = Counter(
+            "db_query_duration_seconds_total", "Time spent executing SQL statements."
+        )
+        self.budget_violations = Counter(
+            "http_request_budget_exceeded_total",
+            "Requests over the query or latency budget.",
+            ("method", "route", "budget"),
+        )
+        self.throttled = Counter(
+            "http_requests_throttled_total",
+            "Requests rejected by the per-user rate limiter.",
+            ("method", "route"),
+        )
+        self.shed = Counter(
+            "http_requests_shed_total",
+            "Requests shed by the concurrency cap.",
+            ("reason",),
+        )
+        self._stats: List[Tuple[str, str, Callable[[], Dict[str, float]]]] = []
+
+    def register_stats(
+        self, prefix: str, documentation: str, stats: Callable[[], Dict[str, float]]
+    ) -> None:
+        """Export each key of ``stats()`` as the gauge ``<prefix>_<key>``."""
+        self._stats.append((prefix, documentation, stats))
+
+    def observe_request(
+        self, method: str, route: str, status: int, seconds: float, stats: RequestStats
+    ) -> None:
+        self.requests.inc(method, route, str(status))
+        self.latency.observe(seconds, method, route)
+        self.request_queries.observe(stats.queries, method, route)
+        self.request_query_seconds.observe(stats.query_seconds, method, route)
+        for phase, phase_seconds in stats.phases.items():
+            self.phases.observe(phase_seconds, method, route, phase)
+
+        over = []
+        if METRICS_QUERY_BUDGET and stats.queries > METRICS_QUERY_BUDGET:
+            over.append("queries")
+        if METRICS_LATENCY_BUDGET_MS and seconds * 1000 > METRICS_LATENCY_BUDGET_MS:
+            over.append("latency")
+        if over:
+            for budget in over:
+                self.budget_violations.inc(method, route, budget)
+            phases = ", ".join(
+                f"{phase} {phase_seconds * 1000:.1f} ms"
+                for phase, phase_seconds in sorted(stats.phases.items())
+            )
+            logger.warning(
+                "%s %s over %s budget: %.1f ms, %d queries (%.1f ms in SQL)%s",
+                method,
+                route,
+                " and ".join(over),
+                seconds * 1000,
+                stats.queries,
+                stats.query_seconds * 1000,
+                f", {phases}" if phases else "",
+            )
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in (
+            self.requests,
+            self.latency,
+            self.request_queries,
+            self.request_query_seconds,
+            self.phases,
+            self.queries,
+            self.query_seconds,
+            self.budget_violations,
+            self.throttled,
+            self.shed,
+        ):
+            lines.extend(metric.render())
+        for prefix, documentation, stats in self._stats:
+            for key, value in sorted(stats().items()):
+                name = f"{prefix}_{key}"
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Shared by every request handled by this process.
+registry = MetricsRegistry()
+
+
+def instrument_engine(sync_engine) -> None:
+    """Count and time the statements executed by ``sync_engine``.
+
+    For an async engine pass its ``sync_engine`` attribute.
+    """
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_query_start"].pop()
+        registry.queries.inc()
+        registry.query_seconds.inc(amount=elapsed)
+        stats = _current.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_seconds += elapsed
+
+    @event.listens_for(sync_engine, "handle_error")
+    def failed_query(exception_context):
+        connection = exception_context.connection
+        starts = connection.info.get("metrics_query_start") if connection is not None else None
+        if starts:
+            starts.pop()
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording every HTTP request in `registry`."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = _current.set(stats)
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current.reset(token)
+            # The router stores the matched route in the (shared) scope.
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            registry.observe_request(scope["method"], route_path, status_code, elapsed, stats)
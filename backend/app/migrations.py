@@ -0,0 +1,451 @@
+"""
+Versioned schema migrations.
+
+The schema is no longer created as a side effect of importing the app.
+Instead, this module holds an ordered list of migrations, each building
+part of the schema from the models in `models.py`, and records the ones
+applied in a `schema_version` table.  Run them before (re)deploying:
+
+```
+python -m app.migrations upgrade          # apply every pending migration
+python -m app.migrations upgrade --to 3   # stop after migration 3
+python -m app.migrations current          # print the database's version
+python -m app.migrations history          # list migrations and whether applied
+```
+
+At startup the app only compares the recorded version with `HEAD` (one
+query, see `check_schema`) and refuses to serve an outdated schema,
+unless `AUTO_MIGRATE` is set, in which case it upgrades first.  That is
+convenient for development but every worker would then race to
+migrate, so production deployments should run the CLI once instead.
+
+Every migration is idempotent (tables and indexes are created only if
+missing, backfills recompute their target), so a database created by
+the old import-time ``create_all`` is brought under version control by
+simply running ``upgrade``: it starts at version 0 and each migration
+fills in whatever that database lacks.
+
+Configuration
+-------------
+```
+AUTO_MIGRATE   Set to 1 to apply pending migrations at startup (default 0).
+```
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List, Optional
+import argparse
+import logging
+import os
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    and_,
+    case,
+    delete,
+    func,
+    insert,
+    inspect,
+    select,
+    text,
+    union_all,
+)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from . import models
+
+
+logger = logging.getLogger(__name__)
+
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "0") == "1"
+
+# Kept out of `Base.metadata` so that it is managed only by this module.
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# Arbitrary key for the Postgres advisory lock serialising migrators.
+_ADVISORY_LOCK_KEY = 7_245_113
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+
+
+def _create_tables(conn: Connection, *tables: Table) -> None:
+    for table in tables:
+        table.create(conn, checkfirst=True)
+
+
+def _create_indexes(conn: Connection, table: Table, *names: str) -> None:
+    """Create the named indexes of ``table``'s model.
+
+    Never all of its indexes: a migration must only create those it
+    introduced, as later ones may cover columns added by later migrations.
+    """
+    indexes = {index.name: index for index in table.indexes}
+    # IF NOT EXISTS rather than reflection, which skips expression indexes.
+    for name in names:
+        conn.execute(CreateIndex(indexes[name], if_not_exists=True))
+
+
+# Migrations.  Once released, a migration must never change (beyond
+# keeping it runnable against later models): append a new one instead.
+# Tables are created from the current models, but indexes and columns
+# are named explicitly so that a migration never touches what a later
+# one introduces.
+
+
+def _baseline(conn: Connection) -> None:
+    """Users, bets and friendships, as originally created by ``create_all``."""
+    _create_tables(
+        conn, models.User.__table__, models.Bet.__table__, models.Friendship.__table__
+    )
+
+
+def _query_indexes(conn: Connection) -> None:
+    """Indexes added after the tables existed: create_all never added them."""
+    _create_indexes(
+        conn, models.User.__table__, "ix_users_username_lower", "ix_users_email_lower"
+    )
+    _create_indexes(
+        conn, models.Bet.__table__, "ix_bets_creator_created", "ix_bets_opponent_created"
+    )
+    _create_indexes(conn, models.Friendship.__table__, "ix_friendships_friend_id")
+
+
+def _user_search(conn: Connection) -> None:
+    """Substring search index over usernames and emails."""
+    for statement in models.USER_SEARCH_DDL.get(conn.dialect.name, []):
+        conn.execute(text(statement))
+
+
+def _user_stats(conn: Connection) -> None:
+    """Per-user stats table, backfilled from existing bets."""
+    _create_tables(conn, models.UserStats.__table__)
+    bet = models.Bet
+    participants = union_all(
+        select(bet.creator_id.label("user_id"), bet.status, bet.winner_id, bet.wager),
+        # A bet against oneself counts once.
+        select(bet.opponent_id, bet.status, bet.winner_id, bet.wager).where(
+            bet.opponent_id != bet.creator_id
+        ),
+    ).subquery()
+    resolved = participants.c.status == models.BetStatus.RESOLVED
+    won = and_(resolved, participants.c.winner_id == participants.c.user_id)
+    lost = and_(resolved, participants.c.winner_id != participants.c.user_id)
+    conn.execute(delete(models.UserStats))
+    conn.execute(
+        insert(models.UserStats).from_select(
+            ["user_id", "wins", "losses", "pending", "net_winnings"],
+            select(
+                participants.c.user_id,
+                func.sum(case((won, 1), else_=0)),
+                func.sum(case((lost, 1), else_=0)),
+                func.sum(
+                    case(
+                        (
+                            participants.c.status.in_(
+                                [models.BetStatus.PENDING, models.BetStatus.ACTIVE]
+                            ),
+                            1,
+                        ),
+                        else_=0,
+                    )
+                ),
+                func.sum(
+                    case(
+                        (won, participants.c.wager),
+                        (lost, -participants.c.wager),
+                        else_=0,
+                    )
+                ),
+            ).group_by(participants.c.user_id),
+        )
+    )
+
+
+def _ledger(conn: Connection) -> None:
+    """Ledger, balances and snapshots; settles bets resolved before the ledger."""
+    _create_tables(
+        conn,
+        models.LedgerEntry.__table__,
+        models.Balance.__table__,
+        models.BalanceSnapshot.__table__,
+    )
+    bet = models.Bet
+    entry = models.LedgerEntry
+    unsettled = and_(
+        bet.status == models.BetStatus.RESOLVED,
+        # Bets against oneself move no money.
+        bet.creator_id != bet.opponent_id,
+        bet.winner_id.in_([bet.creator_id, bet.opponent_id]),
+        ~select(entry.id).where(entry.bet_id == bet.id).exists(),
+    )
+    settled_at = func.coalesce(bet.resolved_at, bet.created_at)
+    loser = case((bet.winner_id == bet.creator_id, bet.opponent_id), else_=bet.creator_id)
+    columns = ["user_id", "bet_id", "amount", "created_at"]
+    # Both selects must see the same unsettled bets, so compute them first.
+    rows = conn.execute(
+        union_all(
+            select(bet.winner_id, bet.id, bet.wager, settled_at).where(unsettled),
+            select(loser, bet.id, -bet.wager, settled_at).where(unsettled),
+        )
+    ).all()
+    if rows:
+        conn.execute(insert(entry), [dict(zip(columns, row)) for row in rows])
+    conn.execute(delete(models.Balance))
+    conn.execute(
+        insert(models.Balance).from_select(
+            ["user_id", "balance"],
+            select(entry.user_id, func.sum(entry.amount)).group_by(entry.user_id),
+        )
+    )
+
+
+def _user_versions(conn: Connection) -> None:
+    """Per-user data versions backing ETags."""
+    _create_tables(conn, models.UserVersion.__table__)
+
+
+def _bet_archive(conn: Connection) -> None:
+    """Archive table for old resolved bets, and the index the archiver scans.
+
+    Archived bets leave `bets`, so ledger entries can no longer reference
+    it: the foreign key is dropped where the database enforces it.
+    """
+    _create_tables(conn, models.BetArchive.__table__)
+    _create_indexes(conn, models.Bet.__table__, "ix_bets_status_resolved")
+    if conn.dialect.name == "sqlite":
+        return
+    for foreign_key in inspect(conn).get_foreign_keys(models.LedgerEntry.__tablename__):
+        if foreign_key["referred_table"] == models.Bet.__tablename__ and foreign_key["name"]:
+            conn.execute(
+                text(
+                    f"ALTER TABLE {models.LedgerEntry.__tablename__} "
+                    f'DROP CONSTRAINT "{foreign_key["name"]}"'
+                )
+            )
+
+
+def _bet_deadlines(conn: Connection) -> None:
+    """Optional bet deadlines, the expired status and the expiry index."""
+    inspector = inspect(conn)
+    for model in (models.Bet, models.BetArchive):
+        table = model.__table__
+        if "deadline" not in {column["name"] for column in inspector.get_columns(table.name)}:
+            column_type = table.c.deadline.type.compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN deadline {column_type}"))
+    _create_indexes(conn, models.Bet.__table__, "ix_bets_status_deadline")
+    if conn.dialect.name == "postgresql":
+        # Enum columns are stored by member name.
+        enum_name = models.Bet.__table__.c.status.type.name
+        value = models.BetStatus.EXPIRED.name
+        conn.execute(text(f"ALTER TYPE {enum_name} ADD VALUE IF NOT EXISTS '{value}'"))
+
+
+def _declined_status(conn: Connection) -> None:
+    """The declined bet status (only Postgres stores the enum's values)."""
+    if conn.dialect.name == "postgresql":
+        enum_name = models.Bet.__table__.c.status.type.name
+        value = models.BetStatus.DECLINED.name
+        conn.execute(text(f"ALTER TYPE {enum_name} ADD VALUE IF NOT EXISTS '{value}'"))
+
+
+def _active_stats(conn: Connection) -> None:
+    """Active bets counted apart from pending ones; no wins for bets against oneself.
+
+    Every user's stats are recomputed from `bets` and `bets_archive`.
+    """
+    table = models.UserStats.__table__
+    if "active" not in {column["name"] for column in inspect(conn).get_columns(table.name)}:
+        conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN active INTEGER NOT NULL DEFAULT 0"))
+    sides = []
+    for bet in (models.Bet, models.BetArchive):
+        against_oneself = bet.creator_id == bet.opponent_id
+        sides.append(
+            select(
+                bet.creator_id.label("user_id"),
+                bet.status,
+                bet.winner_id,
+                bet.wager,
+                against_oneself.label("against_oneself"),
+            )
+        )
+        # A bet against oneself counts once.
+        sides.append(
+            select(bet.opponent_id, bet.status, bet.winner_id, bet.wager, against_oneself).where(
+                ~against_oneself
+            )
+        )
+    participants = union_all(*sides).subquery()
+    # Bets against oneself move no money, so they are neither won nor lost.
+    resolved = and_(
+        participants.c.status == models.BetStatus.RESOLVED, ~participants.c.against_oneself
+    )
+    won = and_(resolved, participants.c.winner_id == participants.c.user_id)
+    lost = and_(resolved, participants.c.winner_id != participants.c.user_id)
+
+    def count(status):
+        return func.sum(case((participants.c.status == status, 1), else_=0))
+
+    conn.execute(delete(models.UserStats))
+    conn.execute(
+        insert(models.UserStats).from_select(
+            ["user_id", "wins", "losses", "pending", "active", "net_winnings"],
+            select(
+                participants.c.user_id,
+                func.sum(case((won, 1), else_=0)),
+                func.sum(case((lost, 1), else_=0)),
+                count(models.BetStatus.PENDING),
+                count(models.BetStatus.ACTIVE),
+                func.sum(
+                    case(
+                        (won, participants.c.wager),
+                        (lost, -participants.c.wager),
+                        else_=0,
+                    )
+                ),
+            ).group_by(participants.c.user_id),
+        )
+    )
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline tables", _baseline),
+    Migration(2, "query indexes", _query_indexes),
+    Migration(3, "user search index", _user_search),
+    Migration(4, "user stats", _user_stats),
+    Migration(5, "ledger and balances", _ledger),
+    Migration(6, "user versions", _user_versions),
+    Migration(7, "bet archive", _bet_archive),
+    Migration(8, "bet deadlines", _bet_deadlines),
+    Migration(9, "declined status", _declined_status),
+    Migration(10, "active bet stats", _active_stats),
+]
+
+HEAD = MIGRATIONS[-1].version
+
+
+def current_version(conn: Connection) -> int:
+    """Return the highest applied migration (0 for an unversioned database)."""
+    if not inspect(conn).has_table(schema_version.name):
+        return 0
+    return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade(engine: Engine, target: Optional[int] = None) -> List[int]:
+    """Apply pending migrations up to ``target`` (default `HEAD`).
+
+    Each migration runs in its own transaction together with its
+    `schema_version` row.  Returns the versions applied.
+    """
+    with engine.connect() as conn:
+        return _upgrade(conn, target)
+
+
+def _upgrade(conn: Connection, target: Optional[int] = None) -> List[int]:
+    target = HEAD if target is None else target
+    applied = []
+    if conn.dialect.name == "postgresql":
+        conn.execute(select(func.pg_advisory_lock(_ADVISORY_LOCK_KEY)))
+        conn.commit()
+    try:
+        with conn.begin():
+            schema_version.create(conn, checkfirst=True)
+        for migration in MIGRATIONS:
+            if migration.version > target:
+                break
+            with conn.begin():
+                # Re-read inside the transaction: another migrator may
+                # have got here first.
+                if current_version(conn) >= migration.version:
+                    continue
+                logger.info("Applying migration %d: %s", migration.version, migration.name)
+                migration.apply(conn)
+                conn.execute(
+                    insert(schema_version).values(
+                        version=migration.version,
+                        name=migration.name,
+                        applied_at=datetime.utcnow(),
+                    )
+                )
+            applied.append(migration.version)
+    finally:
+        if conn.dialect.name == "postgresql":
+            conn.execute(select(func.pg_advisory_unlock(_ADVISORY_LOCK_KEY)))
+            conn.commit()
+    return applied
+
+
+async def check_schema(engine: AsyncEngine) -> int:
+    """Verify at startup that the database is at `HEAD`; returns its version.
+
+    Costs a single query.  With `AUTO_MIGRATE` an outdated database is
+    upgraded instead of rejected.
+    """
+    try:
+        async with engine.connect() as conn:
+            version = (
+                await conn.execute(select(func.max(schema_version.c.version)))
+            ).scalar() or 0
+    except DBAPIError:
+        # No schema_version table: a new or never-migrated database.
+        version = 0
+    if version < HEAD:
+        if not AUTO_MIGRATE:
+            raise RuntimeError(
+                f"Database schema is at version {version}, this code needs {HEAD}. "
+                "Run `python -m app.migrations upgrade` (or set AUTO_MIGRATE=1)."
+            )
+        async with engine.connect() as conn:
+            await conn.run_sync(_upgrade)
+        version = HEAD
+    elif version > HEAD:
+        logger.warning("Database schema version %d is newer than this code (%d)", version, HEAD)
+    return version
+
+
+def main() -> None:
+    from .database import engine
+
+    parser = argparse.ArgumentParser(description="Manage the database schema.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    upgrade_parser = commands.add_parser("upgrade", help="apply pending migrations")
+    upgrade_parser.add_argument("--to", type=int, help="last migration to apply")
+    commands.add_parser("current", help="print the database's schema version")
+    commands.add_parser("history", help="list migrations")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.command == "upgrade":
+        applied = upgrade(engine, args.to)
+        print(f"Applied {len(applied)} migration(s); database is at version ", end="")
+    with engine.connect() as conn:
+        version = current_version(conn)
+    if args.command == "history":
+        for migration in MIGRATIONS:
+            mark = "x" if migration.version <= version else " "
+            print(f"[{mark}] {migration.version:>3}  {migration.name}")
+    else:
+        print(version)
+
+
+if __name__ == "__main__":
+    main()
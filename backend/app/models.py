@@ -17,9 +17,10 @@ from sqlalchemy import (
     DateTime,
     Enum,
     ForeignKey,
+    Index,
 )
 from sqlalchemy.orm import relationship
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, func
 
 from .database import Base
 
@@ -64,11 +65,62 @@ class User(Base):
         "Friendship", back_populates="friend", foreign_keys="Friendship.friend_id", cascade="all, delete-orphan"
     )
 
+    # Case-insensitive lookups used by user search to find exact and prefix
+    # matches with an index range scan.
+    __table_args__ = (
+        Index("ix_users_username_lower", func.lower(username)),
+        Index("ix_users_email_lower", func.lower(email)),
+    )
+
+
+# Substring search index over usernames and emails.
+#
+# On SQLite this is an FTS5 table using the trigram tokenizer, stored as
+# an external-content index over `users` (keyed by the implicit rowid) and
+# kept in sync by triggers.  `VACUUM` may renumber those rowids, so run
+# `INSERT INTO users_search(users_search) VALUES ('rebuild')` afterwards.
+# On Postgres, trigram GIN indexes from `pg_trgm` let the planner answer
+# `lower(column) LIKE '%q%'` without a sequential scan.  Created by the
+# "user search index" migration (see `migrations`).
+USER_SEARCH_DDL = {
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS users_search USING fts5("
+        "username, email, content='users', content_rowid='rowid', tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS users_search_ai AFTER INSERT ON users BEGIN "
+        "INSERT INTO users_search(rowid, username, email) "
+        "VALUES (new.rowid, new.username, new.email); END",
+        "CREATE TRIGGER IF NOT EXISTS users_search_ad AFTER DELETE ON users BEGIN "
+        "INSERT INTO users_search(users_search, rowid, username, email) "
+        "VALUES ('delete', old.rowid, old.username, old.email); END",
+        "CREATE TRIGGER IF NOT EXISTS users_search_au AFTER UPDATE ON users BEGIN "
+        "INSERT INTO users_search(users_search, rowid, username, email) "
+        "VALUES ('delete', old.rowid, old.username, old.email); "
+        "INSERT INTO users_search(rowid, username, email) "
+        "VALUES (new.rowid, new.username, new.email); END",
+        "INSERT INTO users_search(users_search) VALUES ('rebuild')",
+    ],
+    "postgresql": [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+        "ON users USING gin (lower(username) gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_users_email_trgm "
+        "ON users USING gin (lower(email) gin_trgm_ops)",
+    ],
+}
+
 
 class BetStatus(str, enum.Enum):
     PENDING = "pending"
     ACTIVE = "active"
     RESOLVED = "resolved"
+    # A pending bet whose deadline passed (see `crud.expire_bets`).
+    EXPIRED = "expired"
+    # A pending bet its opponent turned down (see `crud.decline_bet`).
+    DECLINED = "declined"
+
+
+# Bets that can still be resolved.
+OPEN_STATUSES = (BetStatus.PENDING, BetStatus.ACTIVE)
 
 
 
@@ -90,6 +142,8 @@ class Bet(Base):
     created_at: datetime = Column(DateTime, default=datetime.utcnow)
     resolved_at: Optional[datetime] = Column(DateTime, nullable=True)
     result: Optional[str] = Column(String(50), nullable=True)
+    # Optional: a bet still pending at its deadline expires.
+    deadline: Optional[datetime] = Column(DateTime, nullable=True)
 
     # relationships
     creator = relationship(
@@ -100,6 +154,48 @@ class Bet(Base):
     )
     winner = relationship("User", foreign_keys=[winner_id])
 
+    # Composite indexes backing keyset pagination of a user's bets: each
+    # side of the creator/opponent union is an index range scan that
+    # already yields rows in (created_at, id) order.  The last two let
+    # the archiver and the expiry job find their bets without scanning
+    # the table.
+    __table_args__ = (
+        Index("ix_bets_creator_created", "creator_id", "created_at", "id"),
+        Index("ix_bets_opponent_created", "opponent_id", "created_at", "id"),
+        Index("ix_bets_status_resolved", "status", "resolved_at"),
+        Index("ix_bets_status_deadline", "status", "deadline"),
+    )
+
+
+class BetArchive(Base):
+    """Resolved and expired bets moved out of `bets` once they are old enough.
+
+    Same columns as `Bet`, so rows move between the tables with a plain
+    ``INSERT ... SELECT``; keep the two in step.  Bets keep their IDs, so
+    ledger entries still identify them.  See `crud.archive_bets`.
+    """
+
+    __tablename__ = "bets_archive"
+
+    id: int = Column(Integer, primary_key=True, autoincrement=False)
+    description: str = Column(Text, nullable=False)
+    wager: int = Column(Integer, nullable=False)
+    status: str = Column(Enum(BetStatus), nullable=False)
+
+    creator_id: str = Column(String(36), ForeignKey("users.id"), nullable=False)
+    opponent_id: str = Column(String(36), ForeignKey("users.id"), nullable=False)
+    winner_id: Optional[str] = Column(String(36), ForeignKey("users.id"), nullable=True)
+
+    created_at: datetime = Column(DateTime)
+    resolved_at: Optional[datetime] = Column(DateTime, nullable=True)
+    result: Optional[str] = Column(String(50), nullable=True)
+    deadline: Optional[datetime] = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_bets_archive_creator_created", "creator_id", "created_at", "id"),
+        Index("ix_bets_archive_opponent_created", "opponent_id", "created_at", "id"),
+    )
+
 
 class Friendship(Base):
     """Represents a mutual friendship between two users.
@@ -112,10 +208,101 @@ class Friendship(Base):
 
     id: int = Column(Integer, primary_key=True, index=True)
     user_id: str = Column(String(36), ForeignKey("users.id"), nullable=False)
-    friend_id: str = Column(String(36), ForeignKey("users.id"), nullable=False)
+    friend_id: str = Column(String(36), ForeignKey("users.id"), nullable=False, index=True)
     created_at: datetime = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="friends", foreign_keys=[user_id])
     friend = relationship("User", back_populates="friend_of", foreign_keys=[friend_id])
 
     __table_args__ = (UniqueConstraint("user_id", "friend_id", name="uq_friendship_pair"),)
+
+
+class UserVersion(Base):
+    """Per-user counter bumped whenever data the user can read changes.
+
+    Bet creation and resolution, new friendships and profile updates
+    (including those of a user's friends) increment the counter in the
+    same transaction.  The API derives ETags from it, so an unchanged
+    version means the user's bets, friends and profile are unchanged.
+    """
+
+    __tablename__ = "user_versions"
+
+    user_id: str = Column(String(36), ForeignKey("users.id"), primary_key=True)
+    version: int = Column(Integer, nullable=False, default=0)
+
+
+class UserStats(Base):
+    """Running totals of a user's bets.
+
+    Rows are maintained incrementally by the CRUD helpers in the same
+    transaction as the bet change that affects them, so reading a user's
+    record never requires aggregating over `bets`.  `pending` counts bets
+    awaiting the opponent's answer and `active` accepted ones not yet
+    resolved.  A bet against oneself counts once, and never as a win or
+    loss: like the ledger, the stats move no money for it.
+    """
+
+    __tablename__ = "user_stats"
+
+    user_id: str = Column(String(36), ForeignKey("users.id"), primary_key=True)
+    wins: int = Column(Integer, nullable=False, default=0)
+    losses: int = Column(Integer, nullable=False, default=0)
+    pending: int = Column(Integer, nullable=False, default=0)
+    active: int = Column(Integer, nullable=False, default=0)
+    net_winnings: int = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (Index("ix_user_stats_net_winnings", "net_winnings"),)
+
+
+class LedgerEntry(Base):
+    """Append-only record of virtual currency moving into or out of a balance.
+
+    Settling a bet writes one entry per participant (the winner's is
+    positive, the loser's negative).  The unique constraint guarantees a
+    bet can never be settled twice for the same user.  `bet_id` has no
+    foreign key because the bet may since have moved to `bets_archive`.
+    """
+
+    __tablename__ = "ledger_entries"
+
+    id: int = Column(Integer, primary_key=True)
+    user_id: str = Column(String(36), ForeignKey("users.id"), nullable=False, index=True)
+    bet_id: int = Column(Integer, nullable=False)
+    amount: int = Column(Integer, nullable=False)
+    created_at: datetime = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (UniqueConstraint("bet_id", "user_id", name="uq_ledger_bet_user"),)
+
+
+class Balance(Base):
+    """A user's current virtual-currency balance.
+
+    Always equal to the sum of the user's ledger entries.  Balances are
+    only ever changed with atomic ``balance = balance + :delta`` updates
+    in the same transaction as the ledger entries that explain them.
+    """
+
+    __tablename__ = "balances"
+
+    user_id: str = Column(String(36), ForeignKey("users.id"), primary_key=True)
+    balance: int = Column(Integer, nullable=False, default=0)
+
+
+class BalanceSnapshot(Base):
+    """Point-in-time copy of every balance.
+
+    `ledger_id` is the highest ledger entry included in the snapshot, so a
+    balance can be rebuilt from the latest snapshot plus the entries after
+    it instead of replaying the whole ledger.
+    """
+
+    __tablename__ = "balance_snapshots"
+
+    id: int = Column(Integer, primary_key=True)
+    user_id: str = Column(String(36), ForeignKey("users.id"), nullable=False)
+    balance: int = Column(Integer, nullable=False)
+    ledger_id: int = Column(Integer, nullable=False)
+    taken_at: datetime = Column(DateTime, nullable=False, index=True)
+
+    __table_args__ = (Index("ix_balance_snapshots_user", "user_id", "taken_at"),)
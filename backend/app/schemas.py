@@ -6,10 +6,10 @@ the API.  They are separate from the SQLAlchemy models to allow clean
 validation and control over exposed fields.
 """
 
-from datetime import datetime
-from typing import Optional
+from datetime import datetime, timezone
+from typing import List, Optional
 
-from pydantic import BaseModel, EmailStr, constr
+from pydantic import BaseModel, EmailStr, constr, field_validator
 
 
 # User schemas
@@ -27,6 +27,12 @@ class UserOut(BaseModel):
         orm_mode = True
 
 
+class FriendSuggestion(UserOut):
+    """A suggested friend and how many friends they share with the user."""
+
+    mutual_friends: int
+
+
 class UserUpdate(BaseModel):
     """Schema for updating the current user's profile.
 
@@ -46,7 +52,29 @@ class BetBase(BaseModel):
 
 
 class BetCreate(BetBase):
-    pass
+    """A new bet.  If it is still pending at ``deadline`` it expires.
+
+    The deadline must lie in the future; it is stored as naive UTC.
+    """
+
+    deadline: Optional[datetime] = None
+
+    @field_validator("deadline")
+    @classmethod
+    def deadline_in_future(cls, value: Optional[datetime]) -> Optional[datetime]:
+        if value is None:
+            return None
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        if value <= datetime.utcnow():
+            raise ValueError("deadline must be in the future")
+        return value
+
+
+class BetResolution(BaseModel):
+    bet_id: int
+    winner_id: str
+    result: str
 
 
 class BetOut(BaseModel):
@@ -60,6 +88,49 @@ class BetOut(BaseModel):
     created_at: datetime
     resolved_at: Optional[datetime]
     result: Optional[str]
+    deadline: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+
+# Stats schemas
+class UserStatsOut(BaseModel):
+    wins: int = 0
+    losses: int = 0
+    pending: int = 0
+    active: int = 0
+    net_winnings: int = 0
 
     class Config:
         orm_mode = True
+
+
+class LeaderboardEntry(BaseModel):
+    id: str
+    username: Optional[str] = None
+    wins: int
+    losses: int
+    net_winnings: int
+
+
+class BalanceOut(BaseModel):
+    balance: int = 0
+
+
+# Feed schemas
+class PendingCounts(BaseModel):
+    """Pending bets awaiting the user (``incoming``) or their opponent (``outgoing``)."""
+
+    incoming: int = 0
+    outgoing: int = 0
+
+
+class FeedOut(BaseModel):
+    """The `/me/feed` response; sections not requested are omitted."""
+
+    profile: Optional[UserOut] = None
+    bets: Optional[List[BetOut]] = None
+    next_cursor: Optional[str] = None
+    friends: Optional[List[UserOut]] = None
+    pending: Optional[PendingCounts] = None
@@ -0,0 +1,44 @@
+"""
+Fast JSON encoding of trusted database rows for list endpoints.
+
+By default FastAPI validates every ORM object returned by an endpoint
+against its `response_model` and then encodes the result with the
+standard library's JSON encoder.  For long lists this costs more than
+the query itself.  Rows read back from our own database need no
+validation, so when the fast path is enabled the list endpoints select
+plain column tuples (see `crud.get_bet_rows_for_user`) and encode them
+directly with orjson.
+
+The output is byte-for-byte what the regular path produces: the same
+keys in schema order, compact separators, unescaped UTF-8, enums as
+their values and naive datetimes in ISO 8601.  `bench.serialization`
+checks this and compares the speed of the two paths.
+
+Configuration
+-------------
+```
+FAST_JSON   Set to 1 to serve list endpoints through the fast path (default 0).
+            Ignored when orjson is not installed.
+```
+"""
+
+from typing import Iterable, Sequence
+import os
+
+try:
+    import orjson
+except ImportError:  # optional speed-up, see FAST_JSON
+    orjson = None
+
+from . import schemas
+
+
+FAST_JSON = os.getenv("FAST_JSON", "0") == "1" and orjson is not None
+
+# Columns selected for, and keys emitted by, the fast `/bets` path.
+BET_FIELDS = tuple(schemas.BetOut.model_fields)
+
+
+def dump_rows(fields: Sequence[str], rows: Iterable[Sequence]) -> bytes:
+    """Encode ``rows`` as a JSON array of objects keyed by ``fields``."""
+    return orjson.dumps([dict(zip(fields, row)) for row in rows])
@@ -0,0 +1,248 @@
+"""
+Multi-worker server entry point.
+
+``uvicorn app.main:app`` serves every request from a single process and
+so from a single core.  This module runs the app on all of them:
+
+```
+python -m app.server                      # one worker per CPU on 0.0.0.0:8000
+python -m app.server --workers 4 --port 8080
+```
+
+The parent process binds the listening socket, imports the application
+once (preloading it) and then forks the workers, which inherit both and
+let the kernel spread incoming connections between them.  Before
+forking, the parent applies pending migrations when `AUTO_MIGRATE` is
+set (so that the workers never race to do it) and fetches the JWKS, so
+every worker starts with the keys already in memory.  No database
+connection is open at that point; each worker opens its own pool, whose
+size is its share of the configured total (see `database`).
+
+Each worker runs uvicorn on the inherited socket.  Its lifespan hook
+checks the schema and warms the worker up (see `warmup`) before it
+starts accepting connections, so a new or restarted worker never
+serves a request cold.  Background jobs (see `tasks`) run in the first
+worker only.  A worker that dies is replaced; one that fails during
+startup stops the server instead of being restarted in a loop.
+
+On SIGTERM or SIGINT the parent asks every worker to shut down: each
+stops accepting connections, lets in-flight requests finish for up to
+`SERVER_GRACEFUL_TIMEOUT` seconds, runs the lifespan shutdown and
+exits.  Workers still alive shortly after that are killed.
+
+Every worker keeps its own caches, limits and metrics, so ``/metrics``
+describes whichever worker answered the scrape.  Requires ``fork``
+(Linux or macOS).
+
+Configuration
+-------------
+```
+WEB_CONCURRENCY           Number of worker processes (default: number of CPUs).
+SERVER_HOST               Interface to listen on (default 0.0.0.0).
+SERVER_PORT               Port to listen on (default 8000).
+SERVER_BACKLOG            Pending connections queued by the kernel (default 2048).
+SERVER_GRACEFUL_TIMEOUT   Seconds in-flight requests get to finish on shutdown (default 30).
+SERVER_LOG_LEVEL          Uvicorn log level (default info).
+```
+"""
+
+from typing import Dict, Optional
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", "2048"))
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))
+SERVER_LOG_LEVEL = os.getenv("SERVER_LOG_LEVEL", "info")
+
+# A worker exiting sooner than this after being forked failed to start.
+_MIN_WORKER_LIFETIME = 5.0
+# Extra time, beyond the graceful timeout, for the lifespan shutdown.
+_SHUTDOWN_MARGIN = 10.0
+
+# Uvicorn configures this logger; the supervisor's messages go with its own.
+logger = logging.getLogger("uvicorn.error")
+
+
+def default_workers() -> int:
+    return int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1
+
+
+def _preload(workers: int):
+    """Import the app (sizing the pools for ``workers``) and prepare it for forking."""
+    # Read by `database` on import to give every worker its share of the pool.
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    from . import database, migrations, warmup
+    from .main import app
+
+    if migrations.AUTO_MIGRATE:
+        migrations.upgrade(database.engine)
+    try:
+        warmup.prefetch_jwks()
+    except RuntimeError as exc:
+        # Each worker retries during its own warm-up.
+        logger.warning("Could not prefetch the JWKS: %s", exc)
+    # Connections must never be shared across a fork.
+    database.engine.dispose()
+    return app
+
+
+def _reset_after_fork() -> None:
+    """Drop any pooled connection inherited from the parent without closing it."""
+    from . import database
+
+    for engine in (database.engine, database.async_engine, database.async_read_engine):
+        if engine is not None:
+            getattr(engine, "sync_engine", engine).dispose(close=False)
+
+
+def _run_worker(config: uvicorn.Config, sock: socket.socket, first: bool) -> None:
+    """Body of a forked worker process; never returns."""
+    from . import tasks
+
+    status = 0
+    try:
+        _reset_after_fork()
+        tasks.BACKGROUND_JOBS = tasks.BACKGROUND_JOBS and first
+        # Uvicorn re-raises the signal that stopped it once it has shut
+        # down; ignoring it lets the worker exit normally afterwards.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        server = uvicorn.Server(config)
+        server.run(sockets=[sock])
+        if not server.started:
+            # The lifespan startup failed (e.g. an outdated schema).
+            status = 3
+    except BaseException:
+        logger.exception("Worker %d crashed", os.getpid())
+        status = 1
+    finally:
+        logging.shutdown()
+        os._exit(status)
+
+
+def _spawn(config: uvicorn.Config, sock: socket.socket, first: bool) -> int:
+    pid = os.fork()
+    if pid == 0:
+        _run_worker(config, sock, first)
+    return pid
+
+
+def _stop(workers: Dict[int, float], sig: int, timeout: float) -> None:
+    """Send ``sig`` to every worker and wait ``timeout`` seconds, then kill the rest."""
+    for pid in workers:
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + timeout
+    while workers and time.monotonic() < deadline:
+        pid, _ = os.waitpid(-1, os.WNOHANG)
+        if pid:
+            workers.pop(pid, None)
+        else:
+            time.sleep(0.1)
+    for pid in workers:
+        logger.warning("Killing worker %d after the graceful timeout", pid)
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+
+def serve(
+    app=None,
+    workers: Optional[int] = None,
+    host: str = SERVER_HOST,
+    port: int = SERVER_PORT,
+    backlog: int = SERVER_BACKLOG,
+    graceful_timeout: int = SERVER_GRACEFUL_TIMEOUT,
+    log_level: str = SERVER_LOG_LEVEL,
+) -> int:
+    """Serve ``app`` (`app.main.app` by default) from ``workers`` processes.
+
+    A custom ``app`` must be built around `app.main.app` after
+    ``WEB_CONCURRENCY`` is set to ``workers``, or the pools will be sized
+    for a single worker.  Blocks until the server is stopped by a signal
+    or a worker fails to start; returns the exit status.
+    """
+    workers = workers or default_workers()
+    config = uvicorn.Config(
+        "app.main:app",
+        host=host,
+        port=port,
+        backlog=backlog,
+        timeout_graceful_shutdown=graceful_timeout,
+        log_level=log_level,
+        lifespan="on",
+    )
+    preloaded = _preload(workers)
+    config.app = app if app is not None else preloaded
+    config.load()
+    sock = config.bind_socket()
+    sock.listen(backlog)
+
+    stopping = []
+
+    def handle_signal(sig, frame):
+        stopping.append(sig)
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    # Worker pid -> its slot (slot 0 runs the background jobs) and fork time.
+    slots: Dict[int, int] = {}
+    started: Dict[int, float] = {}
+    for slot in range(workers):
+        pid = _spawn(config, sock, slot == 0)
+        slots[pid], started[pid] = slot, time.monotonic()
+    logger.info("Serving on %s:%d with %d worker(s) [%d]", host, port, workers, os.getpid())
+
+    status = 0
+    while not stopping:
+        pid, wait_status = os.waitpid(-1, os.WNOHANG)
+        if not pid:
+            time.sleep(0.2)
+            continue
+        slot, forked_at = slots.pop(pid), started.pop(pid)
+        code = os.waitstatus_to_exitcode(wait_status)
+        if time.monotonic() - forked_at < _MIN_WORKER_LIFETIME:
+            logger.error("Worker %d failed to start (exit code %d); stopping", pid, code)
+            status = 1
+            break
+        logger.warning("Worker %d exited (exit code %d); replacing it", pid, code)
+        pid = _spawn(config, sock, slot == 0)
+        slots[pid], started[pid] = slot, time.monotonic()
+
+    _stop(started, signal.SIGTERM, graceful_timeout + _SHUTDOWN_MARGIN)
+    sock.close()
+    logger.info("Server stopped")
+    return status
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve the API from several worker processes.")
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--graceful-timeout", type=int, default=SERVER_GRACEFUL_TIMEOUT)
+    args = parser.parse_args()
+    sys.exit(
+        serve(
+            workers=args.workers,
+            host=args.host,
+            port=args.port,
+            graceful_timeout=args.graceful_timeout,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Background jobs run inside the API process.
+
+Jobs are started from the application's lifespan hook in `main.py` and
+cancelled on shutdown.  Each job opens its own database session, runs,
+and then sleeps until its next run; a failing run is logged and does
+not stop later runs.
+
+The jobs only need to run once per deployment, so with several worker
+processes `server` enables them in the first worker only.
+
+Configuration
+-------------
+```
+BACKGROUND_JOBS             Set to 0 to run no background jobs in this process (default 1).
+BALANCE_SNAPSHOT_INTERVAL   Seconds between balance snapshots (default 86400, 0 disables).
+BALANCE_SNAPSHOT_RETAIN     Number of snapshots to keep (default 2).
+BET_ARCHIVE_INTERVAL        Seconds between archiver runs (default 3600, 0 disables).
+BET_ARCHIVE_AFTER_DAYS      Archive bets closed more than this many days ago (default 90).
+BET_ARCHIVE_BATCH_SIZE      Bets moved per transaction (default 500).
+BET_ARCHIVE_BATCH_PAUSE     Seconds to yield to other writers between batches (default 0.05).
+BET_EXPIRY_INTERVAL         Seconds between runs expiring overdue bets (default 60, 0 disables).
+BET_EXPIRY_BATCH_SIZE       Bets expired per transaction (default 500).
+```
+"""
+
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List
+import asyncio
+import logging
+import os
+import time
+
+from . import crud
+from .database import AsyncSessionLocal
+
+
+BACKGROUND_JOBS = os.getenv("BACKGROUND_JOBS", "1") == "1"
+BALANCE_SNAPSHOT_INTERVAL = float(os.getenv("BALANCE_SNAPSHOT_INTERVAL", "86400"))
+BALANCE_SNAPSHOT_RETAIN = int(os.getenv("BALANCE_SNAPSHOT_RETAIN", "2"))
+BET_ARCHIVE_INTERVAL = float(os.getenv("BET_ARCHIVE_INTERVAL", "3600"))
+BET_ARCHIVE_AFTER_DAYS = float(os.getenv("BET_ARCHIVE_AFTER_DAYS", "90"))
+BET_ARCHIVE_BATCH_SIZE = int(os.getenv("BET_ARCHIVE_BATCH_SIZE", "500"))
+BET_ARCHIVE_BATCH_PAUSE = float(os.getenv("BET_ARCHIVE_BATCH_PAUSE", "0.05"))
+BET_EXPIRY_INTERVAL = float(os.getenv("BET_EXPIRY_INTERVAL", "60"))
+BET_EXPIRY_BATCH_SIZE = int(os.getenv("BET_EXPIRY_BATCH_SIZE", "500"))
+
+logger = logging.getLogger(__name__)
+
+
+async def run_periodically(
+    name: str, interval: float, job: Callable[[], Awaitable[None]]
+) -> None:
+    """Run ``job`` every ``interval`` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await job()
+        except Exception:
+            logger.exception("Background job %s failed", name)
+
+
+async def snapshot_balances() -> None:
+    async with AsyncSessionLocal() as db:
+        rows = await crud.snapshot_balances(db, retain=BALANCE_SNAPSHOT_RETAIN)
+    logger.info("Snapshotted %d balances", rows)
+
+
+# Totals of the expiry job, exported through `/metrics`.
+expiry_stats: Dict[str, float] = {
+    "runs": 0,
+    "batches": 0,
+    "expired": 0,
+    "batch_seconds": 0.0,
+    "last_batch_seconds": 0.0,
+}
+
+
+async def expire_bets() -> None:
+    """Expire overdue pending bets in batches, logging each batch."""
+    now = datetime.utcnow()
+    expiry_stats["runs"] += 1
+    while True:
+        start = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            expired = len(await crud.expire_bets(db, now, limit=BET_EXPIRY_BATCH_SIZE))
+        elapsed = time.perf_counter() - start
+        if expired:
+            expiry_stats["batches"] += 1
+            expiry_stats["expired"] += expired
+            expiry_stats["batch_seconds"] += elapsed
+            expiry_stats["last_batch_seconds"] = elapsed
+            logger.info("Expired %d bets in %.1f ms", expired, elapsed * 1000)
+        if expired < BET_EXPIRY_BATCH_SIZE:
+            break
+        # Let queued requests reach the database between batches.
+        await asyncio.sleep(0)
+
+
+async def archive_bets() -> None:
+    """Move old closed bets to the archive, one short transaction per batch."""
+    cutoff = datetime.utcnow() - timedelta(days=BET_ARCHIVE_AFTER_DAYS)
+    total = 0
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    while True:
+        async with AsyncSessionLocal() as db:
+            moved = await crud.archive_bets(db, cutoff, limit=BET_ARCHIVE_BATCH_SIZE)
+        total += moved
+        if moved < BET_ARCHIVE_BATCH_SIZE:
+            break
+        await asyncio.sleep(BET_ARCHIVE_BATCH_PAUSE)
+    logger.info("Archived %d bets in %.1f s", total, loop.time() - start)
+
+
+def start_background_jobs() -> List[asyncio.Task]:
+    """Start every enabled job and return their tasks."""
+    jobs = []
+    if not BACKGROUND_JOBS:
+        return jobs
+    if BALANCE_SNAPSHOT_INTERVAL > 0:
+        jobs.append(
+            asyncio.create_task(
+                run_periodically("snapshot_balances", BALANCE_SNAPSHOT_INTERVAL, snapshot_balances)
+            )
+        )
+    if BET_EXPIRY_INTERVAL > 0:
+        jobs.append(
+            asyncio.create_task(
+                run_periodically("expire_bets", BET_EXPIRY_INTERVAL, expire_bets)
+            )
+        )
+    if BET_ARCHIVE_INTERVAL > 0:
+        jobs.append(
+            asyncio.create_task(
+                run_periodically("archive_bets", BET_ARCHIVE_INTERVAL, archive_bets)
+            )
+        )
+    return jobs
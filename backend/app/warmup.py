@@ -0,0 +1,153 @@
+"""
+Warm-up run by every worker before it accepts traffic.
+
+A freshly started process is cold: the JWKS has not been fetched, the
+connection pools are empty, SQLAlchemy has compiled none of the hot
+statements (nor has the driver prepared them), and `user_cache` does
+not know a single user, so the first requests after a restart or a
+deploy pay for all of it at once.  `warm_up` pays it up front, from the
+application's lifespan hook, before the worker starts accepting
+connections:
+
+* the JWKS is fetched (a no-op when `server` already fetched it before
+  forking the workers);
+* `WARMUP_CONNECTIONS` connections are opened on every engine and left
+  in the pool;
+* on each of those connections the statements behind the hot read
+  endpoints are executed once, which fills the engine's compiled-SQL
+  cache and the driver's per-connection statement cache;
+* the most recently active users are loaded into `user_cache`, so their
+  requests skip the user lookup (and the placeholder upsert) at once;
+* the friendship index is loaded if it is enabled (see `graph`).
+
+A step that fails is logged and skipped; the whole warm-up is bounded by
+`WARMUP_TIMEOUT`.  A cold worker is slower, never broken, so warm-up
+problems never prevent the app from starting.
+
+Configuration
+-------------
+```
+WARMUP_ENABLED       Set to 0 to skip the warm-up (default 1).
+WARMUP_CONNECTIONS   Connections opened per engine (default: the worker's pool size).
+WARMUP_USERS         Recently active users loaded into the user cache (default 1000).
+WARMUP_TIMEOUT       Seconds after which the warm-up is abandoned (default 30).
+```
+"""
+
+from contextlib import AsyncExitStack
+from typing import Dict
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+from sqlalchemy.pool import QueuePool
+from starlette.concurrency import run_in_threadpool
+
+from . import auth, crud
+from .cache import user_cache
+from .database import POOL_OPTIONS, AsyncSessionLocal, async_engine, async_read_engine
+from .graph import friend_graph
+from .serialization import BET_FIELDS
+
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", str(POOL_OPTIONS["pool_size"])))
+WARMUP_USERS = int(os.getenv("WARMUP_USERS", "1000"))
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "30"))
+
+# Never a real user: the primer queries only need to run, not to match.
+_PRIMER_USER_ID = "00000000-0000-0000-0000-000000000000"
+
+logger = logging.getLogger(__name__)
+
+# Outcome of the last warm-up, reported in `/metrics`.
+stats: Dict[str, float] = {"seconds": 0.0, "connections": 0, "users": 0, "failed_steps": 0}
+
+
+def prefetch_jwks() -> None:
+    """Fetch the JWKS unless the keys are already loaded and fresh."""
+    if auth.JWKS_URL:
+        # With no key ID, `get_key` only (re)loads the key set if needed.
+        auth.get_jwks_client(auth.JWKS_URL).get_key(None)
+
+
+async def prime_statements(conn: AsyncConnection) -> None:
+    """Run the statements behind the hot read endpoints once on ``conn``."""
+    async with AsyncSession(bind=conn, autoflush=False) as db:
+        await crud.get_user(db, _PRIMER_USER_ID)
+        await crud.get_version(db, _PRIMER_USER_ID)
+        await crud.get_bet_rows_for_user(db, _PRIMER_USER_ID, BET_FIELDS, limit=1)
+        await crud.get_user_stats(db, _PRIMER_USER_ID)
+        await crud.get_balance(db, _PRIMER_USER_ID)
+        await crud.get_friends(db, _PRIMER_USER_ID)
+        await crud.get_friends_leaderboard(db, _PRIMER_USER_ID, limit=1)
+
+
+async def open_connections(engine: AsyncEngine, count: int) -> int:
+    """Open ``count`` connections at once, prime each, and return them to the pool.
+
+    Engines without a sized pool (in-memory SQLite) get a single one.
+    """
+    if not isinstance(engine.pool, QueuePool):
+        count = 1
+    async with AsyncExitStack() as stack:
+        connections = [await stack.enter_async_context(engine.connect()) for _ in range(count)]
+        for conn in connections:
+            await prime_statements(conn)
+    return len(connections)
+
+
+async def load_users(limit: int) -> int:
+    """Load the ``limit`` most recently active users into `user_cache`."""
+    async with AsyncSessionLocal() as db:
+        users = await crud.get_recently_active_users(db, limit)
+    for user in users:
+        user_cache.put(user)
+    return len(users)
+
+
+async def load_friend_graph() -> None:
+    async with AsyncSessionLocal() as db:
+        await friend_graph.ensure_loaded(db)
+
+
+async def _step(name: str, coro):
+    try:
+        return await coro
+    except Exception:
+        logger.warning("Warm-up step %s failed", name, exc_info=True)
+        stats["failed_steps"] += 1
+        return 0
+
+
+async def _warm_up() -> None:
+    await _step("jwks", run_in_threadpool(prefetch_jwks))
+    connections = 0
+    for engine in filter(None, (async_engine, async_read_engine)):
+        connections += await _step("connections", open_connections(engine, WARMUP_CONNECTIONS))
+    stats["connections"] = connections
+    if WARMUP_USERS > 0:
+        stats["users"] = await _step("users", load_users(WARMUP_USERS))
+    if friend_graph.enabled:
+        await _step("friend_graph", load_friend_graph())
+
+
+async def warm_up() -> None:
+    """Warm this process up (see the module docstring); never raises."""
+    if not WARMUP_ENABLED:
+        return
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(_warm_up(), WARMUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("Warm-up abandoned after %.0f seconds", WARMUP_TIMEOUT)
+        stats["failed_steps"] += 1
+    stats["seconds"] = time.perf_counter() - start
+    logger.info(
+        "Warmed up in %.3fs: %d connection(s), %d user(s)",
+        stats["seconds"],
+        stats["connections"],
+        stats["users"],
+    )
@@ -0,0 +1,2 @@
+# Benchmarks for the betting API.  Each module is runnable on its own,
+# e.g. `python -m bench.search`, from the `backend` directory.
@@ -0,0 +1,245 @@
+"""
+Synthetic dataset generator for benchmarks and load tests.
+
+Fills the schema from `app.models` with a population that behaves like a
+real one rather than a uniform one:
+
+* user activity follows a Zipf distribution, so a few users create and
+  receive most of the bets;
+* the friend graph is grown by preferential attachment, giving the
+  power-law degree distribution of real social graphs;
+* most bets are between friends, older bets are more likely to be
+  resolved, and wagers are log-normally distributed;
+* derived tables (`user_stats`, the ledger and balances) are filled in
+  consistently with the bets, as if every bet had gone through the API.
+
+Run from the `backend` directory:
+
+```
+python -m bench.dataset --users 10000 --bets 200000 --out /tmp/bench.db
+```
+"""
+
+import argparse
+import json
+import random
+import time
+import uuid
+from bisect import bisect
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import Dict, List, Set
+
+from sqlalchemy import insert
+
+from app import migrations, models
+from app.database import make_engine
+
+
+BATCH_SIZE = 10000
+
+# Share of bets in each status; older bets are the ones resolved.
+STATUS_MIX = {
+    models.BetStatus.RESOLVED: 0.65,
+    models.BetStatus.ACTIVE: 0.10,
+    models.BetStatus.PENDING: 0.25,
+}
+
+RESULTS = ["won fair and square", "photo finish", "on penalties", "by a mile", "disputed"]
+TOPICS = ["match", "race", "election", "bake-off", "quiz night", "marathon", "chess game"]
+
+
+@dataclass
+class Dataset:
+    """IDs of what was generated, for load drivers to pick from."""
+
+    user_ids: List[str]
+    activity: List[float]
+    friends: Dict[str, Set[str]] = field(default_factory=dict)
+    open_bets: Dict[str, List[int]] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self._cumulative = list(accumulate(self.activity))
+
+    def pick_user(self, rng: random.Random) -> str:
+        """Pick a user, weighted by activity."""
+        return self.user_ids[bisect(self._cumulative, rng.random() * self._cumulative[-1])]
+
+
+def _zipf_weights(n: int, exponent: float, rng: random.Random) -> List[float]:
+    weights = [1.0 / (rank ** exponent) for rank in range(1, n + 1)]
+    rng.shuffle(weights)
+    return weights
+
+
+def _friend_graph(user_ids: List[str], avg_friends: int, rng: random.Random):
+    """Grow a friend graph by preferential attachment (Barabási–Albert)."""
+    edges_per_user = max(1, avg_friends // 2)
+    friends: Dict[str, Set[str]] = defaultdict(set)
+    # Every endpoint of every edge, so sampling from it is proportional
+    # to degree.
+    endpoints: List[str] = []
+    for index, user_id in enumerate(user_ids):
+        if index == 0:
+            continue
+        targets: Set[str] = set()
+        wanted = min(edges_per_user, index)
+        while len(targets) < wanted:
+            if endpoints and rng.random() < 0.9:
+                targets.add(rng.choice(endpoints))
+            else:
+                targets.add(user_ids[rng.randrange(index)])
+        for target in targets:
+            friends[user_id].add(target)
+            friends[target].add(user_id)
+            endpoints.extend((user_id, target))
+    return friends
+
+
+def generate(
+    url: str,
+    users: int,
+    bets: int,
+    avg_friends: int = 20,
+    days: int = 180,
+    seed: int = 1,
+) -> Dataset:
+    """Create the schema at ``url`` and fill it; returns what was generated."""
+    if users < 2:
+        raise ValueError("need at least two users to place bets")
+    rng = random.Random(seed)
+    user_ids = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(users)]
+    activity = _zipf_weights(users, 1.1, rng)
+    dataset = Dataset(user_ids, activity)
+    dataset.friends = _friend_graph(user_ids, avg_friends, rng)
+
+    now = datetime.utcnow()
+    first = now - timedelta(days=days)
+    created = sorted(first + timedelta(seconds=rng.uniform(0, days * 86400)) for _ in range(bets))
+    statuses = list(STATUS_MIX)
+    cumulative = list(accumulate(STATUS_MIX.values()))
+
+    bet_rows, ledger_rows = [], []
+    stats: Dict[str, Counter] = defaultdict(Counter)
+    balances: Counter = Counter()
+    for bet_id, created_at in enumerate(created, start=1):
+        creator = dataset.pick_user(rng)
+        creator_friends = dataset.friends.get(creator)
+        if creator_friends and rng.random() < 0.8:
+            opponent = rng.choice(sorted(creator_friends))
+        else:
+            opponent = dataset.pick_user(rng)
+            while opponent == creator:
+                opponent = dataset.pick_user(rng)
+        # Position in time decides the status: the oldest bets are resolved.
+        status = statuses[bisect(cumulative, bet_id / (bets + 1) * cumulative[-1])]
+        wager = max(1, min(1000, int(rng.lognormvariate(3, 1))))
+        row = {
+            "id": bet_id,
+            "description": f"Who wins the {rng.choice(TOPICS)} #{bet_id}?",
+            "wager": wager,
+            "status": status,
+            "creator_id": creator,
+            "opponent_id": opponent,
+            "winner_id": None,
+            "created_at": created_at,
+            "resolved_at": None,
+            "result": None,
+        }
+        if status == models.BetStatus.RESOLVED:
+            winner = rng.choice((creator, opponent))
+            loser = opponent if winner == creator else creator
+            resolved_at = min(now, created_at + timedelta(hours=rng.expovariate(1 / 48)))
+            row.update(winner_id=winner, resolved_at=resolved_at, result=rng.choice(RESULTS))
+            stats[winner].update(wins=1, net_winnings=wager)
+            stats[loser].update(losses=1, net_winnings=-wager)
+            for user_id, amount in ((winner, wager), (loser, -wager)):
+                ledger_rows.append(
+                    {
+                        "user_id": user_id,
+                        "bet_id": bet_id,
+                        "amount": amount,
+                        "created_at": resolved_at,
+                    }
+                )
+                balances[user_id] += amount
+        else:
+            for participant in (creator, opponent):
+                # The `pending` or `active` counter.
+                stats[participant][status.value] += 1
+                dataset.open_bets.setdefault(participant, []).append(bet_id)
+        bet_rows.append(row)
+
+    engine = make_engine(url)
+    migrations.upgrade(engine)
+    with engine.begin() as conn:
+        user_rows = [
+            {"id": user_id, "username": f"user_{i}", "email": f"user_{i}@example.com"}
+            for i, user_id in enumerate(user_ids)
+        ]
+        friendship_rows = [
+            {"user_id": user_id, "friend_id": friend_id}
+            for user_id, friend_ids in dataset.friends.items()
+            for friend_id in friend_ids
+        ]
+        stats_rows = [
+            {
+                "user_id": user_id,
+                "wins": delta["wins"],
+                "losses": delta["losses"],
+                "pending": delta["pending"],
+                "active": delta["active"],
+                "net_winnings": delta["net_winnings"],
+            }
+            for user_id, delta in stats.items()
+        ]
+        balance_rows = [
+            {"user_id": user_id, "balance": amount} for user_id, amount in balances.items()
+        ]
+        for model, rows in (
+            (models.User, user_rows),
+            (models.Friendship, friendship_rows),
+            (models.Bet, bet_rows),
+            (models.LedgerEntry, ledger_rows),
+            (models.UserStats, stats_rows),
+            (models.Balance, balance_rows),
+        ):
+            for start in range(0, len(rows), BATCH_SIZE):
+                conn.execute(insert(model), rows[start:start + BATCH_SIZE])
+    engine.dispose()
+    return dataset
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--bets", type=int, default=100000)
+    parser.add_argument("--avg-friends", type=int, default=20)
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", required=True, help="path of the SQLite file to create")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    dataset = generate(
+        f"sqlite:///{args.out}", args.users, args.bets, args.avg_friends, args.days, args.seed
+    )
+    degrees = sorted((len(friends) for friends in dataset.friends.values()), reverse=True)
+    print(
+        json.dumps(
+            {
+                "users": args.users,
+                "bets": args.bets,
+                "friendships": sum(degrees),
+                "max_friends": degrees[0] if degrees else 0,
+                "median_friends": degrees[len(degrees) // 2] if degrees else 0,
+                "seconds": round(time.perf_counter() - start, 2),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
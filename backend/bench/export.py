@@ -0,0 +1,104 @@
+"""
+Benchmark the memory use of the streaming bet export.
+
+For each size a throwaway SQLite database is filled with that many
+synthetic bets for one user (see `bench.serialization.populate`), then
+the user's export is consumed through `export.stream_bets` while
+`tracemalloc` records the peak Python heap.  For comparison the same
+bets are also read the way a client of the list endpoint would have to,
+by paging through `crud.get_bets_for_user` and keeping the ORM objects
+of every page.  The streaming peak should stay flat as the history
+grows.  Run from the `backend` directory:
+
+```
+python -m bench.export --sizes 1000 10000 100000
+```
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from .serialization import USER_ID, populate
+
+
+async def measure(url: str, fmt: str) -> dict:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    from app import crud, export
+    from app.database import async_engine
+
+    results = {}
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = 0
+    async for chunk in export.stream_bets(fmt, USER_ID):
+        size += len(chunk)
+    results["stream"] = {
+        "peak_kib": round(tracemalloc.get_traced_memory()[1] / 1024),
+        "seconds": round(time.perf_counter() - start, 3),
+        "bytes": size,
+    }
+    tracemalloc.stop()
+
+    engine = create_async_engine(url)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    tracemalloc.start()
+    start = time.perf_counter()
+    bets = []
+    async with sessions() as db:
+        while True:
+            page = await crud.get_bets_for_user(db, USER_ID, skip=len(bets), limit=100)
+            bets.extend(page)
+            if len(page) < 100:
+                break
+    results["paged"] = {
+        "peak_kib": round(tracemalloc.get_traced_memory()[1] / 1024),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    tracemalloc.stop()
+    await engine.dispose()
+    await async_engine.dispose()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="emit machine-readable output")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # `app` reads DATABASE_URL once, on import, so every size reuses the
+        # same file, recreated from scratch.
+        path = os.path.join(tmp, "export.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+        os.environ.pop("ASYNC_DATABASE_URL", None)
+        os.environ.pop("DATABASE_READ_URL", None)
+        for size in args.sizes:
+            for name in os.listdir(tmp):
+                os.remove(os.path.join(tmp, name))
+            populate(os.environ["DATABASE_URL"], size, args.seed)
+            results[size] = asyncio.run(measure(f"sqlite+aiosqlite:///{path}", args.format))
+
+    if args.json:
+        print(json.dumps({"format": args.format, "results": results}))
+        return
+    print(f"{'bets':>8}{'stream KiB':>12}{'stream s':>10}{'paged KiB':>12}{'paged s':>10}")
+    for size, result in results.items():
+        stream, paged = result["stream"], result["paged"]
+        print(
+            f"{size:>8}{stream['peak_kib']:>12}{stream['seconds']:>10}"
+            f"{paged['peak_kib']:>12}{paged['seconds']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
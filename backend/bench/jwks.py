@@ -0,0 +1,91 @@
+"""
+Local stand-in for the Supabase JWKS endpoint.
+
+Benchmarks should exercise the real token verification in `app.auth`
+(RS256 signature check against keys fetched from a JWKS URL) without
+talking to Supabase.  `StubJWKS` generates an RSA key pair, serves the
+public half from a local HTTP server and mints tokens signed with the
+private half.  Call `StubJWKS.configure_env` before importing `app` so
+that `auth` picks up the stub's URL, audience and issuer.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+
+AUDIENCE = "authenticated"
+ISSUER = "bench-issuer"
+
+
+class StubJWKS:
+    """A one-key JWKS served over HTTP on ``127.0.0.1``."""
+
+    def __init__(self, kid: str = "bench-key"):
+        self.kid = kid
+        # Signing with the key object rather than its PEM spares a costly
+        # key parse (and consistency check) on every token minted.
+        self._private_key = private_key = rsa.generate_private_key(
+            public_exponent=65537, key_size=2048
+        )
+        public_pem = private_key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        public = jwk.construct(public_pem, "RS256").to_dict()
+        public.update(kid=kid, alg="RS256", use="sig")
+        body = json.dumps(
+            {"keys": [{k: v.decode() if isinstance(v, bytes) else v for k, v in public.items()}]}
+        ).encode()
+        stub = self
+        self.requests = 0
+        # Seconds each response is held back, to simulate a slow endpoint.
+        self.delay = 0.0
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                if stub.delay:
+                    time.sleep(stub.delay)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_port}/.well-known/jwks.json"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def configure_env(self, environ: Optional[dict] = None) -> dict:
+        """Point the `app.auth` settings in ``environ`` (default `os.environ`) at the stub."""
+        environ = os.environ if environ is None else environ
+        environ.update(
+            SUPABASE_JWT_JWKS_URL=self.url,
+            SUPABASE_JWT_AUDIENCE=AUDIENCE,
+            SUPABASE_JWT_ISSUER=ISSUER,
+        )
+        return environ
+
+    def mint(self, sub: str, email: Optional[str] = None, ttl: int = 3600) -> str:
+        """Return a signed access token for user ``sub``."""
+        now = int(time.time())
+        claims = {"sub": sub, "aud": AUDIENCE, "iss": ISSUER, "iat": now, "exp": now + ttl}
+        if email is not None:
+            claims["email"] = email
+        return jwt.encode(
+            claims, self._private_key, algorithm="RS256", headers={"kid": self.kid}
+        )
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,505 @@
+"""
+Load driver for the betting API.
+
+Generates a synthetic dataset (see `bench.dataset`), starts a stub JWKS
+(see `bench.jwks`) so every request goes through the real RS256 token
+verification, then runs a weighted mix of requests against every HTTP
+endpoint in `app.main` from many concurrent virtual users.  Users are
+picked by the dataset's activity skew, so popular users dominate just
+as they would in production.
+
+The app can be driven in-process through httpx's ASGI transport, which
+isolates the application's own cost, or over real HTTP against a
+uvicorn server started in a subprocess.  Either way the app is wrapped
+in a small ASGI shim that counts the SQL statements each request
+executes and returns the count in an ``X-Bench-Queries`` header.
+``--workers N`` serves the app through `app.server` with N preloaded
+worker processes instead (it implies ``--http``); compare the
+throughput of ``--workers 1`` and ``--workers <cores>`` to see how the
+app scales with cores.
+
+Results (per-endpoint throughput, p50/p95/p99 latency, error counts and
+queries per request) are printed as JSON so runs of different commits
+can be compared.  Run from the `backend` directory:
+
+```
+python -m bench.load --users 5000 --bets 100000 --duration 30 --concurrency 32
+python -m bench.load --http --duration 30 --out results.json
+python -m bench.load --workers 4 --concurrency 64 --duration 30
+```
+
+Requires httpx (see `bench/requirements.txt`).
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import httpx
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .jwks import StubJWKS
+
+if TYPE_CHECKING:
+    from .dataset import Dataset
+
+# Nothing from `app` may be imported at module level: it reads its
+# configuration on import, which has to wait until the scratch database
+# and the stub JWKS exist.
+
+
+QUERY_HEADER = "x-bench-queries"
+
+_query_count: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar(
+    "bench_query_count", default=None
+)
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = _query_count.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def count_queries(app):
+    """Wrap an ASGI ``app`` so responses report their SQL statement count."""
+    if not event.contains(Engine, "before_cursor_execute", _count_query):
+        event.listen(Engine, "before_cursor_execute", _count_query)
+
+    async def counted(scope, receive, send):
+        if scope["type"] != "http":
+            await app(scope, receive, send)
+            return
+        counter = [0]
+        token = _query_count.set(counter)
+
+        async def send_with_count(message):
+            if message["type"] == "http.response.start":
+                headers = [*message.get("headers", []), (QUERY_HEADER.encode(), b"%d" % counter[0])]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await app(scope, receive, send_with_count)
+        finally:
+            _query_count.reset(token)
+
+    return counted
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of sorted ``samples``."""
+    if not samples:
+        return 0.0
+    index = max(0, min(len(samples) - 1, int(round(pct / 100 * len(samples) + 0.5)) - 1))
+    return samples[index]
+
+
+class Driver:
+    """Runs scenarios as the dataset's users and records every request."""
+
+    def __init__(self, client: httpx.AsyncClient, dataset: "Dataset", jwks: StubJWKS, seed: int):
+        self.client = client
+        self.dataset = dataset
+        self.jwks = jwks
+        self.rng = random.Random(seed)
+        self.recording = False
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.queries: Dict[str, List[int]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.failures: Dict[str, int] = defaultdict(int)
+        self._tokens: Dict[str, str] = {}
+        self._resolved: set = set()
+
+    def headers(self, user_id: str) -> Dict[str, str]:
+        token = self._tokens.get(user_id)
+        if token is None:
+            token = self._tokens[user_id] = self.jwks.mint(user_id)
+        return {"Authorization": f"Bearer {token}"}
+
+    async def request(self, label: str, user_id: str, method: str, url: str, **kwargs):
+        headers = self.headers(user_id)
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, headers=headers, **kwargs)
+        except httpx.HTTPError:
+            if self.recording:
+                self.failures[label] += 1
+            return None
+        elapsed = (time.perf_counter() - start) * 1000
+        if self.recording:
+            self.latencies[label].append(elapsed)
+            self.statuses[label][response.status_code] += 1
+            if QUERY_HEADER in response.headers:
+                self.queries[label].append(int(response.headers[QUERY_HEADER]))
+        return response
+
+    # Helpers for picking realistic arguments.
+
+    def friend_of(self, user_id: str) -> Optional[str]:
+        friends = self.dataset.friends.get(user_id)
+        return self.rng.choice(sorted(friends)) if friends else None
+
+    def opponent_for(self, user_id: str) -> str:
+        opponent = self.friend_of(user_id)
+        while opponent is None or opponent == user_id:
+            opponent = self.dataset.pick_user(self.rng)
+        return opponent
+
+    def take_open_bets(self, user_id: str, count: int) -> List[int]:
+        open_bets = self.dataset.open_bets.get(user_id, [])
+        taken = []
+        while open_bets and len(taken) < count:
+            bet_id = open_bets.pop()
+            if bet_id not in self._resolved:
+                self._resolved.add(bet_id)
+                taken.append(bet_id)
+        return taken
+
+    def remember_bets(self, bets: List[dict]) -> None:
+        for bet in bets:
+            for participant in (bet["creator_id"], bet["opponent_id"]):
+                self.dataset.open_bets.setdefault(participant, []).append(bet["id"])
+
+    def bet_payload(self, user_id: str) -> dict:
+        return {
+            "description": f"Bench bet {self.rng.getrandbits(32):08x}",
+            "wager": self.rng.randint(1, 200),
+            "opponent_id": self.opponent_for(user_id),
+        }
+
+
+# Scenarios: one per endpoint, each issuing the request(s) a client would.
+
+
+async def read_me(driver: Driver, user_id: str) -> None:
+    await driver.request("GET /users/me", user_id, "GET", "/users/me")
+
+
+async def read_feed(driver: Driver, user_id: str) -> None:
+    await driver.request("GET /me/feed", user_id, "GET", "/me/feed")
+
+
+async def list_bets(driver: Driver, user_id: str) -> None:
+    response = await driver.request("GET /bets", user_id, "GET", "/bets", params={"limit": 20})
+    cursor = response.headers.get("x-next-cursor") if response is not None else None
+    if cursor and driver.rng.random() < 0.3:
+        await driver.request(
+            "GET /bets?cursor", user_id, "GET", "/bets", params={"limit": 20, "cursor": cursor}
+        )
+
+
+async def create_bet(driver: Driver, user_id: str) -> None:
+    response = await driver.request(
+        "POST /bets", user_id, "POST", "/bets", json=driver.bet_payload(user_id)
+    )
+    if response is not None and response.status_code == 201:
+        driver.remember_bets([response.json()])
+
+
+async def create_bet_batch(driver: Driver, user_id: str) -> None:
+    payload = [driver.bet_payload(user_id) for _ in range(10)]
+    response = await driver.request(
+        "POST /bets/batch", user_id, "POST", "/bets/batch", json=payload
+    )
+    if response is not None and response.status_code == 201:
+        driver.remember_bets(response.json())
+
+
+async def resolve_bet(driver: Driver, user_id: str) -> None:
+    for bet_id in driver.take_open_bets(user_id, 1):
+        await driver.request(
+            "PUT /bets/{bet_id}/resolve",
+            user_id,
+            "PUT",
+            f"/bets/{bet_id}/resolve",
+            params={"winner_id": user_id, "result": "bench"},
+        )
+
+
+async def resolve_bets(driver: Driver, user_id: str) -> None:
+    bet_ids = driver.take_open_bets(user_id, 5)
+    if bet_ids:
+        payload = [
+            {"bet_id": bet_id, "winner_id": user_id, "result": "bench"} for bet_id in bet_ids
+        ]
+        await driver.request("POST /bets/resolve", user_id, "POST", "/bets/resolve", json=payload)
+
+
+async def read_stats(driver: Driver, user_id: str) -> None:
+    await driver.request("GET /users/me/stats", user_id, "GET", "/users/me/stats")
+
+
+async def read_balance(driver: Driver, user_id: str) -> None:
+    await driver.request("GET /users/me/balance", user_id, "GET", "/users/me/balance")
+
+
+async def update_profile(driver: Driver, user_id: str) -> None:
+    username = f"bench_{driver.rng.getrandbits(48):012x}"
+    await driver.request("PUT /users/me", user_id, "PUT", "/users/me", json={"username": username})
+
+
+async def search_users(driver: Driver, user_id: str) -> None:
+    name = f"user_{driver.rng.randrange(len(driver.dataset.user_ids))}"
+    query = name[: driver.rng.randint(3, len(name))]
+    await driver.request(
+        "GET /users/search", user_id, "GET", "/users/search", params={"query": query}
+    )
+
+
+async def add_friend(driver: Driver, user_id: str) -> None:
+    friend_id = driver.dataset.pick_user(driver.rng)
+    if friend_id == user_id or friend_id in driver.dataset.friends.get(user_id, ()):
+        return
+    response = await driver.request(
+        "POST /friends/{friend_id}", user_id, "POST", f"/friends/{friend_id}"
+    )
+    if response is not None and response.status_code == 201:
+        driver.dataset.friends.setdefault(user_id, set()).add(friend_id)
+        driver.dataset.friends.setdefault(friend_id, set()).add(user_id)
+
+
+async def list_friends(driver: Driver, user_id: str) -> None:
+    await driver.request("GET /friends", user_id, "GET", "/friends")
+
+
+async def mutual_friends(driver: Driver, user_id: str) -> None:
+    other = driver.friend_of(user_id) or driver.dataset.pick_user(driver.rng)
+    await driver.request(
+        "GET /friends/mutual/{user_id}", user_id, "GET", f"/friends/mutual/{other}"
+    )
+
+
+async def suggest_friends(driver: Driver, user_id: str) -> None:
+    await driver.request("GET /friends/suggestions", user_id, "GET", "/friends/suggestions")
+
+
+async def friends_leaderboard(driver: Driver, user_id: str) -> None:
+    await driver.request("GET /leaderboard/friends", user_id, "GET", "/leaderboard/friends")
+
+
+# Relative frequency of each scenario in the mix: reads dominate.
+SCENARIOS = {
+    list_bets: 30,
+    read_me: 10,
+    list_friends: 8,
+    search_users: 8,
+    create_bet: 8,
+    read_stats: 6,
+    read_balance: 6,
+    friends_leaderboard: 5,
+    resolve_bet: 5,
+    mutual_friends: 4,
+    suggest_friends: 4,
+    read_feed: 4,
+    update_profile: 2,
+    add_friend: 2,
+    create_bet_batch: 1,
+    resolve_bets: 1,
+}
+
+
+async def run_load(driver: Driver, concurrency: int, duration: float, warmup: float) -> float:
+    """Run the scenario mix; returns the measured wall-clock seconds."""
+    scenarios = list(SCENARIOS)
+    weights = list(SCENARIOS.values())
+
+    async def worker(deadline: float) -> None:
+        while time.perf_counter() < deadline:
+            scenario = driver.rng.choices(scenarios, weights)[0]
+            await scenario(driver, driver.dataset.pick_user(driver.rng))
+
+    if warmup > 0:
+        deadline = time.perf_counter() + warmup
+        await asyncio.gather(*(worker(deadline) for _ in range(concurrency)))
+    driver.recording = True
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(start + duration) for _ in range(concurrency)))
+    return time.perf_counter() - start
+
+
+def report(driver: Driver, elapsed: float) -> dict:
+    endpoints = {}
+    for label in sorted(set(driver.latencies) | set(driver.failures)):
+        samples = sorted(driver.latencies[label])
+        statuses = driver.statuses[label]
+        server_errors = sum(n for code, n in statuses.items() if code >= 500)
+        queries = driver.queries[label]
+        endpoints[label] = {
+            "requests": len(samples),
+            "throughput_rps": round(len(samples) / elapsed, 2),
+            "p50_ms": round(percentile(samples, 50), 3),
+            "p95_ms": round(percentile(samples, 95), 3),
+            "p99_ms": round(percentile(samples, 99), 3),
+            "errors": server_errors + driver.failures[label],
+            "statuses": {str(code): n for code, n in sorted(statuses.items())},
+            "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+        }
+    everything = sorted(sample for samples in driver.latencies.values() for sample in samples)
+    return {
+        "seconds": round(elapsed, 3),
+        "total": {
+            "requests": len(everything),
+            "throughput_rps": round(len(everything) / elapsed, 2),
+            "p50_ms": round(percentile(everything, 50), 3),
+            "p95_ms": round(percentile(everything, 95), 3),
+            "p99_ms": round(percentile(everything, 99), 3),
+            "errors": sum(endpoint["errors"] for endpoint in endpoints.values()),
+        },
+        "endpoints": endpoints,
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_for_server(client: httpx.AsyncClient, process: subprocess.Popen) -> None:
+    for _ in range(300):
+        if process.poll() is not None:
+            raise SystemExit("server exited during startup")
+        try:
+            await client.get("/users/me")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise SystemExit("server did not start")
+
+
+async def drive(args, dataset: "Dataset", jwks: StubJWKS) -> dict:
+    limits = httpx.Limits(
+        max_connections=args.concurrency, max_keepalive_connections=args.concurrency
+    )
+    if args.http:
+        port = _free_port()
+        command = [sys.executable, "-m", "bench.load", "--serve", str(port)]
+        if args.workers:
+            command += ["--workers", str(args.workers)]
+        process = subprocess.Popen(command, env=os.environ.copy())
+        try:
+            async with httpx.AsyncClient(
+                base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60
+            ) as client:
+                await _wait_for_server(client, process)
+                driver = Driver(client, dataset, jwks, args.seed)
+                elapsed = await run_load(driver, args.concurrency, args.duration, args.warmup)
+        finally:
+            process.terminate()
+            process.wait()
+    else:
+        from app.main import app
+
+        transport = httpx.ASGITransport(app=count_queries(app))
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://bench", timeout=60
+            ) as client:
+                driver = Driver(client, dataset, jwks, args.seed)
+                elapsed = await run_load(driver, args.concurrency, args.duration, args.warmup)
+    return report(driver, elapsed)
+
+
+def serve(port: int, workers: Optional[int]) -> None:
+    """Entry point of the `--http` server subprocess."""
+    if workers:
+        # Set before `app` is imported, so the pools are sized per worker.
+        os.environ["WEB_CONCURRENCY"] = str(workers)
+        from app import server
+        from app.main import app
+
+        sys.exit(
+            server.serve(
+                count_queries(app), workers, host="127.0.0.1", port=port, log_level="warning"
+            )
+        )
+
+    import uvicorn
+
+    from app.main import app
+
+    uvicorn.run(count_queries(app), host="127.0.0.1", port=port, log_level="warning")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--bets", type=int, default=50000)
+    parser.add_argument("--avg-friends", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="unmeasured seconds first")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--http", action="store_true", help="drive a uvicorn subprocess over HTTP")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="serve through app.server with this many workers (implies --http)",
+    )
+    parser.add_argument(
+        "--rate-limits", action="store_true", help="keep the per-user rate limits enabled"
+    )
+    parser.add_argument("--out", help="write the JSON results to this file")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.workers)
+        return
+    args.http = args.http or bool(args.workers)
+
+    jwks = StubJWKS()
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'load.db')}"
+        jwks.configure_env()
+        os.environ["DATABASE_URL"] = url
+        os.environ.pop("ASYNC_DATABASE_URL", None)
+        os.environ.pop("DATABASE_READ_URL", None)
+        # The driver's most active users would exceed their route budgets,
+        # which measures the limiter rather than the endpoints.
+        os.environ["RATE_LIMIT_ENABLED"] = "1" if args.rate_limits else "0"
+        from .dataset import generate
+
+        start = time.perf_counter()
+        dataset = generate(url, args.users, args.bets, args.avg_friends, seed=args.seed)
+        generated = time.perf_counter() - start
+        results = asyncio.run(drive(args, dataset, jwks))
+    jwks.close()
+
+    results = {
+        "mode": "http" if args.http else "in-process",
+        "config": {
+            "users": args.users,
+            "bets": args.bets,
+            "avg_friends": args.avg_friends,
+            "concurrency": args.concurrency,
+            "workers": args.workers or 1,
+            "duration": args.duration,
+            "seed": args.seed,
+            "rate_limits": os.environ["RATE_LIMIT_ENABLED"] == "1",
+        },
+        "dataset_seconds": round(generated, 2),
+        "jwks_fetches": jwks.requests,
+        **results,
+    }
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w") as handle:
+            handle.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
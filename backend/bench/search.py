@@ -0,0 +1,150 @@
+"""
+Benchmark indexed user search against the original LIKE scan.
+
+A throwaway SQLite database is filled with synthetic users, then a set
+of queries is timed through `crud.search_users` (trigram index, with
+`cache.search_cache` cleared before every sample) and through the
+unindexed ``lower(column) LIKE '%q%'`` query it replaced.
+
+Then each query is typed one keystroke at a time, as the search screen
+sends it, and the whole burst of prefix searches is timed with the
+search cache (starting empty) and without it.  Run from the `backend`
+directory:
+
+```
+python -m bench.search --users 1000000
+```
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import string
+import tempfile
+import time
+from statistics import median
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app import crud, migrations, models
+from app.cache import search_cache
+
+
+QUERIES = ["ali", "alice", "smith", "zq", "xyz123", "@example", "user_42"]
+
+
+def _random_name(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 12)))
+
+
+def populate(url: str, users: int, seed: int) -> None:
+    """Create the schema and insert ``users`` synthetic users."""
+    rng = random.Random(seed)
+    engine = create_engine(url)
+    migrations.upgrade(engine)
+    batch = []
+    with engine.begin() as conn:
+        for i in range(users):
+            name = f"{_random_name(rng)}_{i}"
+            batch.append({"id": f"user-{i}", "username": name, "email": f"{name}@example.com"})
+            if len(batch) == 10000:
+                conn.execute(insert(models.User), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(models.User), batch)
+    engine.dispose()
+
+
+async def legacy_search(db: AsyncSession, query: str, current_user_id: str, limit: int = 20):
+    """The unindexed search used before the trigram index was added."""
+    q = f"%{query.lower()}%"
+    result = await db.scalars(
+        select(models.User)
+        .where(
+            models.User.id != current_user_id,
+            (func.lower(models.User.username).like(q)) | (func.lower(models.User.email).like(q)),
+        )
+        .limit(limit)
+    )
+    return list(result)
+
+
+async def time_queries(url: str, repeat: int) -> dict:
+    engine = create_async_engine(url)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    results = {}
+    for name, search in (("like_scan", legacy_search), ("indexed", crud.search_users)):
+        per_query = {}
+        for query in QUERIES:
+            samples = []
+            for _ in range(repeat):
+                search_cache.clear()
+                async with sessions() as db:
+                    start = time.perf_counter()
+                    await search(db, query, "nobody")
+                    samples.append((time.perf_counter() - start) * 1000)
+            per_query[query] = round(median(samples), 3)
+        results[name] = per_query
+    await engine.dispose()
+    return results
+
+
+async def uncached_search(db: AsyncSession, query: str, current_user_id: str, limit: int = 20):
+    return await crud._search_users(db, query.lower(), limit, exclude_id=current_user_id)
+
+
+async def time_typeahead(url: str, repeat: int) -> dict:
+    """Median milliseconds to search every prefix of each query in turn."""
+    engine = create_async_engine(url)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    results = {}
+    for name, search in (("uncached", uncached_search), ("cached", crud.search_users)):
+        per_query = {}
+        for query in QUERIES:
+            samples = []
+            for _ in range(repeat):
+                search_cache.clear()
+                start = time.perf_counter()
+                for end in range(1, len(query) + 1):
+                    # One request, and so one session, per keystroke.
+                    async with sessions() as db:
+                        await search(db, query[:end], "nobody")
+                samples.append((time.perf_counter() - start) * 1000)
+            per_query[query] = round(median(samples), 3)
+        results[name] = per_query
+    await engine.dispose()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="emit machine-readable output")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "search.db")
+        populate(f"sqlite:///{path}", args.users, args.seed)
+        url = f"sqlite+aiosqlite:///{path}"
+        results = asyncio.run(time_queries(url, args.repeat))
+        typeahead = asyncio.run(time_typeahead(url, args.repeat))
+
+    if args.json:
+        print(json.dumps({"users": args.users, "median_ms": results, "typeahead_ms": typeahead}))
+        return
+    print(f"{args.users} users, median of {args.repeat} runs (ms)")
+    print(f"{'query':<12}{'like_scan':>12}{'indexed':>12}{'typed':>12}{'typed+cache':>12}")
+    for query in QUERIES:
+        print(
+            f"{query:<12}{results['like_scan'][query]:>12}{results['indexed'][query]:>12}"
+            f"{typeahead['uncached'][query]:>12}{typeahead['cached'][query]:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Benchmark the fast `/bets` serialisation path against the regular one.
+
+A throwaway SQLite database is filled with synthetic bets for one user,
+then a page of bets is fetched and encoded repeatedly through each path:
+
+* ``orm``: `crud.get_bets_for_user` followed by FastAPI's own response
+  handling (validation against `schemas.BetOut`, then the standard
+  library JSON encoder), exactly as the `/bets` route does it;
+* ``fast``: `crud.get_bet_rows_for_user` followed by
+  `serialization.dump_rows`.
+
+Both paths must produce identical bytes; the run aborts otherwise.  Run
+from the `backend` directory:
+
+```
+python -m bench.serialization --bets 5000 --limit 100
+```
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from statistics import median
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+
+USER_ID = "bench-user"
+
+
+def populate(url: str, bets: int, seed: int) -> None:
+    """Create the schema and insert ``bets`` bets involving `USER_ID`."""
+    from app import migrations, models
+
+    rng = random.Random(seed)
+    engine = create_engine(url)
+    migrations.upgrade(engine)
+    start = datetime(2024, 1, 1)
+    rows = []
+    for i in range(bets):
+        resolved = rng.random() < 0.5
+        other = f"friend-{rng.randrange(50)}"
+        creator, opponent = (USER_ID, other) if rng.random() < 0.5 else (other, USER_ID)
+        created_at = start + timedelta(seconds=i * 37, microseconds=rng.randrange(1000000))
+        rows.append(
+            {
+                "description": f"Bet #{i}: who wins the match? ☕",
+                "wager": rng.randint(1, 500),
+                "status": models.BetStatus.RESOLVED if resolved else models.BetStatus.PENDING,
+                "creator_id": creator,
+                "opponent_id": opponent,
+                "winner_id": creator if resolved else None,
+                "created_at": created_at,
+                "resolved_at": created_at + timedelta(hours=1) if resolved else None,
+                "result": "won on penalties" if resolved else None,
+            }
+        )
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{"id": USER_ID}])
+        conn.execute(insert(models.Bet), rows)
+    engine.dispose()
+
+
+async def time_paths(url: str, limit: int, repeat: int) -> dict:
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+
+    from app import crud, serialization
+    from app.main import app
+
+    route = next(
+        r for r in app.routes if getattr(r, "path", None) == "/bets" and "GET" in r.methods
+    )
+    engine = create_async_engine(url)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def orm_path() -> bytes:
+        async with sessions() as db:
+            bets = await crud.get_bets_for_user(db, USER_ID, limit=limit)
+            content = await serialize_response(field=route.response_field, response_content=bets)
+            return JSONResponse(content).body
+
+    async def fast_path() -> bytes:
+        async with sessions() as db:
+            rows = await crud.get_bet_rows_for_user(
+                db, USER_ID, serialization.BET_FIELDS, limit=limit
+            )
+            return serialization.dump_rows(serialization.BET_FIELDS, rows)
+
+    expected = await orm_path()
+    if await fast_path() != expected:
+        raise SystemExit("fast path output differs from the regular path")
+
+    results = {}
+    for name, path in (("orm", orm_path), ("fast", fast_path)):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            await path()
+            samples.append((time.perf_counter() - start) * 1000)
+        results[name] = round(median(samples), 3)
+    await engine.dispose()
+    return {"bytes": len(expected), "median_ms": results}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--bets", type=int, default=5000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="emit machine-readable output")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "serialization.db")
+        # Keep the engines `app` creates on import off the default database.
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+        populate(os.environ["DATABASE_URL"], args.bets, args.seed)
+        results = asyncio.run(
+            time_paths(f"sqlite+aiosqlite:///{path}", args.limit, args.repeat)
+        )
+
+    if args.json:
+        print(json.dumps({"bets": args.bets, "limit": args.limit, **results}))
+        return
+    orm, fast = results["median_ms"]["orm"], results["median_ms"]["fast"]
+    print(f"page of {args.limit} bets ({results['bytes']} bytes), median of {args.repeat} runs")
+    print(f"{'orm':<8}{orm:>10} ms")
+    print(f"{'fast':<8}{fast:>10} ms  ({orm / fast:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
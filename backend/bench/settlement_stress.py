@@ -0,0 +1,237 @@
+"""
+Stress test for concurrent bet settlement against SQLite.
+
+Many tasks, sharing one event loop and one connection pool like the
+requests of an API worker, race to resolve the same set of bets through
+`crud.update_bet_result` and the bulk `crud.settle_bets` path, while
+another task keeps taking balance snapshots.  The engine is built by
+`database.make_async_engine`, so the database runs with the app's own
+pool and `SQLITE_PRAGMAS`.  Afterwards the ledger invariants are
+checked:
+
+* every resolved bet has exactly one ledger entry per participant;
+* every balance equals the sum of that user's ledger entries;
+* balances sum to zero (currency is only ever moved, never created);
+* `user_stats` agree with the resolved bets;
+* rebuilding balances from the latest snapshot reproduces them.
+
+Run from the `backend` directory; the exit status is non-zero if any
+invariant is violated:
+
+```
+python -m bench.settlement_stress --tasks 16 --bets 2000
+```
+
+`tests/test_settlement.py` runs a small instance of this on every test
+run.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app import crud, migrations, models
+from app.database import make_async_engine, make_engine
+
+
+def populate(path: str, users: int, bets: int, seed: int) -> None:
+    rng = random.Random(seed)
+    engine = make_engine(f"sqlite:///{path}")
+    migrations.upgrade(engine)
+    user_ids = [f"user-{i}" for i in range(users)]
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{"id": user_id} for user_id in user_ids])
+        rows = []
+        for _ in range(bets):
+            creator, opponent = rng.sample(user_ids, 2)
+            rows.append(
+                {
+                    "description": "stress",
+                    "wager": rng.randint(1, 100),
+                    "status": models.BetStatus.PENDING,
+                    "creator_id": creator,
+                    "opponent_id": opponent,
+                }
+            )
+        conn.execute(insert(models.Bet), rows)
+        stats = Counter()
+        for row in rows:
+            stats[row["creator_id"]] += 1
+            stats[row["opponent_id"]] += 1
+        conn.execute(
+            insert(models.UserStats),
+            [
+                {
+                    "user_id": user_id,
+                    "wins": 0,
+                    "losses": 0,
+                    "pending": count,
+                    "active": 0,
+                    "net_winnings": 0,
+                }
+                for user_id, count in stats.items()
+            ],
+        )
+    engine.dispose()
+
+
+def open_database(path: str):
+    """Return an engine configured like the app's, and its session factory."""
+    engine = make_async_engine(f"sqlite+aiosqlite:///{path}")
+    return engine, async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+
+async def resolver(sessions, bet_ids, seed: int, batch: int, settled: Counter) -> None:
+    """Try to resolve every bet in ``bet_ids`` (in a random order)."""
+    rng = random.Random(seed)
+    order = list(bet_ids)
+    rng.shuffle(order)
+    while order:
+        chunk, order = order[:batch], order[batch:]
+        async with sessions() as db:
+            if len(chunk) == 1:
+                bet = await crud.get_bet(db, chunk[0])
+                winner = rng.choice([bet.creator_id, bet.opponent_id])
+                result = await crud.update_bet_result(db, bet, winner, "single")
+                settled["single"] += result is not None
+            else:
+                bets = [await crud.get_bet(db, bet_id) for bet_id in chunk]
+                resolutions = [
+                    (bet.id, rng.choice([bet.creator_id, bet.opponent_id]), "bulk")
+                    for bet in bets
+                ]
+                done = await crud.settle_bets(db, resolutions)
+                settled["bulk"] += len(done)
+
+
+async def snapshotter(sessions, stop: asyncio.Event, taken: Counter) -> None:
+    while not stop.is_set():
+        async with sessions() as db:
+            await crud.snapshot_balances(db)
+        taken["snapshots"] += 1
+        await asyncio.sleep(0.05)
+
+
+async def check(sessions) -> dict:
+    """Verify the ledger invariants and return a summary."""
+    failures = []
+    async with sessions() as db:
+        bets = list(await db.scalars(select(models.Bet)))
+        entries = list(await db.scalars(select(models.LedgerEntry)))
+        balances = {row.user_id: row.balance for row in await db.scalars(select(models.Balance))}
+        stats = {row.user_id: row for row in await db.scalars(select(models.UserStats))}
+
+        per_bet = defaultdict(list)
+        ledger_totals = Counter()
+        for entry in entries:
+            per_bet[entry.bet_id].append(entry)
+            ledger_totals[entry.user_id] += entry.amount
+        expected = defaultdict(Counter)
+        for bet in bets:
+            participants = {bet.creator_id, bet.opponent_id}
+            if bet.status != models.BetStatus.RESOLVED:
+                if bet.id in per_bet:
+                    failures.append(f"unresolved bet {bet.id} has ledger entries")
+                if bet.status in models.OPEN_STATUSES:
+                    for user_id in participants:
+                        # The `pending` or `active` counter.
+                        expected[user_id][bet.status.value] += 1
+                continue
+            amounts = {entry.user_id: entry.amount for entry in per_bet[bet.id]}
+            loser = (participants - {bet.winner_id}).pop()
+            if amounts != {bet.winner_id: bet.wager, loser: -bet.wager}:
+                failures.append(f"bet {bet.id} settled incorrectly: {amounts}")
+            expected[bet.winner_id]["wins"] += 1
+            expected[bet.winner_id]["net_winnings"] += bet.wager
+            expected[loser]["losses"] += 1
+            expected[loser]["net_winnings"] -= bet.wager
+        for user_id, total in ledger_totals.items():
+            if balances.get(user_id, 0) != total:
+                failures.append(f"balance of {user_id} != ledger sum")
+        if sum(balances.values()) != 0:
+            failures.append("balances do not sum to zero")
+        for user_id in stats.keys() | expected.keys():
+            row, counts = stats[user_id], expected[user_id]
+            names = ("wins", "losses", "pending", "active", "net_winnings")
+            actual = {name: getattr(row, name) for name in names}
+            if any(actual[name] != counts[name] for name in actual):
+                failures.append(f"user_stats for {user_id} disagree: {actual}")
+
+        await crud.rebuild_balances(db)
+        rebuilt = {row.user_id: row.balance for row in await db.scalars(select(models.Balance))}
+        if rebuilt != balances:
+            failures.append("rebuilding from the latest snapshot changed balances")
+        resolved = await db.scalar(
+            select(func.count()).where(models.Bet.status == models.BetStatus.RESOLVED)
+        )
+    return {"resolved": resolved, "ledger_entries": len(entries), "failures": failures}
+
+
+async def stress(path: str, tasks: int, bets: int, batch: int, seed: int) -> dict:
+    """Race ``tasks`` resolvers over the ``bets`` bets of ``path``; return the summary.
+
+    Half the tasks resolve one bet at a time, the rest ``batch`` at a
+    time, and every task races for every bet.
+    """
+    engine, sessions = open_database(path)
+    bet_ids = list(range(1, bets + 1))
+    settled = Counter()
+    snapshots = Counter()
+    stop = asyncio.Event()
+    snapshot_task = asyncio.create_task(snapshotter(sessions, stop, snapshots))
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            resolver(sessions, bet_ids, seed + i, 1 if i % 2 else batch, settled)
+            for i in range(tasks)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await snapshot_task
+    summary = await check(sessions)
+    await engine.dispose()
+    if summary["resolved"] != bets:
+        summary["failures"].append(f"{summary['resolved']} of {bets} bets were resolved")
+    if settled["single"] + settled["bulk"] != bets:
+        summary["failures"].append("some bets were reported as settled more than once")
+    summary.update(
+        tasks=tasks,
+        bets=bets,
+        settled_single=settled["single"],
+        settled_bulk=settled["bulk"],
+        snapshots=snapshots["snapshots"],
+        seconds=round(elapsed, 3),
+    )
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tasks", type=int, default=8)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--bets", type=int, default=500)
+    parser.add_argument("--batch", type=int, default=10, help="bets per bulk settlement")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stress.db")
+        populate(path, args.users, args.bets, args.seed)
+        summary = asyncio.run(stress(path, args.tasks, args.bets, args.batch, args.seed))
+    print(json.dumps(summary, indent=2))
+    if summary["failures"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark worker cold start: import-time ``create_all`` vs. a version check.
+
+Each sample is a fresh Python process that imports `app.main` and then
+does the schema work a worker does before it can serve:
+
+* ``create_all``: what every worker used to do on import, i.e.
+  ``Base.metadata.create_all``, which inspects every table and index;
+* ``version_check``: `migrations.check_schema`, the single query the
+  lifespan hook now runs.
+
+The database is migrated to `migrations.HEAD` first, so both variants
+find an up-to-date schema, as they would on a normal worker start.  By
+default a scratch SQLite file is used; pass ``--database-url`` to
+measure against a server, where every inspection is a network round
+trip.  Run from the `backend` directory:
+
+```
+python -m bench.startup --repeat 20
+```
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from statistics import median
+
+
+# Runs in the child process; prints the phase timings as JSON.
+CHILD = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+if sys.argv[1] == "create_all":
+    from app.database import Base, engine
+    Base.metadata.create_all(bind=engine)
+else:
+    from app import migrations
+    from app.database import async_engine
+    asyncio.run(migrations.check_schema(async_engine))
+ready = time.perf_counter()
+print(json.dumps({"import": imported - start, "schema": ready - imported}))
+"""
+
+MODES = ("create_all", "version_check")
+
+
+def sample(mode: str, env: dict) -> dict:
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, mode], env=env, check=True, capture_output=True, text=True
+    ).stdout
+    total = time.perf_counter() - start
+    timings = json.loads(output.strip().splitlines()[-1])
+    return {**timings, "process": total}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument(
+        "--database-url", help="database to start against (default: scratch SQLite)"
+    )
+    parser.add_argument("--json", action="store_true", help="emit machine-readable output")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'startup.db')}"
+        env = {**os.environ, "DATABASE_URL": url, "AUTO_MIGRATE": "0"}
+        env.pop("ASYNC_DATABASE_URL", None)
+        subprocess.run(
+            [sys.executable, "-m", "app.migrations", "upgrade"],
+            env=env,
+            check=True,
+            capture_output=True,
+        )
+        results = {}
+        for mode in MODES:
+            samples = [sample(mode, env) for _ in range(args.repeat)]
+            results[mode] = {
+                phase: round(median(s[phase] for s in samples) * 1000, 2)
+                for phase in ("import", "schema", "process")
+            }
+
+    if args.json:
+        print(json.dumps({"repeat": args.repeat, "median_ms": results}))
+        return
+    print(f"median of {args.repeat} cold starts (ms)")
+    print(f"{'':<16}{'import':>10}{'schema':>10}{'process':>10}")
+    for mode in MODES:
+        timings = results[mode]
+        print(
+            f"{mode:<16}{timings['import']:>10}{timings['schema']:>10}{timings['process']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
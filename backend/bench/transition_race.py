@@ -0,0 +1,182 @@
+"""
+Race concurrent accept, decline and resolve requests for the same bets.
+
+Many tasks, sharing one event loop and one connection pool (built by
+`database.make_async_engine`, so with the app's `SQLITE_PRAGMAS`) like
+the requests of an API worker, walk every bet of a fresh SQLite
+database in random order and try a random transition on it: accept or
+decline as the bet's opponent, or resolve it as either participant.
+Each successful transition is recorded, then the results are checked:
+
+* no transition succeeded twice for the same bet, and no bet was both
+  declined and accepted or resolved (no lost updates);
+* every bet's final status is the one its successful transitions lead
+  to;
+* the ledger, balance and `user_stats` invariants of
+  `bench.settlement_stress` hold.
+
+``--naive`` swaps accept and decline for the read-check-write
+implementation the compare-and-set replaces (load the bet, check it in
+Python, then write), which lets concurrent transitions of the same bet
+all succeed; expect failures.  Under SQLite, some of its writes are
+instead rejected with "database is locked" (a transaction that read a
+snapshot cannot upgrade to a write once another writer has committed);
+those attempts are reported as failures too.  Run from the `backend`
+directory; the exit status is non-zero if any check fails:
+
+```
+python -m bench.transition_race --tasks 16 --bets 1000
+```
+
+`tests/test_transitions.py` runs a small race on every test run.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from app import crud, models
+from .settlement_stress import check, open_database, populate
+
+
+ACTIONS = ("accept", "decline", "resolve")
+
+# Successful transitions -> the status they leave the bet in.
+OUTCOMES = {
+    (): models.BetStatus.PENDING,
+    ("accept",): models.BetStatus.ACTIVE,
+    ("decline",): models.BetStatus.DECLINED,
+    ("resolve",): models.BetStatus.RESOLVED,
+    ("accept", "resolve"): models.BetStatus.RESOLVED,
+}
+
+
+async def naive_transition(db, bet_id: int, user_id: str, expected, new):
+    """Read-modify-write: the check and the write are separate statements."""
+    bet = await crud.get_bet(db, bet_id)
+    if bet is None or bet.status != expected or bet.opponent_id != user_id:
+        return None
+    bet.status = new
+    if new == models.BetStatus.ACTIVE:
+        await crud.apply_stats(db, crud._accepted_stats(bet))
+    else:
+        await crud.apply_stats(db, crud._closed_stats([bet]))
+    await db.commit()
+    return bet
+
+
+async def attempt(db, rng, naive: bool, action: str, bet_id: int, creator_id, opponent_id):
+    if action == "resolve":
+        actor = rng.choice([creator_id, opponent_id])
+        winner = rng.choice([creator_id, opponent_id])
+        return await crud.settle_bets(db, [(bet_id, winner, "race")], actor_id=actor)
+    if naive:
+        new = models.BetStatus.ACTIVE if action == "accept" else models.BetStatus.DECLINED
+        return await naive_transition(db, bet_id, opponent_id, models.BetStatus.PENDING, new)
+    if action == "accept":
+        return await crud.accept_bet(db, bet_id, opponent_id)
+    return await crud.decline_bet(db, bet_id, opponent_id)
+
+
+async def racer(sessions, bets: dict, seed: int, naive: bool, log: list, errors: list) -> None:
+    """Try one random transition on every bet, in a random order."""
+    rng = random.Random(seed)
+    order = list(bets)
+    rng.shuffle(order)
+    for bet_id in order:
+        creator_id, opponent_id = bets[bet_id]
+        action = rng.choice(ACTIONS)
+        async with sessions() as db:
+            try:
+                done = await attempt(db, rng, naive, action, bet_id, creator_id, opponent_id)
+            except (IntegrityError, OperationalError) as exc:
+                # E.g. a bet settled twice after a lost update, or a
+                # read-then-write transaction SQLite refused to upgrade.
+                errors.append(f"bet {bet_id}: {action} failed: {exc.orig}")
+                continue
+        if done:
+            log.append((bet_id, action))
+
+
+async def verify(sessions, log: list) -> list:
+    """Check every bet's successful transitions against its final status."""
+    async with sessions() as db:
+        statuses = dict((await db.execute(select(models.Bet.id, models.Bet.status))).all())
+    succeeded = defaultdict(list)
+    for bet_id, action in log:
+        succeeded[bet_id].append(action)
+    failures = []
+    for bet_id, status in statuses.items():
+        actions = tuple(sorted(succeeded[bet_id]))
+        expected = OUTCOMES.get(actions)
+        if expected is None:
+            failures.append(f"bet {bet_id}: conflicting transitions succeeded: {actions}")
+        elif expected != status:
+            failures.append(f"bet {bet_id}: is {status.value} after {actions}")
+    return failures
+
+
+async def race(path: str, tasks: int, seed: int, naive: bool = False) -> dict:
+    """Race ``tasks`` racers over every bet of ``path``; return the summary."""
+    engine, sessions = open_database(path)
+    async with sessions() as db:
+        rows = await db.execute(
+            select(models.Bet.id, models.Bet.creator_id, models.Bet.opponent_id)
+        )
+        bets = {bet_id: (creator, opponent) for bet_id, creator, opponent in rows}
+    log: list = []
+    errors: list = []
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(racer(sessions, bets, seed + i, naive, log, errors) for i in range(tasks))
+    )
+    elapsed = time.perf_counter() - start
+    failures = await verify(sessions, log)
+    summary = await check(sessions)
+    await engine.dispose()
+
+    summary["failures"] = errors + failures + summary["failures"]
+    summary.update(
+        mode="naive" if naive else "compare-and-set",
+        tasks=tasks,
+        bets=len(bets),
+        attempts=tasks * len(bets),
+        succeeded=dict(Counter(action for _, action in log)),
+        seconds=round(elapsed, 3),
+    )
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tasks", type=int, default=8)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--bets", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--naive", action="store_true", help="use read-check-write for accept and decline"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "race.db")
+        populate(path, args.users, args.bets, args.seed)
+        summary = asyncio.run(race(path, args.tasks, args.seed, args.naive))
+    summary["failure_count"] = len(summary["failures"])
+    summary["failures"] = summary["failures"][:20]
+    print(json.dumps(summary, indent=2))
+    if summary["failure_count"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Shared setup for the test suite.
+
+The app reads its configuration from the environment when imported, so
+the test database and an unverified-token setup are put in place here,
+before any test module imports `app`.  Run from the `backend` directory:
+
+```
+python -m pytest tests
+```
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+_DATABASE_DIR = tempfile.mkdtemp(prefix="bet-app-tests-")
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{os.path.join(_DATABASE_DIR, 'api.db')}",
+    # Tokens are decoded without signature verification (see `auth`).
+    SUPABASE_JWT_JWKS_URL="",
+    WARMUP_ENABLED="0",
+    RATE_LIMIT_ENABLED="0",
+)
+
+
+@pytest.fixture(scope="session")
+def client():
+    """A `TestClient` for the app, on a freshly migrated database."""
+    from fastapi.testclient import TestClient
+
+    from app import migrations
+    from app.database import engine
+    from app.main import app
+
+    migrations.upgrade(engine)
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def auth_headers():
+    """Return request headers authenticating as the given user ID."""
+    from jose import jwt
+
+    def headers(user_id: str) -> dict:
+        token = jwt.encode({"sub": user_id}, "unverified", algorithm="HS256")
+        return {"Authorization": f"Bearer {token}"}
+
+    return headers
+
+
+@pytest.fixture
+def run_db(client):
+    """Return a function running ``fn(db)`` on a session of the test database.
+
+    Each call gets its own event loop and engine, configured like the
+    app's (see `database.make_async_engine`).
+    """
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    from app.database import ASYNC_SQLALCHEMY_DATABASE_URL, make_async_engine
+
+    def run(fn):
+        async def main():
+            engine = make_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+            try:
+                sessions = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+                async with sessions() as db:
+                    return await fn(db)
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(main())
+
+    return run
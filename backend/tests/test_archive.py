@@ -0,0 +1,70 @@
+"""
+`crud.archive_bets`: old closed bets move to `bets_archive` exactly once.
+"""
+
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app import crud, models
+from app.database import ASYNC_SQLALCHEMY_DATABASE_URL, make_async_engine
+
+LONG_AGO = datetime(2000, 1, 1)
+
+
+def test_concurrent_archivers_move_each_bet_once(client, auth_headers, run_db):
+    headers = auth_headers("archiver")
+    body = [{"description": f"bet {i}", "wager": 1, "opponent_id": "archivee"} for i in range(12)]
+    bets = client.post("/bets/batch", json=body, headers=headers).json()
+    ids = [bet["id"] for bet in bets]
+    resolved, expired = ids[:8], ids[8:]
+    client.post(
+        "/bets/resolve",
+        json=[{"bet_id": bet_id, "winner_id": "archiver", "result": "won"} for bet_id in resolved],
+        headers=headers,
+    )
+
+    async def backdate(db):
+        await db.execute(
+            update(models.Bet).where(models.Bet.id.in_(resolved)).values(resolved_at=LONG_AGO)
+        )
+        await db.execute(
+            update(models.Bet)
+            .where(models.Bet.id.in_(expired))
+            .values(status=models.BetStatus.EXPIRED, deadline=LONG_AGO)
+        )
+        await db.commit()
+
+    run_db(backdate)
+
+    async def archive_concurrently(archivers=3):
+        engine = make_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+        sessions = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+        async def archiver():
+            moved = []
+            async with sessions() as db:
+                while True:
+                    count = await crud.archive_bets(db, datetime(2001, 1, 1), limit=2)
+                    moved.append(count)
+                    if count < 2:
+                        return moved
+
+        try:
+            return await asyncio.gather(*(archiver() for _ in range(archivers)))
+        finally:
+            await engine.dispose()
+
+    moved = asyncio.run(archive_concurrently())
+
+    assert sum(map(sum, moved)) == len(ids)
+
+    async def count(db, model):
+        return await db.scalar(select(func.count()).where(model.id.in_(ids)))
+
+    assert run_db(lambda db: count(db, models.Bet)) == 0
+    assert run_db(lambda db: count(db, models.BetArchive)) == len(ids)
+    history = client.get("/bets/history", headers=headers).json()
+    assert sorted(bet["id"] for bet in history) == ids
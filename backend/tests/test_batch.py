@@ -0,0 +1,68 @@
+"""
+``POST /bets/batch``: all-or-nothing, and answered in request order.
+"""
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from app import crud, models, schemas
+
+
+def _bets_of(client, headers) -> list:
+    return client.get("/bets", headers=headers).json()
+
+
+def test_bets_are_returned_in_request_order(client, auth_headers):
+    body = [
+        {"description": f"bet {i}", "wager": i + 1, "opponent_id": f"rival-{i % 3}"}
+        for i in range(30)
+    ]
+    response = client.post("/bets/batch", json=body, headers=auth_headers("batcher"))
+
+    assert response.status_code == 201
+    bets = response.json()
+    assert [(bet["description"], bet["opponent_id"]) for bet in bets] == [
+        (item["description"], item["opponent_id"]) for item in body
+    ]
+    assert client.get("/users/me/stats", headers=auth_headers("batcher")).json()["pending"] == 30
+
+
+def test_invalid_item_rejects_the_whole_batch(client, auth_headers):
+    headers = auth_headers("invalid-batcher")
+    body = [
+        {"description": "fine", "wager": 1, "opponent_id": "rival"},
+        {"description": "past", "wager": 1, "opponent_id": "rival", "deadline": "2000-01-01T00:00"},
+    ]
+
+    assert client.post("/bets/batch", json=body, headers=headers).status_code == 422
+    assert _bets_of(client, headers) == []
+
+
+def test_oversized_batch_is_rejected(client, auth_headers):
+    headers = auth_headers("greedy-batcher")
+    body = [{"description": "x", "wager": 1, "opponent_id": "rival"}] * 101
+
+    assert client.post("/bets/batch", json=body, headers=headers).status_code == 413
+    assert _bets_of(client, headers) == []
+
+
+def test_failing_row_rolls_back_the_whole_batch(client, run_db):
+    creator = models.User(id="atomic-batcher")
+    # Bypasses validation: the second row violates NOT NULL in the database.
+    bets_in = [
+        schemas.BetCreate(description="fine", wager=1, opponent_id="rival"),
+        schemas.BetCreate.model_construct(description="broken", wager=1, opponent_id=None),
+    ]
+
+    async def create_then_count(db):
+        try:
+            await crud.create_bets(db, creator, bets_in)
+        except IntegrityError:
+            await db.rollback()
+        else:
+            raise AssertionError("the batch should have failed")
+        return await db.scalar(
+            select(func.count()).where(models.Bet.creator_id == creator.id)
+        )
+
+    assert run_db(create_then_count) == 0
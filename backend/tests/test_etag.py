@@ -0,0 +1,38 @@
+"""
+ETag revalidation of ``/bets``, ``/friends`` and ``/users/me``.
+"""
+
+import pytest
+
+
+@pytest.mark.parametrize("path", ["/bets", "/friends", "/users/me"])
+def test_unchanged_data_is_answered_with_304(client, auth_headers, path):
+    headers = auth_headers("etag-reader")
+    response = client.get(path, headers=headers)
+    etag = response.headers["ETag"]
+
+    response = client.get(path, headers={**headers, "If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+
+def test_write_changes_the_etag_of_both_participants(client, auth_headers):
+    creator, opponent = auth_headers("etag-creator"), auth_headers("etag-opponent")
+    etags = {
+        user: client.get("/bets", headers=headers).headers["ETag"]
+        for user, headers in (("creator", creator), ("opponent", opponent))
+    }
+
+    client.post(
+        "/bets",
+        json={"description": "x", "wager": 1, "opponent_id": "etag-opponent"},
+        headers=creator,
+    )
+
+    for user, headers in (("creator", creator), ("opponent", opponent)):
+        response = client.get("/bets", headers={**headers, "If-None-Match": etags[user]})
+        assert response.status_code == 200, user
+        assert response.headers["ETag"] != etags[user]
+        assert len(response.json()) == 1
@@ -0,0 +1,62 @@
+"""
+`crud.expire_bets`: overdue pending bets are expired in bounded batches.
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from app import crud, models
+
+
+def test_overdue_pending_bets_are_expired_in_batches(client, auth_headers, run_db):
+    creator, opponent = auth_headers("expirer"), auth_headers("expiree")
+    soon = (datetime.utcnow() + timedelta(hours=1)).isoformat()
+    bets = client.post(
+        "/bets/batch",
+        json=[
+            {"description": f"bet {i}", "wager": 1, "opponent_id": "expiree", "deadline": soon}
+            for i in range(10)
+        ],
+        headers=creator,
+    ).json()
+    accepted, *overdue = [bet["id"] for bet in bets]
+    assert client.put(f"/bets/{accepted}/accept", headers=opponent).status_code == 200
+    not_due = client.post(
+        "/bets",
+        json={"description": "later", "wager": 1, "opponent_id": "expiree", "deadline": soon},
+        headers=creator,
+    ).json()["id"]
+    pending = client.get("/users/me/stats", headers=creator).json()["pending"]
+
+    now = datetime.utcnow()
+
+    async def backdate(db):
+        await db.execute(
+            update(models.Bet)
+            .where(models.Bet.id.in_([accepted, *overdue]))
+            .values(deadline=now - timedelta(minutes=1))
+        )
+        await db.commit()
+
+    async def expire_all(db):
+        batches = []
+        while True:
+            expired = await crud.expire_bets(db, now, limit=4)
+            batches.append(sorted(bet.id for bet in expired))
+            if len(expired) < 4:
+                return batches
+
+    run_db(backdate)
+    batches = run_db(expire_all)
+
+    assert [len(batch) for batch in batches] == [4, 4, 1]
+    assert sorted(sum(batches, [])) == sorted(overdue)
+    statuses = {bet["id"]: bet["status"] for bet in client.get("/bets", headers=creator).json()}
+    assert {statuses[bet_id] for bet_id in overdue} == {"expired"}
+    assert statuses[accepted] == "active"
+    assert statuses[not_due] == "pending"
+    stats = client.get("/users/me/stats", headers=creator).json()
+    assert stats["pending"] == pending - len(overdue)
+    # Nothing is left to expire.
+    assert run_db(lambda db: crud.expire_bets(db, now, limit=4)) == []
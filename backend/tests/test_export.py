@@ -0,0 +1,46 @@
+"""
+Bet exports merge archived and current bets in order.
+"""
+
+import json
+from datetime import datetime
+
+from sqlalchemy import update
+
+from app import auth, crud, models
+
+
+def _ids(response) -> list:
+    return [json.loads(line)["id"] for line in response.text.splitlines()]
+
+
+def test_exports_interleave_archived_bets_in_order(client, auth_headers, run_db, monkeypatch):
+    headers = auth_headers("exporter")
+    body = [{"description": f"bet {i}", "wager": 1, "opponent_id": "exportee"} for i in range(6)]
+    ids = [bet["id"] for bet in client.post("/bets/batch", json=body, headers=headers).json()]
+    archived = ids[1::2]
+    client.post(
+        "/bets/resolve",
+        json=[{"bet_id": bet_id, "winner_id": "exporter", "result": "won"} for bet_id in archived],
+        headers=headers,
+    )
+
+    async def archive(db):
+        await db.execute(
+            update(models.Bet)
+            .where(models.Bet.id.in_(archived))
+            .values(resolved_at=datetime(2000, 1, 1))
+        )
+        await db.commit()
+        return await crud.archive_bets(db, datetime(2001, 1, 1))
+
+    assert run_db(archive) == len(archived)
+    monkeypatch.setattr(auth, "ADMIN_USER_IDS", frozenset({"export-admin"}))
+
+    everything = _ids(client.get("/admin/bets/export", headers=auth_headers("export-admin")))
+    own = _ids(client.get("/bets/export", headers=headers))
+
+    assert everything == sorted(everything)
+    assert set(ids) <= set(everything)
+    # A batch shares one `created_at`, so its bets are exported by ID.
+    assert own == ids
@@ -0,0 +1,86 @@
+"""
+`auth.JWKSClient` against a local stub of the JWKS endpoint.
+
+Time-based behaviour is exercised with short real intervals, so each
+test takes a fraction of a second.
+"""
+
+import threading
+import time
+
+import pytest
+
+from app.auth import JWKSClient
+from bench.jwks import StubJWKS
+
+
+@pytest.fixture
+def stub():
+    server = StubJWKS()
+    yield server
+    server.close()
+
+
+def test_keys_are_cached_until_the_ttl_expires(stub):
+    client = JWKSClient(stub.url, ttl=0.3, refresh_ahead=1.0)
+
+    assert client.get_key(stub.kid)["kid"] == stub.kid
+    assert client.get_key(stub.kid) is not None
+    assert stub.requests == 1
+
+    time.sleep(0.35)
+    assert client.get_key(stub.kid) is not None
+    assert stub.requests == 2
+
+
+def test_keys_are_refreshed_ahead_in_the_background(stub):
+    client = JWKSClient(stub.url, ttl=10, refresh_ahead=0.01)
+    client.get_key(stub.kid)
+    time.sleep(0.15)
+
+    # Past the refresh-ahead point, the cached key is served at once.
+    stub.delay = 0.3
+    start = time.monotonic()
+    assert client.get_key(stub.kid) is not None
+    assert time.monotonic() - start < stub.delay
+    client._background_refresh.join()
+    assert stub.requests == 2
+
+
+def test_concurrent_refreshes_share_one_fetch(stub):
+    client = JWKSClient(stub.url)
+    stub.delay = 0.3
+    barrier = threading.Barrier(8)
+
+    def get_key():
+        barrier.wait()
+        assert client.get_key(stub.kid) is not None
+
+    threads = [threading.Thread(target=get_key) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert stub.requests == 1
+    assert client.fetches == 1
+
+
+def test_unknown_key_id_refetches_at_most_once_per_interval(stub):
+    client = JWKSClient(stub.url, min_refetch_interval=0.3)
+    client.get_key(stub.kid)
+    assert stub.requests == 1
+
+    # An unknown kid may mean the keys rotated: refetch once...
+    assert client.get_key("rotated") is None
+    assert stub.requests == 2
+    # ...but not again for every token carrying a bogus kid.
+    for _ in range(5):
+        assert client.get_key("rotated") is None
+    assert stub.requests == 2
+    assert client.get_key(stub.kid) is not None
+    assert stub.requests == 2
+
+    time.sleep(0.35)
+    assert client.get_key("rotated") is None
+    assert stub.requests == 3
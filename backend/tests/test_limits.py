@@ -0,0 +1,162 @@
+"""
+`limits.LimitsMiddleware`: 429 once a caller's budget is spent, 503 once
+the server is saturated.
+
+The middleware wraps a bare ASGI app here, so that handlers can be held
+open to saturate it.
+"""
+
+import asyncio
+
+import pytest
+from starlette.routing import Route
+
+from app import auth, limits
+
+
+def _scope(path: str = "/things", client: str = "10.0.0.1") -> dict:
+    return {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "client": (client, 1234),
+    }
+
+
+async def _call(middleware, scope) -> dict:
+    """Send one request through ``middleware``; return status and headers."""
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await middleware(scope, receive, send)
+    start = messages[0]
+    return {"status": start["status"], "headers": dict(start["headers"])}
+
+
+async def _ok(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+ROUTES = [Route("/things", _ok), Route("/other", _ok)]
+
+
+@pytest.fixture(autouse=True)
+def rate_limiting(monkeypatch):
+    # Disabled for the rest of the suite (see conftest).
+    monkeypatch.setattr(limits, "RATE_LIMIT_ENABLED", True)
+
+
+def test_caller_over_budget_gets_429_with_retry_after():
+    rate_limiter = limits.RateLimiter(budgets={("GET", "/things"): (0.5, 2)})
+    middleware = limits.LimitsMiddleware(
+        _ok, ROUTES, rate_limiter, limits.ConcurrencyLimiter(limit=0)
+    )
+
+    async def run():
+        first = [await _call(middleware, _scope()) for _ in range(3)]
+        # Another route draws from the default budget; another caller has its own.
+        other_route = await _call(middleware, _scope("/other"))
+        other_caller = await _call(middleware, _scope(client="10.0.0.2"))
+        return first, other_route, other_caller
+
+    responses, other_route, other_caller = asyncio.run(run())
+
+    assert [response["status"] for response in responses] == [200, 200, 429]
+    # One token every 2 seconds.
+    assert responses[2]["headers"][b"retry-after"] == b"2"
+    assert other_route["status"] == 200
+    assert other_caller["status"] == 200
+    assert rate_limiter.stats()["throttled"] == 1
+
+
+def test_verified_callers_are_limited_by_subject(monkeypatch):
+    token_cache = auth.TokenCache()
+    token_cache.put("token", {"sub": "u1"})
+    monkeypatch.setattr(auth, "token_cache", token_cache)
+    rate_limiter = limits.RateLimiter(default=(0.5, 1))
+    middleware = limits.LimitsMiddleware(
+        _ok, ROUTES, rate_limiter, limits.ConcurrencyLimiter(limit=0)
+    )
+
+    def scope(client, token):
+        return {**_scope(client=client), "headers": [(b"authorization", b"Bearer " + token)]}
+
+    async def run():
+        return [
+            await _call(middleware, scope("10.0.0.1", b"token")),
+            # Same user from another address: same bucket.
+            await _call(middleware, scope("10.0.0.2", b"token")),
+            # Unverified token: limited by address.
+            await _call(middleware, scope("10.0.0.2", b"other")),
+        ]
+
+    responses = asyncio.run(run())
+
+    assert [response["status"] for response in responses] == [200, 429, 200]
+    # Looking tokens up does not count as token cache hits or misses.
+    stats = token_cache.stats()
+    assert (stats["hits"], stats["misses"]) == (0, 0)
+
+
+def test_saturated_server_sheds_with_503():
+    async def run():
+        done = asyncio.Event()
+
+        async def slow(scope, receive, send):
+            await done.wait()
+            await _ok(scope, receive, send)
+
+        concurrency = limits.ConcurrencyLimiter(limit=1, queue_size=1, timeout=5)
+        middleware = limits.LimitsMiddleware(
+            slow, ROUTES, limits.RateLimiter(default=(1000, 1000)), concurrency
+        )
+        # One request runs, one waits in the queue, the third is shed.
+        running = asyncio.create_task(_call(middleware, _scope()))
+        queued = asyncio.create_task(_call(middleware, _scope()))
+        await asyncio.sleep(0.01)
+        shed = await _call(middleware, _scope())
+        done.set()
+        return shed, await running, await queued, concurrency.stats()
+
+    shed, running, queued, stats = asyncio.run(run())
+
+    assert shed["status"] == 503
+    assert shed["headers"][b"retry-after"] == str(limits.LOAD_SHED_RETRY_AFTER).encode()
+    assert running["status"] == 200
+    assert queued["status"] == 200
+    assert stats["rejected"] == 1
+    assert stats["active"] == 0
+
+
+def test_queued_request_times_out_with_503():
+    async def run():
+        done = asyncio.Event()
+
+        async def slow(scope, receive, send):
+            await done.wait()
+            await _ok(scope, receive, send)
+
+        concurrency = limits.ConcurrencyLimiter(limit=1, queue_size=1, timeout=0.05)
+        middleware = limits.LimitsMiddleware(
+            slow, ROUTES, limits.RateLimiter(default=(1000, 1000)), concurrency
+        )
+        running = asyncio.create_task(_call(middleware, _scope()))
+        await asyncio.sleep(0.01)
+        timed_out = await _call(middleware, _scope())
+        done.set()
+        await running
+        return timed_out, concurrency.stats()
+
+    timed_out, stats = asyncio.run(run())
+
+    assert timed_out["status"] == 503
+    assert stats["timed_out"] == 1
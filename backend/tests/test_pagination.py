@@ -0,0 +1,35 @@
+"""
+Keyset pagination of ``GET /bets``.
+"""
+
+
+def test_cursor_pages_have_no_gaps_or_duplicates_when_created_at_ties(client, auth_headers):
+    headers = auth_headers("pager")
+    # A batch shares a single `created_at`, so only the ID breaks ties.
+    response = client.post(
+        "/bets/batch",
+        json=[{"description": f"bet {i}", "wager": 1, "opponent_id": "paged"} for i in range(25)],
+        headers=headers,
+    )
+    created = [bet["id"] for bet in response.json()]
+
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        params = {"limit": 7} if cursor is None else {"limit": 7, "cursor": cursor}
+        response = client.get("/bets", params=params, headers=headers)
+        assert response.status_code == 200
+        seen.extend(bet["id"] for bet in response.json())
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert pages == 4
+    assert seen == sorted(created, reverse=True)
+
+
+def test_invalid_cursor_is_rejected(client, auth_headers):
+    response = client.get("/bets", params={"cursor": "not a cursor"}, headers=auth_headers("pager"))
+    assert response.status_code == 400
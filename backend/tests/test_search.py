@@ -0,0 +1,53 @@
+"""
+`crud.search_users`: answers served by `cache.search_cache` match the
+database's.
+"""
+
+from sqlalchemy import insert
+
+from app import crud, models
+from app.cache import ascii_lower, search_cache
+
+USERS = [
+    ("zy-1", "zyla", None),
+    ("zy-2", "Zylan", "zylan@example.com"),
+    ("zy-3", "ZYLANDER", None),
+    ("zy-4", "mazyl", None),
+    ("zy-5", None, "zyl@example.com"),
+    ("zy-6", "ÉZYL", None),
+    ("zy-7", "élan", "ezy@example.com"),
+    # More matches for "zq" than fit in a page.
+    *[(f"zq-{i}", f"zq-{i}", None) for i in range(30)],
+]
+
+
+def _typed(*queries):
+    return [query[:end] for query in queries for end in range(1, len(query) + 1)]
+
+
+def test_prefix_answers_match_the_database(client, run_db):
+    async def search(db):
+        await db.execute(
+            insert(models.User),
+            [{"id": id_, "username": name, "email": email} for id_, name, email in USERS],
+        )
+        await db.commit()
+        answers = []
+        search_cache.clear()
+        for query in _typed("zylan", "ZYLA", "Ézyl", "ézy", "zq-12"):
+            cached = await crud.search_users(db, query, "zy-1")
+            found = await crud._search_users(db, ascii_lower(query), 20, exclude_id="zy-1")
+            answers.append((query, [user.id for user in cached], [user.id for user in found]))
+        return answers, search_cache.stats()
+
+    answers, stats = run_db(search)
+
+    for query, cached, found in answers:
+        assert cached == found, query
+    assert stats["prefix_hits"] > 0
+    found = {query: ids for query, ids, _ in answers}
+    assert found["zyla"] == ["zy-2", "zy-3"]
+    assert found["zq-12"] == ["zq-12"]
+    # SQLite's lower() folds ASCII letters only, so "É" and "é" differ.
+    assert found["Ézyl"] == ["zy-6"]
+    assert found["ézy"] == []
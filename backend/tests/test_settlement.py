@@ -0,0 +1,49 @@
+"""
+Settlement: a bet moves its wager through the ledger exactly once.
+
+`test_resolving_twice_settles_once` replays a resolution over HTTP; the
+race test runs a small instance of `bench.settlement_stress`, which
+races single and bulk settlements of the same bets (with balance
+snapshots in between) and checks the ledger invariants.
+"""
+
+import asyncio
+
+from bench.settlement_stress import populate, stress
+
+
+def _resolve(client, headers, bet_id: int, user_id: str, winner_id: str):
+    return client.put(
+        f"/bets/{bet_id}/resolve",
+        params={"winner_id": winner_id, "result": "done"},
+        headers=headers(user_id),
+    )
+
+
+def test_resolving_twice_settles_once(client, auth_headers):
+    response = client.post(
+        "/bets",
+        json={"description": "test", "wager": 10, "opponent_id": "dave"},
+        headers=auth_headers("carol"),
+    )
+    bet_id = response.json()["id"]
+    response = _resolve(client, auth_headers, bet_id, "carol", "dave")
+    assert response.status_code == 200
+    assert response.json()["winner_id"] == "dave"
+
+    assert _resolve(client, auth_headers, bet_id, "dave", "carol").status_code == 409
+    balances = {
+        user_id: client.get("/users/me/balance", headers=auth_headers(user_id)).json()["balance"]
+        for user_id in ("carol", "dave")
+    }
+    assert balances == {"carol": -10, "dave": 10}
+
+
+def test_concurrent_settlements_settle_each_bet_once(tmp_path):
+    path = str(tmp_path / "stress.db")
+    populate(path, users=10, bets=40, seed=1)
+
+    summary = asyncio.run(stress(path, tasks=4, bets=40, batch=5, seed=1))
+
+    assert summary["failures"] == []
+    assert summary["ledger_entries"] == 2 * 40
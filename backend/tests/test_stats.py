@@ -0,0 +1,77 @@
+"""
+`user_stats` agree with the bets and with the ledger.
+"""
+
+
+def _stats(client, headers) -> dict:
+    return client.get("/users/me/stats", headers=headers).json()
+
+
+def _balance(client, headers) -> int:
+    return client.get("/users/me/balance", headers=headers).json()["balance"]
+
+
+def _create(client, headers, opponent_id, wager=10) -> int:
+    response = client.post(
+        "/bets",
+        json={"description": "stats", "wager": wager, "opponent_id": opponent_id},
+        headers=headers,
+    )
+    return response.json()["id"]
+
+
+def test_accepting_moves_a_bet_from_pending_to_active(client, auth_headers):
+    creator, opponent = auth_headers("stats-creator"), auth_headers("stats-opponent")
+    bet_id = _create(client, creator, "stats-opponent")
+    assert _stats(client, creator)["pending"] == 1
+
+    client.put(f"/bets/{bet_id}/accept", headers=opponent)
+
+    for headers in (creator, opponent):
+        assert (_stats(client, headers)["pending"], _stats(client, headers)["active"]) == (0, 1)
+    # The feed counts pending bets the same way.
+    feed = client.get("/me/feed", params={"fields": "pending"}, headers=creator).json()
+    assert feed["pending"] == {"incoming": 0, "outgoing": 0}
+
+    client.put(
+        f"/bets/{bet_id}/resolve",
+        params={"winner_id": "stats-creator", "result": "won"},
+        headers=creator,
+    )
+
+    won, lost = _stats(client, creator), _stats(client, opponent)
+    assert (won["active"], won["wins"], won["net_winnings"]) == (0, 1, 10)
+    assert (lost["active"], lost["losses"], lost["net_winnings"]) == (0, 1, -10)
+    assert _balance(client, creator) == won["net_winnings"]
+    assert _balance(client, opponent) == lost["net_winnings"]
+
+
+def test_resolving_a_pending_bet_clears_pending(client, auth_headers):
+    creator = auth_headers("stats-hasty")
+    bet_id = _create(client, creator, "stats-hasty-rival")
+
+    client.put(
+        f"/bets/{bet_id}/resolve",
+        params={"winner_id": "stats-hasty-rival", "result": "lost"},
+        headers=creator,
+    )
+
+    stats = _stats(client, creator)
+    assert (stats["pending"], stats["active"], stats["losses"]) == (0, 0, 1)
+
+
+def test_bets_against_oneself_are_neither_won_nor_lost(client, auth_headers):
+    headers = auth_headers("stats-loner")
+    bet_id = _create(client, headers, "stats-loner")
+    assert _stats(client, headers)["pending"] == 1
+
+    response = client.put(
+        f"/bets/{bet_id}/resolve",
+        params={"winner_id": "stats-loner", "result": "won"},
+        headers=headers,
+    )
+
+    assert response.status_code == 200
+    stats = _stats(client, headers)
+    assert stats == {"wins": 0, "losses": 0, "pending": 0, "active": 0, "net_winnings": 0}
+    assert _balance(client, headers) == 0
@@ -0,0 +1,59 @@
+"""
+`auth.TokenCache`: verified payloads expire at ``min(exp, max_age)``.
+"""
+
+import time
+
+from app.auth import TokenCache
+
+
+def test_entry_expires_after_max_age():
+    cache = TokenCache(max_age=0.2)
+    cache.put("token", {"sub": "u1", "exp": time.time() + 3600})
+
+    assert cache.get("token")["sub"] == "u1"
+    time.sleep(0.25)
+    assert cache.get("token") is None
+
+
+def test_entry_expires_at_the_token_expiry():
+    cache = TokenCache(max_age=3600)
+    cache.put("token", {"sub": "u1", "exp": time.time() + 0.2})
+
+    assert cache.get("token") is not None
+    time.sleep(0.25)
+    assert cache.get("token") is None
+
+
+def test_expired_token_is_never_served():
+    cache = TokenCache(max_age=3600)
+    cache.put("token", {"sub": "u1", "exp": time.time() - 1})
+
+    assert cache.get("token") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TokenCache(maxsize=2)
+    cache.put("a", {"sub": "a"})
+    cache.put("b", {"sub": "b"})
+    cache.get("a")
+    cache.put("c", {"sub": "c"})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"sub": "a"}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_peek_leaves_counters_and_order_alone():
+    cache = TokenCache(maxsize=2)
+    cache.put("a", {"sub": "a"})
+    cache.put("b", {"sub": "b"})
+
+    assert cache.peek("a") == {"sub": "a"}
+    assert cache.peek("missing") is None
+    cache.put("c", {"sub": "c"})
+
+    # "a" stayed least recently used.
+    assert cache.peek("a") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (0, 0)
@@ -0,0 +1,63 @@
+"""
+Bet transitions: a transition of a bet that has already moved on fails.
+
+The HTTP tests replay accept, decline and resolve on bets that are no
+longer pending or active; the race test runs a small instance of
+`bench.transition_race`, which races all three on the same bets.
+"""
+
+import asyncio
+
+from bench.settlement_stress import populate
+from bench.transition_race import race
+
+
+def _create_bet(client, headers) -> int:
+    response = client.post(
+        "/bets",
+        json={"description": "test", "wager": 10, "opponent_id": "bob"},
+        headers=headers("alice"),
+    )
+    assert response.status_code == 201
+    return response.json()["id"]
+
+
+def test_stale_accept_and_decline_conflict(client, auth_headers):
+    bet_id = _create_bet(client, auth_headers)
+    response = client.put(f"/bets/{bet_id}/accept", headers=auth_headers("bob"))
+    assert response.status_code == 200
+    assert response.json()["status"] == "active"
+
+    for action in ("accept", "decline"):
+        response = client.put(f"/bets/{bet_id}/{action}", headers=auth_headers("bob"))
+        assert response.status_code == 409, action
+
+
+def test_transitions_of_declined_bet_conflict(client, auth_headers):
+    bet_id = _create_bet(client, auth_headers)
+    assert client.put(f"/bets/{bet_id}/decline", headers=auth_headers("bob")).status_code == 200
+
+    assert client.put(f"/bets/{bet_id}/accept", headers=auth_headers("bob")).status_code == 409
+    response = client.put(
+        f"/bets/{bet_id}/resolve",
+        params={"winner_id": "alice", "result": "done"},
+        headers=auth_headers("alice"),
+    )
+    assert response.status_code == 409
+
+
+def _race(tmp_path, naive: bool) -> dict:
+    path = str(tmp_path / "race.db")
+    populate(path, users=10, bets=60, seed=1)
+    return asyncio.run(race(path, tasks=4, seed=1, naive=naive))
+
+
+def test_concurrent_transitions_succeed_once_per_bet(tmp_path):
+    assert _race(tmp_path, naive=False)["failures"] == []
+
+
+def test_read_check_write_transitions_are_caught(tmp_path):
+    # Without compare-and-set, concurrent transitions of a bet all
+    # succeed (or fail on SQLite's lock): the race must notice.
+    assert _race(tmp_path, naive=True)["failures"]
+